@@ -1,23 +1,198 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query, Request
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
 import shutil
 import uuid
 import json
-from datetime import datetime
-from main import full_converter, No_ai_converter
+from datetime import datetime, timezone
+from src.jobqueue import JobQueue, QueueFullError
+from src.convcache import (ConversionCache, options_fingerprint, page_options, cache_key,
+                           PAGE_CACHE_ROOT, MAX_PAGE_CACHE_BYTES)
+from src.formulacache import FormulaCache
+from src.llmcache import LLMResponseCache
+from src.pagerange import parse_page_range, page_fingerprints, INCREMENTAL_PAGES
+from src.imageoutput import ImageOutputPolicy, render_page
+from src.historystore import HistoryStore
+from src.workspacegc import WorkspaceManager
+import asyncio
+import hashlib
+import re
 import subprocess
 import os
 import mimetypes
 import logging
+import gzip
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import quote
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is always offered
+    brotli = None
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
+# Largest request body accepted; enforced while the upload streams in.
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(200 * 1024 ** 2)))
+# Block size for copying (and hashing) uploads to disk.
+UPLOAD_CHUNK_BYTES = 1024 ** 2
+# PDF readers accept the header anywhere in the first KiB of the file.
+PDF_MAGIC = b"%PDF-"
+PDF_MAGIC_WINDOW = 1024
+# Routes whose multipart file part must be a PDF.
+PDF_UPLOAD_PATHS = frozenset({"/convert", "/convert_raw", "/convert_stream", "/jobs"})
+# Most of a request body read looking for the start of the file part.
+UPLOAD_PREAMBLE_BYTES = 64 * 1024
+MULTIPART_BOUNDARY_RE = re.compile(r'boundary="?([^";]+)"?', re.IGNORECASE)
+MULTIPART_FILENAME_RE = re.compile(rb'filename\*?=', re.IGNORECASE)
+NO_FILE_PART = object()
+
+
+async def send_json_error(send, status_code: int, detail: str):
+    """Answer an ASGI request with a JSON error and close the connection."""
+    body = json.dumps({"detail": detail}).encode("utf-8")
+    await send({"type": "http.response.start", "status": status_code,
+                "headers": [(b"content-type", b"application/json"),
+                            (b"content-length", str(len(body)).encode()),
+                            (b"connection", b"close")]})
+    await send({"type": "http.response.body", "body": body})
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Answers 413 to request bodies larger than `max_bytes`: straight away when
+    Content-Length says so, otherwise as soon as the streamed body passes the
+    limit, so the multipart parser never spools an oversized upload to disk.
+    """
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        too_large = HTTPException(status_code=413, detail=f"Upload exceeds {self.max_bytes} bytes.")
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > self.max_bytes:
+            return await self._reject(send, too_large)
+
+        received = 0
+        started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # FastAPI passes HTTPExceptions raised while parsing the form through unchanged.
+                    raise too_large
+            return message
+
+        async def tracked_send(message):
+            nonlocal started
+            started = started or message["type"] == "http.response.start"
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracked_send)
+        except HTTPException as e:
+            if e is not too_large or started:
+                raise
+            await self._reject(send, too_large)
+
+    @staticmethod
+    async def _reject(send, error: HTTPException):
+        await send_json_error(send, error.status_code, error.detail)
+
+
+def first_file_part(body: bytes, boundary: bytes, window: int):
+    """
+    Up to `window` leading bytes of the first file part in the start of a
+    multipart body; NO_FILE_PART if the form has none, or None while `body`
+    is too short to tell.
+    """
+    delimiter = b"--" + boundary
+    pos = 0
+    while True:
+        start = body.find(delimiter, pos)
+        if start == -1 or len(body) < start + len(delimiter) + 2:
+            return None
+        if body[start + len(delimiter):start + len(delimiter) + 2] == b"--":
+            return NO_FILE_PART
+        header_end = body.find(b"\r\n\r\n", start)
+        if header_end == -1:
+            return None
+        content_start = header_end + 4
+        if MULTIPART_FILENAME_RE.search(body[start:header_end]):
+            end = body.find(b"\r\n" + delimiter, content_start)
+            content = body[content_start:end if end != -1 else len(body)]
+            if end == -1 and len(content) < window:
+                return None
+            return content[:window]
+        pos = content_start
+
+
+class UploadMagicMiddleware:
+    """
+    Answers 415 to uploads on `paths` whose first file part does not carry
+    `magic` within its first `window` bytes. Only the start of the raw
+    request stream is read (at most `max_preamble` bytes, then replayed to
+    the app), so a body of the wrong type is refused before the multipart
+    parser spools it to disk. Anything it cannot decide on is passed through.
+    """
+
+    def __init__(self, app, paths, magic: bytes = PDF_MAGIC, window: int = PDF_MAGIC_WINDOW,
+                 max_preamble: int = UPLOAD_PREAMBLE_BYTES):
+        self.app = app
+        self.paths = frozenset(paths)
+        self.magic = magic
+        self.window = window
+        self.max_preamble = max_preamble
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            return await self.app(scope, receive, send)
+        content_type = dict(scope["headers"]).get(b"content-type", b"").decode("latin-1")
+        boundary = MULTIPART_BOUNDARY_RE.search(content_type)
+        if not content_type.lower().startswith("multipart/form-data") or boundary is None:
+            return await self.app(scope, receive, send)
+
+        buffered = []
+        head = b""
+        prefix = None
+        while prefix is None and len(head) <= self.max_preamble:
+            message = await receive()
+            buffered.append(message)
+            if message["type"] != "http.request":
+                break
+            head += message.get("body", b"")
+            prefix = first_file_part(head, boundary.group(1).encode("latin-1"), self.window)
+            if not message.get("more_body", False):
+                break
+        if isinstance(prefix, bytes) and self.magic not in prefix:
+            return await send_json_error(send, 415, "The upload is not a valid file of this type.")
+
+        async def replay_receive():
+            if buffered:
+                return buffered.pop(0)
+            return await receive()
+
+        await self.app(scope, replay_receive, send)
+
+
 app = FastAPI(title="PDF → Markdown Converter API")
 
+app.add_middleware(UploadMagicMiddleware, paths=PDF_UPLOAD_PATHS)
+app.add_middleware(UploadSizeLimitMiddleware, max_bytes=MAX_UPLOAD_BYTES)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -31,112 +206,483 @@ TEMP_ROOT.mkdir(exist_ok=True)
 
 HISTORY_FILE = Path("History/history.json")
 HISTORY_FILE.parent.mkdir(exist_ok=True)
+# Largest page /history returns when a limit is given; without one it returns everything.
+MAX_HISTORY_PAGE = 1000
 
 FRONTEND_BUILD_DIR = Path(__file__).parent / "Frontend" / "dist"
 
 STATIC_DIR = Path(__file__).parent / "static"
 STATIC_DIR.mkdir(exist_ok=True)
 
-def load_history():
-    if HISTORY_FILE.exists():
-        with open(HISTORY_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return []
-
-
-def save_history(history):
-    with open(HISTORY_FILE, "w", encoding="utf-8") as f:
-        json.dump(history, f, ensure_ascii=False, indent=2)
-
-# ----------------------------------------------------------
-# Routes
-# ----------------------------------------------------------
-@app.post("/convert", summary="Convert PDF to Markdown with image + formula analysis")
-async def convert_pdf_to_md(file: UploadFile = File(...), ocr: bool = Form(False)):
+# How often streaming clients are sent new progress events.
+EVENT_POLL_SECONDS = 0.25
+# Worker events can trail the job result slightly; wait this long for them.
+EVENT_DRAIN_GRACE_SECONDS = 0.5
+# Share of an upload's pages that must already be cached before only the
+# remaining pages are converted.
+INCREMENTAL_MIN_REUSE = float(os.getenv("INCREMENTAL_MIN_REUSE", "0.5"))
+# Bodies smaller than this are sent uncompressed.
+COMPRESS_MIN_BYTES = 1024
+# Compressed Markdown/JSON kept in memory so repeat views are not recompressed.
+MAX_COMPRESSED_CACHE_BYTES = 64 * 1024 ** 2
+# Browsers keep served files but revalidate them; an unchanged file costs a 304.
+FILE_CACHE_CONTROL = "no-cache"
+
+job_queue = JobQueue()
+# Expires, deduplicates and caps temp_sessions/ (and temp/) in the background.
+workspaces = WorkspaceManager(in_use=job_queue.active_workspaces)
+conversion_cache = ConversionCache()
+page_cache = ConversionCache(root=PAGE_CACHE_ROOT, max_bytes=MAX_PAGE_CACHE_BYTES)
+formula_cache = FormulaCache(warm_start=False)
+llm_cache = LLMResponseCache()
+# Imports History/history.json on first start.
+history_store = HistoryStore(legacy_json=HISTORY_FILE)
+
+
+@app.on_event("startup")
+def start_job_queue():
+    # Worker processes load the Docling models as they start, so the first
+    # upload does not pay for model initialisation.
+    job_queue.start()
+    workspaces.start()
+
+
+@app.on_event("shutdown")
+def stop_job_queue():
+    workspaces.stop()
+    job_queue.shutdown()
+
+
+def append_history(entry):
+    history_store.append(entry)
+
+
+def save_upload(file: UploadFile, destination: Path, magic: bytes = None, magic_window: int = PDF_MAGIC_WINDOW) -> str:
+    """
+    Copy an upload to `destination` in UPLOAD_CHUNK_BYTES blocks and return
+    its SHA-256, computed in the same pass. The first block is checked for
+    `magic` before `destination` is created (415 if missing), and the copy
+    stops with 413 past MAX_UPLOAD_BYTES; no copy is left for a refused
+    upload. By now the form parser has already spooled the body, so
+    PDF routes are screened earlier by UploadMagicMiddleware.
+    """
+    try:
+        chunk = file.file.read(UPLOAD_CHUNK_BYTES)
+        if magic is not None and magic not in chunk[:magic_window]:
+            raise HTTPException(status_code=415, detail="The upload is not a valid file of this type.")
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        sha256 = hashlib.sha256()
+        size = 0
+        try:
+            with open(destination, "wb") as f:
+                while chunk:
+                    size += len(chunk)
+                    if size > MAX_UPLOAD_BYTES:
+                        raise HTTPException(status_code=413, detail=f"Upload exceeds {MAX_UPLOAD_BYTES} bytes.")
+                    sha256.update(chunk)
+                    f.write(chunk)
+                    chunk = file.file.read(UPLOAD_CHUNK_BYTES)
+        except BaseException:
+            destination.unlink(missing_ok=True)
+            raise
+    finally:
+        file.file.close()
+    return sha256.hexdigest()
+
+
+class CompressedBodies:
+    """Compressed response bodies by (key, encoding); least recently used are dropped first."""
+
+    def __init__(self, max_bytes: int = MAX_COMPRESSED_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._bodies = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple, encoding: str, load) -> bytes:
+        """Compressed form of `load()`, computed once per key and encoding."""
+        with self._lock:
+            body = self._bodies.get((key, encoding))
+            if body is not None:
+                self._bodies.move_to_end((key, encoding))
+                return body
+        data = load()
+        body = brotli.compress(data, quality=9) if encoding == "br" else gzip.compress(data, compresslevel=6)
+        with self._lock:
+            if (key, encoding) not in self._bodies and len(body) <= self.max_bytes:
+                self._bodies[(key, encoding)] = body
+                self._size += len(body)
+                while self._size > self.max_bytes:
+                    _, dropped = self._bodies.popitem(last=False)
+                    self._size -= len(dropped)
+        return body
+
+
+compressed_bodies = CompressedBodies()
+
+
+def negotiate_encoding(request: Request):
+    """'br' or 'gzip' if the client accepts it (br only when brotli is installed), else None."""
+    accepted = {}
+    for part in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = part.partition(";")
+        params = params.strip()
+        try:
+            quality = float(params[2:]) if params.startswith("q=") else 1.0
+        except ValueError:
+            quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in ("br", "gzip") if brotli is not None else ("gzip",):
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def not_modified(request: Request, etag: str, mtime: float) -> bool:
+    """Whether a conditional GET can be answered with 304. If-None-Match takes precedence."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if not if_modified_since:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return int(mtime) <= since.timestamp()
+
+
+def validated_body(request: Request, key: tuple, validator: str, mtime: float, media_type: str,
+                   load, headers: dict = None) -> Response:
+    """
+    Response for a body that only changes with `validator`: 304 when the
+    client already has it, otherwise `load()`, compressed if the client
+    accepts it. Each encoding gets its own ETag.
+    """
+    headers = {"Cache-Control": FILE_CACHE_CONTROL, "Vary": "Accept-Encoding",
+               "Last-Modified": formatdate(mtime, usegmt=True), **(headers or {})}
+    encoding = negotiate_encoding(request)
+    etag = f'"{validator}-{encoding}"' if encoding else f'"{validator}"'
+    headers["ETag"] = etag
+    if not_modified(request, etag, mtime):
+        return Response(status_code=304, headers=headers)
+
+    if encoding is None:
+        return Response(load(), media_type=media_type, headers=headers)
+    body = compressed_bodies.get(key + (validator,), encoding, load)
+    return Response(body, media_type=media_type, headers=headers | {"Content-Encoding": encoding})
+
+
+def serve_file(request: Request, path: Path, media_type: str, filename: str = None,
+               compress: bool = False) -> Response:
+    """
+    Serve a file inline with a strong ETag and Last-Modified taken from its
+    stat, answering matching conditional GETs with 304. Byte ranges are left
+    to FileResponse, so PDF viewers can fetch pages as they need them. With
+    `compress`, whole-file requests are gzip/brotli encoded when accepted.
+    """
+    stat = path.stat()
+    validator = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+    workspaces.touch(path)
+    disposition = f"inline; filename*=utf-8''{quote(filename or path.name)}"
+    if compress and "range" not in request.headers and stat.st_size >= COMPRESS_MIN_BYTES:
+        return validated_body(request, (str(path),), validator, stat.st_mtime, media_type, path.read_bytes,
+                              headers={"Content-Disposition": disposition})
+
+    etag = f'"{validator}"'
+    headers = {"Cache-Control": FILE_CACHE_CONTROL, "ETag": etag,
+               "Last-Modified": formatdate(stat.st_mtime, usegmt=True)}
+    if compress:
+        headers["Vary"] = "Accept-Encoding"
+    if not_modified(request, etag, stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path=path, media_type=media_type, filename=filename or path.name, headers=headers,
+                        stat_result=stat, content_disposition_type="inline")
+
+
+def page_cache_keys(pdf_path: Path, options: dict):
+    """Page cache key of every page of the PDF, or None if it cannot be fingerprinted."""
+    if not INCREMENTAL_PAGES:
+        return None
+    try:
+        return [cache_key(fingerprint, page_options(options)) for fingerprint in page_fingerprints(pdf_path)]
+    except Exception as e:
+        log.warning(f"Could not fingerprint the pages of {pdf_path}: {e}")
+        return None
+
+
+def restore_cached_pages(page_keys: list, session_dir: Path) -> dict:
+    """
+    Markdown (as it was before the LLM rewrite) of the upload's pages that
+    are already cached, with their images copied into the session, if enough
+    of them are to make a partial conversion worthwhile; otherwise {}.
+    """
+    if not page_keys:
+        return {}
+    cached = [page_no for page_no, key in enumerate(page_keys, 1) if page_cache.has(key)]
+    if not cached or len(cached) < INCREMENTAL_MIN_REUSE * len(page_keys):
+        return {}
+    reused = {}
+    for page_no in cached:
+        # Links come back as session paths, like restore() and freshly converted pages.
+        text = page_cache.restore_text(page_keys[page_no - 1], session_dir / "images" / f"page-{page_no}")
+        if text is not None:  # evicted in the meantime: convert it again
+            reused[page_no] = text
+    return reused
+
+
+def store_converted_pages(page_keys: list, session_dir: Path, reused: dict, options: dict):
+    """Cache the Markdown of every page the worker converted, as it was before the LLM rewrite."""
+    page_file = session_dir / "page_markdown.json"
+    if not page_keys or not page_file.exists():
+        return
+    with open(page_file, "r", encoding="utf-8") as f:
+        converted = json.load(f)
+    for page_no, text in converted.items():
+        page_no = int(page_no)
+        if page_no not in reused and page_no <= len(page_keys):
+            page_cache.store_text(page_keys[page_no - 1], text, session_dir, page_options(options))
+
+
+def submit_conversion(file: UploadFile, ocr: bool, kind: str, pages: str = None) -> str:
+    """
+    Store the upload in a fresh session folder and queue its conversion,
+    or restore it straight from the conversion cache when it was seen before.
+    `pages` ("12-40", "7") limits the conversion to part of the document.
+    """
     if not file.filename.lower().endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Only PDF files are supported.")
+    try:
+        page_range = parse_page_range(pages)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     session_id = uuid.uuid4().hex
     temp_dir = TEMP_ROOT / session_id
-    temp_dir.mkdir(parents=True, exist_ok=True)
 
     input_pdf_path = temp_dir / file.filename
     output_md_path = temp_dir / f"{Path(file.filename).stem}.md"
 
     try:
-        with open(input_pdf_path, "wb") as f:
-            shutil.copyfileobj(file.file, f)
+        pdf_sha256 = save_upload(file, input_pdf_path, magic=PDF_MAGIC)
+    except HTTPException:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+    workspaces.touch(temp_dir)
+    options = options_fingerprint(ocr, kind, pages=page_range)
+    key = cache_key(pdf_sha256, options)
+    history_entry = {
+        "session_id": session_id,
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "input_pdf": str(input_pdf_path),
+        "output_md": str(output_md_path),
+        "filename": file.filename,
+        "ocr": bool(ocr),
+        "sha256": pdf_sha256,
+        "pages": list(page_range) if page_range else None,
+    }
+    meta = {"session_id": session_id, "filename": file.filename, "cache_key": key}
+
+    if conversion_cache.restore(key, output_md_path):
+        append_history(history_entry)
+        return job_queue.add_completed(kind, str(output_md_path), str(temp_dir),
+                                       meta={**meta, "cached": True})
+
+    # Pages seen before (e.g. a re-upload with one corrected slide) are
+    # spliced in from the page cache; only the others are converted.
+    page_keys = page_cache_keys(input_pdf_path, options)
+    reused = restore_cached_pages(page_keys, temp_dir) if not page_range else {}
+
+    def record(job):
+        workspaces.touch(temp_dir)
+        if output_md_path.exists():
+            append_history(history_entry)
+            conversion_cache.store(key, output_md_path, options)
+            store_converted_pages(page_keys, temp_dir, reused, options)
 
-        full_converter(str(input_pdf_path), str(output_md_path), bool(ocr))
+    try:
+        return job_queue.submit(
+            kind, str(input_pdf_path), str(output_md_path), bool(ocr),
+            workspace=str(temp_dir),
+            meta={**meta, "cached": False, "reused_pages": len(reused)},
+            on_done=record,
+            pages=page_range,
+            reuse_pages=reused or None,
+        )
+    except QueueFullError as e:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise HTTPException(status_code=429, detail=f"Server busy, try again later: {e}")
+    except ValueError as e:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise HTTPException(status_code=400, detail=str(e))
 
-        if output_md_path.exists():
-            history = load_history()
-            history_entry = {
-                "session_id": session_id,
-                "timestamp": datetime.utcnow().isoformat() + "Z",
-                "input_pdf": str(input_pdf_path),
-                "output_md": str(output_md_path),
-                "filename": file.filename,
-                "ocr": bool(ocr),
-            }
-            history.append(history_entry)
-            save_history(history)
 
-            return FileResponse(
-                path=output_md_path,
-                filename=output_md_path.name,
-                media_type="text/markdown",
-            )
-        else:
-            raise HTTPException(status_code=500, detail="Markdown output not found.")
+async def wait_for_markdown(job_id: str) -> FileResponse:
+    try:
+        await asyncio.wrap_future(job_queue.future(job_id))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Conversion failed: {e}")
-    finally:
-        file.file.close()
-
 
-@app.post("/convert_raw", summary="Convert PDF to Markdown without summarisation")
-async def convert_pdf_to_md_raw(file: UploadFile = File(...), ocr: bool = Form(False)):
-    if not file.filename.lower().endswith(".pdf"):
-        raise HTTPException(status_code=400, detail="Only PDF files are supported.")
-
-    session_id = uuid.uuid4().hex
-    temp_dir = TEMP_ROOT / session_id
-    temp_dir.mkdir(parents=True, exist_ok=True)
+    output_md_path = Path(job_queue.get(job_id)["output_md"])
+    if not output_md_path.exists():
+        raise HTTPException(status_code=500, detail="Markdown output not found.")
+    return FileResponse(
+        path=output_md_path,
+        filename=output_md_path.name,
+        media_type="text/markdown",
+    )
 
-    input_pdf_path = temp_dir / file.filename
-    output_md_path = temp_dir / f"{Path(file.filename).stem}.md"
+def ndjson(event: dict) -> bytes:
+    return (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+async def stream_job_events(job_id: str, since: int = 0):
+    """
+    Yield a job's progress as NDJSON lines: stage events, intermediate
+    Markdown snapshots and rewritten chunks, then a final "done" line with
+    the finished Markdown (or an "error" line). A job pruned from the queue
+    while being followed ends the stream with a "gone" line.
+    """
+    gone = {"event": "gone", "job_id": job_id, "detail": f"Job {job_id} is no longer known."}
+    job = job_queue.get(job_id)
+    if job is None:
+        yield ndjson(gone)
+        return
+    yield ndjson({"event": "job", **job})
+    while True:
+        job = job_queue.get(job_id)
+        if job is None:
+            yield ndjson(gone)
+            return
+        finished = job["status"] in ("done", "failed")
+        if finished:
+            await asyncio.sleep(EVENT_DRAIN_GRACE_SECONDS)
+        progress = job_queue.events(job_id, since)
+        if progress is None:
+            yield ndjson(gone)
+            return
+        since, events = progress
+        for event in events:
+            yield ndjson(event)
+        if finished:
+            break
+        await asyncio.sleep(EVENT_POLL_SECONDS)
+
+    output_md_path = Path(job["output_md"])
+    if job["status"] == "failed":
+        yield ndjson({"event": "error", "detail": f"Conversion failed: {job['error']}"})
+    elif not output_md_path.exists():
+        yield ndjson({"event": "error", "detail": "Markdown output not found."})
+    else:
+        yield ndjson({
+            "event": "done",
+            "job_id": job_id,
+            "cached": job.get("cached", False),
+            "content": output_md_path.read_text(encoding="utf-8"),
+        })
 
-    try:
-        with open(input_pdf_path, "wb") as f:
-            shutil.copyfileobj(file.file, f)
+# ----------------------------------------------------------
+# Routes
+# ----------------------------------------------------------
+@app.post("/convert", summary="Convert PDF to Markdown with image + formula analysis")
+async def convert_pdf_to_md(file: UploadFile = File(...), ocr: bool = Form(False),
+                            pages: str = Form(None)):
+    job_id = await asyncio.to_thread(submit_conversion, file, ocr, "ai", pages)
+    return await wait_for_markdown(job_id)
 
-        No_ai_converter(str(input_pdf_path), str(output_md_path), bool(ocr))
 
-        if output_md_path.exists():
-            history = load_history()
-            history_entry = {
-                "session_id": session_id,
-                "timestamp": datetime.utcnow().isoformat() + "Z",
-                "input_pdf": str(input_pdf_path),
-                "output_md": str(output_md_path),
-                "filename": file.filename,
-                "ocr": bool(ocr),
-            }
-            history.append(history_entry)
-            save_history(history)
-
-            return FileResponse(
-                path=output_md_path,
-                filename=output_md_path.name,
-                media_type="text/markdown",
-            )
-        else:
-            raise HTTPException(status_code=500, detail="Markdown output not found.")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Conversion failed: {e}")
-    finally:
-        file.file.close()
+@app.post("/convert_raw", summary="Convert PDF to Markdown without summarisation")
+async def convert_pdf_to_md_raw(file: UploadFile = File(...), ocr: bool = Form(False),
+                                pages: str = Form(None)):
+    job_id = await asyncio.to_thread(submit_conversion, file, ocr, "raw", pages)
+    return await wait_for_markdown(job_id)
+
+
+@app.post("/convert_stream", summary="Convert PDF to Markdown, streaming progress as NDJSON")
+async def convert_pdf_to_md_stream(file: UploadFile = File(...), ocr: bool = Form(False),
+                                   use_ai: bool = Form(True), pages: str = Form(None)):
+    job_id = await asyncio.to_thread(submit_conversion, file, ocr, "ai" if use_ai else "raw", pages)
+    return StreamingResponse(stream_job_events(job_id), media_type="application/x-ndjson")
+
+
+@app.post("/jobs", status_code=202, summary="Queue a PDF conversion and return its job id")
+async def submit_job(file: UploadFile = File(...), ocr: bool = Form(False), use_ai: bool = Form(True),
+                     pages: str = Form(None)):
+    job_id = await asyncio.to_thread(submit_conversion, file, ocr, "ai" if use_ai else "raw", pages)
+    return JSONResponse(job_queue.get(job_id), status_code=202)
+
+
+@app.get("/jobs", summary="Conversion queue depth and worker count")
+def get_job_stats():
+    return JSONResponse(job_queue.stats())
+
+
+@app.get("/jobs/{job_id}", summary="Status of a queued conversion")
+def get_job(job_id: str):
+    job = job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    return JSONResponse(job)
+
+
+@app.get("/jobs/{job_id}/events", summary="Progress of a conversion, streamed as NDJSON")
+def get_job_events(job_id: str, since: int = Query(0, ge=0)):
+    if not job_queue.get(job_id):
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    return StreamingResponse(stream_job_events(job_id, since), media_type="application/x-ndjson")
+
+
+@app.get("/jobs/{job_id}/result", summary="Markdown produced by a finished conversion")
+def get_job_result(job_id: str, request: Request):
+    job = job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    if job["status"] == "failed":
+        raise HTTPException(status_code=500, detail=f"Conversion failed: {job['error']}")
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Job is still {job['status']}.")
+
+    output_md_path = Path(job["output_md"])
+    if not output_md_path.exists():
+        raise HTTPException(status_code=500, detail="Markdown output not found.")
+    return serve_file(request, output_md_path, "text/markdown", compress=True)
+
+
+@app.get("/sessions/{session_id}/markdown", summary="Converted Markdown of a session, served from disk")
+def get_session_markdown(session_id: str, request: Request):
+    if not re.fullmatch(r"[0-9a-f]{32}", session_id):
+        raise HTTPException(status_code=400, detail="Invalid session id.")
+    entry = next((e for e in reversed(history_store.by_session(session_id)) if e.get("output_md")), None)
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"No Markdown recorded for session {session_id}")
+    md_file = Path(entry["output_md"])
+    if not md_file.exists():
+        raise HTTPException(status_code=404, detail="Markdown file is missing on disk.")
+    return serve_file(request, md_file, "text/markdown", compress=True)
+
+
+@app.get("/sessions/{session_id}/pages/{page_no}", summary="Render one page of an uploaded PDF on demand")
+def get_page_image(session_id: str, page_no: int, scale: float = Query(2.0, gt=0, le=4)):
+    if not re.fullmatch(r"[0-9a-f]{32}", session_id):
+        raise HTTPException(status_code=400, detail="Invalid session id.")
+    session_dir = TEMP_ROOT / session_id
+    pdf_file = next(session_dir.glob("*.pdf"), None) if session_dir.is_dir() else None
+    if pdf_file is None:
+        raise HTTPException(status_code=404, detail=f"No PDF stored for session {session_id}")
+    workspaces.touch(session_dir)
+
+    policy = ImageOutputPolicy.from_env()
+    page_file = session_dir / "pages" / f"page-{page_no}@{scale:g}.{policy.extension}"
+    if not page_file.exists():
+        try:
+            page_file = render_page(pdf_file, page_no, page_file, scale=scale, policy=policy)
+        except ValueError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+    return FileResponse(path=page_file, media_type=mimetypes.guess_type(page_file.name)[0])
 
 
 @app.post("/convert_md_to_docx", summary="Convert Markdown to DOCX")
@@ -146,32 +692,32 @@ async def convert_md_to_docx(file: UploadFile = File(...)):
 
     session_id = uuid.uuid4().hex
     temp_dir = TEMP_ROOT / session_id
-    temp_dir.mkdir(parents=True, exist_ok=True)
 
     input_md_path = temp_dir / file.filename
     output_docx_path = temp_dir / f"{Path(file.filename).stem}.docx"
 
     try:
-        with open(input_md_path, "wb") as f:
-            shutil.copyfileobj(file.file, f)
+        await asyncio.to_thread(save_upload, file, input_md_path)
+    except HTTPException:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
 
-        subprocess.run(
+    try:
+        await asyncio.to_thread(
+            subprocess.run,
             ["pandoc", str(input_md_path), "-o", str(output_docx_path)],
             check=True,
         )
 
         if output_docx_path.exists():
-            history = load_history()
-            history_entry = {
+            append_history({
                 "session_id": session_id,
                 "timestamp": datetime.utcnow().isoformat() + "Z",
                 "input_md": str(input_md_path),
                 "output_docx": str(output_docx_path),
                 "filename": file.filename,
                 "type": "md_to_docx",
-            }
-            history.append(history_entry)
-            save_history(history)
+            })
 
             return FileResponse(
                 path=output_docx_path,
@@ -182,45 +728,138 @@ async def convert_md_to_docx(file: UploadFile = File(...)):
             raise HTTPException(status_code=500, detail="DOCX output not found.")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Conversion failed: {e}")
-    finally:
-        file.file.close()
 
 
-@app.get("/history", summary="Get conversion history")
-def get_history():
-    return JSONResponse(load_history())
+@app.get("/history", summary="Get conversion history, newest first")
+def get_history(limit: int = Query(None, ge=1, le=MAX_HISTORY_PAGE), offset: int = Query(0, ge=0)):
+    return JSONResponse(
+        history_store.entries(limit=limit, offset=offset),
+        headers={"X-Total-Count": str(history_store.count())},
+    )
 
 
-@app.get("/get_file", summary="Fetch specific converted file (MD + PDF)")
-def get_file(filename: str = Query(..., description="Original file name, e.g. 'SPASSIGN.pdf'")):
-    history = load_history()
-    entry = next((item for item in history if item["filename"].lower() == filename.lower()), None)
-    if not entry:
-        raise HTTPException(status_code=404, detail=f"No record found for {filename}")
+@app.get("/history/{session_id}", summary="History entries of one session")
+def get_history_session(session_id: str):
+    entries = history_store.by_session(session_id)
+    if not entries:
+        raise HTTPException(status_code=404, detail=f"No record found for session {session_id}")
+    return JSONResponse(entries)
 
-    md_path = entry.get("output_md")
-    pdf_path = entry.get("input_pdf")
 
-    if not md_path or not pdf_path:
-        raise HTTPException(status_code=500, detail="Missing Markdown or PDF path in record.")
+@app.get("/metrics/converter", summary="Docling model load time versus conversion time")
+def get_converter_metrics():
+    return JSONResponse({
+        pid: metrics["converter"] for pid, metrics in job_queue.worker_metrics().items()
+    })
 
-    md_file = Path(md_path)
-    pdf_file = Path(pdf_path)
 
-    if not (md_file.exists() and pdf_file.exists()):
-        raise HTTPException(status_code=404, detail="One or both files are missing on disk.")
+@app.get("/metrics/llm", summary="Per-backend LLM latency, error rate and circuit state per worker")
+def get_llm_metrics():
+    return JSONResponse({
+        pid: metrics.get("llm", {}) for pid, metrics in job_queue.worker_metrics().items()
+    })
 
-    with open(md_file, "r", encoding="utf-8") as f:
-        markdown_content = f.read()
 
+@app.get("/metrics/disk", summary="Disk used by conversion workspaces and caches, and collector counters")
+def get_disk_metrics():
     return JSONResponse({
-        "filename": filename,
-        "markdown_content": markdown_content,
-        "pdf_url": f"/download_pdf?path={pdf_path}"
+        "workspaces": workspaces.stats(),
+        "caches": {
+            "conversions_bytes": conversion_cache.stats()["bytes"],
+            "pages_bytes": page_cache.stats()["bytes"],
+        },
     })
 
-@app.get("/download_pdf", summary="Serve a PDF file directly")
-def download_pdf(path: str = Query(..., description="Full path to PDF file")):
+
+@app.post("/workspaces/gc", summary="Expire, deduplicate and trim conversion workspaces now")
+def collect_workspaces():
+    return JSONResponse(workspaces.collect())
+
+
+@app.get("/cache/stats", summary="Conversion cache hit/miss counters and size")
+def get_cache_stats():
+    return JSONResponse(conversion_cache.stats())
+
+
+@app.get("/cache/pages/stats", summary="Per-page cache hit/miss counters and size")
+def get_page_cache_stats():
+    return JSONResponse(page_cache.stats())
+
+
+@app.get("/cache/formulas/stats", summary="Formula LaTeX cache hit ratio across all workers")
+def get_formula_cache_stats():
+    return JSONResponse(formula_cache.stats())
+
+
+@app.get("/cache/llm/stats", summary="LLM response cache hit ratio across all workers")
+def get_llm_cache_stats():
+    return JSONResponse(llm_cache.stats())
+
+
+@app.delete("/cache/llm", summary="Drop every cached LLM response")
+def clear_llm_cache():
+    return JSONResponse({"removed": llm_cache.clear()})
+
+
+@app.delete("/cache", summary="Drop every cached conversion")
+def clear_cache():
+    return JSONResponse({"removed": conversion_cache.invalidate()})
+
+
+@app.delete("/cache/{key}", summary="Drop one cached conversion")
+def invalidate_cache_entry(key: str):
+    try:
+        removed = conversion_cache.invalidate(key)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not removed:
+        raise HTTPException(status_code=404, detail=f"No cached conversion for {key}")
+    return JSONResponse({"removed": removed})
+
+
+@app.get("/get_file", summary="Fetch specific converted file (MD + PDF)")
+def get_file(request: Request,
+             filename: str = Query(..., description="Original file name, e.g. 'SPASSIGN.pdf'")):
+    entries = history_store.by_filename(filename)
+    if not entries:
+        raise HTTPException(status_code=404, detail=f"No record found for {filename}")
+
+    recorded = [e for e in entries if e.get("output_md") and e.get("input_pdf")]
+    if not recorded:
+        raise HTTPException(status_code=500, detail="Missing Markdown or PDF path in record.")
+
+    # Newest conversion still on disk: the workspace collector may have removed older sessions.
+    entry = next((e for e in recorded if Path(e["output_md"]).exists() and Path(e["input_pdf"]).exists()), None)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="One or both files are missing on disk.")
+
+    md_path = entry["output_md"]
+    pdf_path = entry["input_pdf"]
+    md_file = Path(md_path)
+    workspaces.touch(md_file)
+
+    # The body only changes with the Markdown file and the record it came from.
+    md_stat = md_file.stat()
+    record = hashlib.sha256(f"{filename}\0{md_path}\0{pdf_path}".encode("utf-8")).hexdigest()[:16]
+    validator = f"{md_stat.st_mtime_ns:x}-{md_stat.st_size:x}-{record}"
+
+    def body() -> bytes:
+        with open(md_file, "r", encoding="utf-8") as f:
+            markdown_content = f.read()
+        response = {
+            "filename": filename,
+            "markdown_content": markdown_content,
+            "pdf_url": f"/download_pdf?path={pdf_path}",
+        }
+        if entry.get("session_id"):
+            response["markdown_url"] = f"/sessions/{entry['session_id']}/markdown"
+        return json.dumps(response, ensure_ascii=False).encode("utf-8")
+
+    return validated_body(request, ("get_file", filename.lower()), validator, md_stat.st_mtime,
+                          "application/json", body)
+
+@app.get("/download_pdf", summary="Serve a PDF file directly, with byte-range support")
+def download_pdf(request: Request, path: str = Query(..., description="Full path to PDF file")):
     pdf_file = Path(path)
     if not pdf_file.is_absolute():
         pdf_file = Path.cwd() / pdf_file
@@ -228,11 +867,7 @@ def download_pdf(path: str = Query(..., description="Full path to PDF file")):
     if not pdf_file.exists():
         raise HTTPException(status_code=404, detail=f"PDF file not found at {pdf_file}")
 
-    return FileResponse(
-        path=pdf_file,
-        filename=pdf_file.name,
-        media_type="application/pdf",
-    )
+    return serve_file(request, pdf_file, "application/pdf")
 
 app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 
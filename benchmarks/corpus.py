@@ -0,0 +1,164 @@
+"""
+Generated PDF fixtures for the benchmarks. Every document is built from a
+fixed seed, so the same corpus is produced on every machine.
+
+    python -m benchmarks.corpus out_dir
+"""
+import io
+import sys
+import random
+from pathlib import Path
+
+import fitz  # pymupdf
+import matplotlib
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 in points
+MARGIN = 56
+WORDS = (
+    "signal system energy model layer matrix vector gradient sample kernel "
+    "network variance estimate integral boundary sequence function transform "
+    "frequency process entropy channel response operator domain stable linear"
+).split()
+FORMULAS = [
+    r"$E = mc^2$",
+    r"$\int_0^\infty e^{-x^2}\,dx = \frac{\sqrt{\pi}}{2}$",
+    r"$\sum_{n=1}^{\infty} \frac{1}{n^2} = \frac{\pi^2}{6}$",
+    r"$\nabla \cdot \mathbf{E} = \frac{\rho}{\varepsilon_0}$",
+    r"$f(x) = \frac{1}{\sigma\sqrt{2\pi}} e^{-\frac{(x-\mu)^2}{2\sigma^2}}$",
+    r"$\mathbf{A}\mathbf{x} = \lambda \mathbf{x}$",
+]
+
+
+def _paragraph(rng: random.Random, words: int = 70) -> str:
+    text = " ".join(rng.choice(WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + "."
+
+
+def _png(fig) -> bytes:
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", dpi=150, bbox_inches="tight")
+    plt.close(fig)
+    return buffer.getvalue()
+
+
+def _formula_png(latex: str) -> bytes:
+    fig = plt.figure(figsize=(4, 0.6))
+    fig.text(0.5, 0.5, latex, fontsize=16, ha="center", va="center")
+    return _png(fig)
+
+
+def _chart_png(rng: random.Random, kind: str) -> bytes:
+    fig, ax = plt.subplots(figsize=(4, 2.6))
+    values = [rng.randint(2, 20) for _ in range(6)]
+    if kind == "bar":
+        ax.bar(range(len(values)), values)
+    else:
+        ax.plot(range(len(values)), values, marker="o")
+    ax.set_title(f"{kind.title()} chart of {rng.choice(WORDS)}")
+    return _png(fig)
+
+
+def _logo_png() -> bytes:
+    fig = plt.figure(figsize=(0.8, 0.8))
+    fig.add_artist(plt.Circle((0.5, 0.5), 0.4, color="tab:blue", transform=fig.transFigure))
+    return _png(fig)
+
+
+def _write_text(page, rng: random.Random, y: float, paragraphs: int, heading: str = None) -> float:
+    if heading:
+        page.insert_text((MARGIN, y), heading, fontsize=16, fontname="helv")
+        y += 28
+    for _ in range(paragraphs):
+        rect = fitz.Rect(MARGIN, y, PAGE_WIDTH - MARGIN, y + 120)
+        page.insert_textbox(rect, _paragraph(rng), fontsize=10, fontname="helv")
+        y += 110
+    return y
+
+
+def text_pdf(path: Path, pages: int = 10, seed: int = 1):
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for n in range(pages):
+        page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        _write_text(page, rng, MARGIN + 20, 6, heading=f"{n + 1}. Section on {rng.choice(WORDS)}")
+    doc.save(str(path))
+
+
+def formula_pdf(path: Path, pages: int = 6, seed: int = 2):
+    rng = random.Random(seed)
+    doc = fitz.open()
+    images = [_formula_png(latex) for latex in FORMULAS]
+    for n in range(pages):
+        page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        y = _write_text(page, rng, MARGIN + 20, 1, heading=f"{n + 1}. Derivation")
+        for _ in range(4):
+            page.insert_image(fitz.Rect(MARGIN + 60, y, PAGE_WIDTH - MARGIN - 60, y + 50),
+                              stream=rng.choice(images))
+            y = _write_text(page, rng, y + 70, 1)
+    doc.save(str(path))
+
+
+def image_pdf(path: Path, pages: int = 6, seed: int = 3):
+    rng = random.Random(seed)
+    doc = fitz.open()
+    logo = _logo_png()
+    for n in range(pages):
+        page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        # The same small logo on every page, as in slide decks.
+        page.insert_image(fitz.Rect(PAGE_WIDTH - MARGIN - 30, 20, PAGE_WIDTH - MARGIN, 50), stream=logo)
+        y = _write_text(page, rng, MARGIN + 20, 1, heading=f"{n + 1}. Results")
+        for kind in ("bar", "line"):
+            page.insert_image(fitz.Rect(MARGIN, y, PAGE_WIDTH - MARGIN, y + 250), stream=_chart_png(rng, kind))
+            y += 270
+    doc.save(str(path))
+
+
+def scanned_pdf(path: Path, pages: int = 4, seed: int = 4, dpi: int = 150):
+    """Text pages rasterised to images, so only OCR can recover the text."""
+    source = fitz.open()
+    text_rng = random.Random(seed)
+    for n in range(pages):
+        page = source.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        _write_text(page, text_rng, MARGIN + 20, 6, heading=f"{n + 1}. Scanned notes")
+    doc = fitz.open()
+    for page in source:
+        pixmap = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+        scanned = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        scanned.insert_image(scanned.rect, stream=pixmap.tobytes("png"))
+    doc.save(str(path))
+
+
+def long_pdf(path: Path, pages: int = 120, seed: int = 5):
+    text_pdf(path, pages=pages, seed=seed)
+
+
+# name -> (builder, convert with OCR)
+CORPUS = {
+    "text": (text_pdf, False),
+    "formulas": (formula_pdf, False),
+    "images": (image_pdf, False),
+    "scanned": (scanned_pdf, True),
+    "long": (long_pdf, False),
+}
+
+
+def build_corpus(out_dir: Path, names=None) -> dict:
+    """Write the fixtures to `out_dir`; returns {name: (pdf path, ocr)}."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    corpus = {}
+    for name in names or CORPUS:
+        builder, ocr = CORPUS[name]
+        path = out_dir / f"{name}.pdf"
+        if not path.exists():
+            builder(path)
+        corpus[name] = (path, ocr)
+    return corpus
+
+
+if __name__ == "__main__":
+    for name, (path, _) in build_corpus(Path(sys.argv[1] if len(sys.argv) > 1 else "bench_corpus")).items():
+        print(f"{name}: {path}")
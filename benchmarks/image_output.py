@@ -0,0 +1,63 @@
+"""
+Docling conversion time and bytes written per image-output policy.
+
+    python -m benchmarks.image_output path/to/book.pdf [--ocr] [--runs 3]
+
+"legacy" reproduces the old behaviour (a PNG per page and per table at
+zlib level 6); the other rows are the policies available through
+SAVE_PAGE_IMAGES / SAVE_TABLE_IMAGES / IMAGE_FORMAT.
+"""
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.pdftomd import convert, get_converter
+from src.imageoutput import ImageOutputPolicy
+
+POLICIES = {
+    "legacy": ImageOutputPolicy(page_images=True, table_images=True, compress_level=6),
+    "referenced-png": ImageOutputPolicy(),
+    "referenced-webp": ImageOutputPolicy(image_format="webp"),
+    "referenced-jpeg": ImageOutputPolicy(image_format="jpeg"),
+}
+
+
+def bytes_written(folder: Path) -> tuple:
+    files = [f for f in folder.rglob("*") if f.is_file()]
+    return len(files), sum(f.stat().st_size for f in files)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdf", type=Path)
+    parser.add_argument("--ocr", action="store_true")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    # Load both converter variants up front so model loading is not timed.
+    get_converter(ocr=args.ocr, page_images=True)
+    get_converter(ocr=args.ocr, page_images=False)
+
+    print(f"{'policy':<18}{'seconds':>10}{'files':>8}{'MiB':>10}")
+    for name, policy in POLICIES.items():
+        timings = []
+        for _ in range(args.runs):
+            output_dir = Path(tempfile.mkdtemp(prefix=f"bench-{name}-"))
+            try:
+                start_time = time.perf_counter()
+                convert(args.pdf, output_dir, args.ocr, image_policy=policy)
+                timings.append(time.perf_counter() - start_time)
+                files, size = bytes_written(output_dir)
+            finally:
+                shutil.rmtree(output_dir, ignore_errors=True)
+        timings.sort()
+        print(f"{name:<18}{timings[len(timings) // 2]:>10.2f}{files:>8}{size / 1024 ** 2:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+local_clean / restore_math_blocks throughput against the step-by-step
+versions they replace, plus an identity check on a golden corpus.
+
+    python -m benchmarks.markdown_clean --sizes 1,4,16 --runs 3
+    python -m benchmarks.markdown_clean --check-only notes/*.md
+
+The corpus is generated from fixed seeds (headings, duplicated lines and
+sections, placeholder lines, Windows image paths, math, blank runs); any
+Markdown files given on the command line are checked as well. The script
+exits with status 1 if any output differs from the reference.
+"""
+import re
+import sys
+import time
+import random
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.notesconverter import (
+    normalize_image_paths, remove_placeholder_lines, collapse_consecutive_duplicates,
+    dedupe_adjacent_identical_sections, preserve_math_blocks, preserve_image_links,
+    local_clean, restore_math_blocks,
+)
+
+WORDS = (
+    "signal system energy model layer matrix vector gradient sample kernel "
+    "network variance estimate integral boundary sequence function transform"
+).split()
+ODD_LINES = ["Screenshot", "  other ", "Bar chart", "image", "temp\\temp", "CHART", "#", "##", "###",
+             "####### seven", "  ", "\t", "", "", "---", "> quote", "* item", "#hashtag"]
+
+
+def reference_local_clean(md_text: str) -> str:
+    md_text = normalize_image_paths(md_text)
+    md_text = remove_placeholder_lines(md_text)
+    md_text = collapse_consecutive_duplicates(md_text)
+    md_text = dedupe_adjacent_identical_sections(md_text)
+    md_text = re.sub(r'\n{3,}', '\n\n', md_text)
+    md_text = "\n".join([ln.rstrip() for ln in md_text.splitlines()])
+    return md_text.strip() + "\n"
+
+
+def reference_restore(md: str, token_map: dict) -> str:
+    for token, math in token_map.items():
+        md = md.replace(token, math)
+    return md
+
+
+def _line(rng: random.Random) -> str:
+    roll = rng.random()
+    if roll < 0.08:
+        return f"{'#' * rng.randint(1, 4)} {rng.choice(WORDS).title()} {rng.randint(1, 5)}"
+    if roll < 0.14:
+        return rng.choice(ODD_LINES)
+    if roll < 0.20:
+        return f"![{rng.choice(WORDS)}](images\\fig_{rng.randint(1, 99)}.png)"
+    if roll < 0.23:
+        return f"[Image](pics\\{rng.choice(WORDS)}.png)"
+    if roll < 0.28:
+        return f"$$\n\\sum_{{i={rng.randint(0, 3)}}} x_i^{rng.randint(2, 4)}\n$$"
+    words = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 25)))
+    if roll < 0.40:
+        words += f" with $x_{rng.randint(0, 9)}$ inline"
+    return words + " " * rng.randint(0, 2)
+
+
+def generate_markdown(size: int, seed: int) -> str:
+    """About `size` characters of lecture-note-like Markdown with the usual Docling noise."""
+    rng = random.Random(seed)
+    blocks = []
+    total = 0
+    while total < size:
+        block = "\n".join(_line(rng) for _ in range(rng.randint(1, 8)))
+        roll = rng.random()
+        if roll < 0.1 and blocks:
+            block = blocks[-1]  # repeated line / section
+        elif roll < 0.15 and blocks:
+            block = rng.choice(blocks[-20:])
+        blocks.append(block)
+        total += len(block)
+        blocks.append("\n" * rng.choice((1, 1, 2, 2, 3, 4)))
+    return "".join(blocks)
+
+
+def clean_and_restore(md: str, clean, restore) -> str:
+    """The local part of rewrite_markdown: mask, clean, restore math and images."""
+    masked, token_map = preserve_math_blocks(md)
+    cleaned = clean(masked)
+    with_images, image_map = preserve_image_links(cleaned)
+    token_map.update(image_map)
+    return restore(with_images, token_map)
+
+
+def check(name: str, md: str) -> bool:
+    if clean_and_restore(md, local_clean, restore_math_blocks) == clean_and_restore(
+            md, reference_local_clean, reference_restore):
+        return True
+    print(f"MISMATCH {name}", file=sys.stderr)
+    return False
+
+
+def timed(fn, *args, runs: int) -> float:
+    best = float("inf")
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", type=Path, help="Extra Markdown files for the identity check.")
+    parser.add_argument("--sizes", default="1,4,16", help="Generated document sizes in MB.")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--seeds", type=int, default=200, help="Small generated documents to check.")
+    parser.add_argument("--check-only", action="store_true")
+    args = parser.parse_args()
+
+    ok = all([check(f"seed {seed}", generate_markdown(random.Random(seed).randint(0, 4000), seed))
+              for seed in range(args.seeds)])
+    ok = all([check(str(path), path.read_text(encoding="utf-8")) for path in args.files]) and ok
+    print(f"identity check: {'ok' if ok else 'FAILED'}")
+
+    if not args.check_only:
+        print(f"{'size':>6} {'step':>16} {'reference s':>12} {'single-pass s':>14} {'speedup':>8}")
+        for mb in (float(s) for s in args.sizes.split(",")):
+            md = generate_markdown(int(mb * 1024 ** 2), seed=int(mb * 1000))
+            ok = check(f"{mb:g} MB", md) and ok
+            masked, token_map = preserve_math_blocks(md)
+            for step, reference, current, step_args in (
+                ("local_clean", reference_local_clean, local_clean, (masked,)),
+                ("restore_math", reference_restore, restore_math_blocks, (masked, token_map)),
+            ):
+                before = timed(reference, *step_args, runs=args.runs)
+                after = timed(current, *step_args, runs=args.runs)
+                print(f"{mb:>5g}M {step:>16} {before:>12.3f} {after:>14.3f} {before / after:>7.1f}x")
+
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
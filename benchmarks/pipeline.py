@@ -0,0 +1,319 @@
+"""
+End-to-end pipeline benchmark over the generated corpus (benchmarks/corpus.py)
+with Gemini and the LLM backends replaced by local stubs.
+
+    python -m benchmarks.pipeline --runs 3 --output bench.json
+    python -m benchmarks.pipeline --baseline benchmarks/baseline.json
+    python -m benchmarks.pipeline --save-baseline benchmarks/baseline.json
+    python -m benchmarks.pipeline --concurrency 8 --workers 4
+
+Reports per stage: wall time, CPU time (all threads of the process), peak RSS
+and bytes written, plus the size and SHA-256 of the final Markdown. With
+--baseline, exits with status 1 when a stage got slower or heavier than the
+tolerance allows, or when a document's output changed.
+
+With --concurrency N, every document is converted once serially, then N
+conversions (cycling over the corpus) are submitted to a JobQueue at once.
+Each concurrent output must be byte-identical to its serial run, otherwise
+the script exits with status 1. Serial and concurrent wall times are reported.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import platform
+import tempfile
+import threading
+from pathlib import Path
+from statistics import median
+from functools import partial
+
+import psutil
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+from benchmarks.corpus import CORPUS, build_corpus
+
+RSS_SAMPLE_SECONDS = 0.02
+# Longest wait for the queue's workers to load their models.
+WORKER_WARMUP_SECONDS = 600
+
+
+class StageMeter:
+    """
+    `on_event` callback for run_conversion that measures each stage between
+    its "started" and "finished" events. A sampler thread tracks peak RSS.
+    """
+
+    def __init__(self):
+        self.process = psutil.Process()
+        self.stages = {}
+        self._current = None
+        self._peak_rss = 0
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+
+    def _written(self) -> int:
+        try:
+            return self.process.io_counters().write_bytes
+        except (AttributeError, psutil.Error):
+            return 0
+
+    def _sample(self):
+        while not self._stop.wait(RSS_SAMPLE_SECONDS):
+            self._peak_rss = max(self._peak_rss, self.process.memory_info().rss)
+
+    def __call__(self, event: dict):
+        if event.get("event") != "stage":
+            return
+        if event["status"] == "started":
+            self._peak_rss = self.process.memory_info().rss
+            self._current = (event["stage"], time.perf_counter(), time.process_time(), self._written())
+        elif self._current and self._current[0] == event["stage"]:
+            name, wall, cpu, written = self._current
+            self._peak_rss = max(self._peak_rss, self.process.memory_info().rss)
+            self.stages[name] = {
+                "wall_seconds": time.perf_counter() - wall,
+                "cpu_seconds": time.process_time() - cpu,
+                "peak_rss_bytes": self._peak_rss,
+                "write_bytes": self._written() - written,
+            }
+            self._current = None
+
+    def close(self):
+        self._stop.set()
+        self._sampler.join()
+
+
+def run_document(pdf: Path, ocr: bool, kind: str, work_dir: Path) -> dict:
+    from main import full_converter, No_ai_converter
+
+    workspace = work_dir / f"{pdf.stem}-{kind}"
+    shutil.rmtree(workspace, ignore_errors=True)
+    workspace.mkdir(parents=True)
+    output_md = workspace / f"{pdf.stem}.md"
+    converter = full_converter if kind == "ai" else No_ai_converter
+
+    meter = StageMeter()
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    try:
+        converter(str(pdf), str(output_md), ocr, workspace=str(workspace), on_event=meter)
+    finally:
+        meter.close()
+    markdown = output_md.read_bytes()
+    return {
+        "wall_seconds": time.perf_counter() - start_wall,
+        "cpu_seconds": time.process_time() - start_cpu,
+        "stages": meter.stages,
+        "workspace_bytes": sum(f.stat().st_size for f in workspace.rglob("*") if f.is_file()),
+        "output_bytes": len(markdown),
+        "output_sha256": hashlib.sha256(markdown).hexdigest(),
+    }
+
+
+def run_concurrent(corpus: dict, kinds: list, jobs: int, workers: int, work_dir: Path,
+                   llm_latency: float, vision_latency: float) -> dict:
+    """
+    Convert every document once in this process, then submit `jobs`
+    conversions to a JobQueue at the same time, each into its own workspace,
+    and compare every concurrent output with its serial run byte for byte.
+    """
+    from src.jobqueue import JobQueue
+    from src.pdftomd import warm_converters
+    from benchmarks.stubs import install_stubs
+
+    pairs = [(name, kind) for name in corpus for kind in kinds]
+    warm_converters()
+    serial = {}
+    serial_seconds = 0.0
+    for name, kind in pairs:
+        shutil.rmtree(work_dir / "cache", ignore_errors=True)
+        pdf, ocr = corpus[name]
+        run = run_document(pdf, ocr, kind, work_dir / "out" / "serial")
+        serial[(name, kind)] = run["output_sha256"]
+        serial_seconds += run["wall_seconds"]
+        print(f"serial {name}-{kind}: {run['wall_seconds']:.2f}s", file=sys.stderr)
+
+    shutil.rmtree(work_dir / "cache", ignore_errors=True)
+    queue = JobQueue(max_workers=workers, max_queued=jobs,
+                     worker_setup=partial(install_stubs, llm_latency, vision_latency))
+    queue.start()
+    try:
+        deadline = time.monotonic() + WORKER_WARMUP_SECONDS
+        while len(queue.worker_metrics()) < queue.max_workers and time.monotonic() < deadline:
+            time.sleep(0.5)
+
+        submitted = []
+        start_wall = time.perf_counter()
+        for i in range(jobs):
+            name, kind = pairs[i % len(pairs)]
+            pdf, ocr = corpus[name]
+            workspace = work_dir / "out" / "concurrent" / f"{i:03d}-{name}-{kind}"
+            workspace.mkdir(parents=True)
+            output_md = workspace / f"{pdf.stem}.md"
+            job_id = queue.submit(kind, str(pdf), str(output_md), ocr, workspace=str(workspace))
+            submitted.append((f"{i:03d}-{name}-{kind}", serial[(name, kind)], output_md, queue.future(job_id)))
+
+        mismatches = []
+        for label, expected, output_md, future in submitted:
+            try:
+                future.result()
+            except Exception as e:
+                mismatches.append(f"{label}: failed ({e})")
+                continue
+            actual = hashlib.sha256(output_md.read_bytes()).hexdigest()
+            if actual != expected:
+                mismatches.append(f"{label}: {actual[:12]} differs from serial {expected[:12]}")
+        concurrent_seconds = time.perf_counter() - start_wall
+    finally:
+        queue.shutdown()
+
+    return {
+        "jobs": jobs,
+        "workers": queue.max_workers,
+        "serial_seconds": serial_seconds,
+        # Serial time for the same job mix, for a like-for-like throughput comparison.
+        "serial_seconds_for_jobs": serial_seconds * jobs / len(pairs),
+        "concurrent_seconds": concurrent_seconds,
+        "jobs_per_minute": jobs * 60 / concurrent_seconds,
+        "identical": not mismatches,
+        "mismatches": mismatches,
+    }
+
+
+def summarize(runs: list) -> dict:
+    """Median times and maximum memory over repeated runs of one document."""
+    stages = {}
+    for name in runs[0]["stages"]:
+        samples = [run["stages"][name] for run in runs if name in run["stages"]]
+        stages[name] = {
+            "wall_seconds": median(s["wall_seconds"] for s in samples),
+            "cpu_seconds": median(s["cpu_seconds"] for s in samples),
+            "peak_rss_bytes": max(s["peak_rss_bytes"] for s in samples),
+            "write_bytes": median(s["write_bytes"] for s in samples),
+        }
+    return {
+        "runs": len(runs),
+        "wall_seconds": median(run["wall_seconds"] for run in runs),
+        "cpu_seconds": median(run["cpu_seconds"] for run in runs),
+        "stages": stages,
+        "workspace_bytes": runs[-1]["workspace_bytes"],
+        "output_bytes": runs[-1]["output_bytes"],
+        "output_sha256": runs[-1]["output_sha256"],
+        # The stubs are deterministic, so repeated runs must agree byte for byte.
+        "deterministic": len({run["output_sha256"] for run in runs}) == 1,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_seconds: float) -> list:
+    """Human-readable regressions of `results` against `baseline`."""
+    problems = []
+    for doc, current in results["documents"].items():
+        previous = baseline.get("documents", {}).get(doc)
+        if previous is None:
+            continue
+        if current["output_sha256"] != previous["output_sha256"]:
+            problems.append(f"{doc}: output changed ({previous['output_sha256'][:12]} -> {current['output_sha256'][:12]})")
+        if not current["deterministic"]:
+            problems.append(f"{doc}: output differs between runs")
+        for stage, now in current["stages"].items():
+            before = previous["stages"].get(stage)
+            if before is None:
+                continue
+            for metric, floor in (("wall_seconds", min_seconds), ("cpu_seconds", min_seconds),
+                                  ("peak_rss_bytes", 32 * 1024 ** 2)):
+                limit = before[metric] * (1 + tolerance)
+                if now[metric] > limit and now[metric] - before[metric] > floor:
+                    problems.append(f"{doc}/{stage}: {metric} {before[metric]:.3g} -> {now[metric]:.3g}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", default=",".join(CORPUS), help="Comma-separated corpus entries.")
+    parser.add_argument("--kinds", default="ai,raw", help="ai (full_converter) and/or raw (No_ai_converter).")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Seconds per stub LLM call.")
+    parser.add_argument("--vision-latency", type=float, default=0.3, help="Seconds per stub Gemini call.")
+    parser.add_argument("--corpus-dir", type=Path, default=REPO_ROOT / "benchmarks" / ".corpus")
+    parser.add_argument("--output", type=Path, help="Write the JSON report here (default: stdout).")
+    parser.add_argument("--baseline", type=Path, help="Compare against this earlier report.")
+    parser.add_argument("--save-baseline", type=Path, help="Also store the report as the new baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative slowdown.")
+    parser.add_argument("--min-seconds", type=float, default=0.1, help="Ignore slowdowns smaller than this.")
+    parser.add_argument("--concurrency", type=int, default=0,
+                        help="Submit this many conversions to a JobQueue at once and compare with serial runs.")
+    parser.add_argument("--workers", type=int, help="JobQueue workers for --concurrency (default: sized to the machine).")
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.corpus_dir.resolve(), args.documents.split(","))
+    baseline = json.loads(args.baseline.read_text(encoding="utf-8")) if args.baseline else None
+
+    # Caches and config are resolved relative to the working directory: run
+    # in a scratch folder so every run starts cold and nothing leaks into the repo.
+    work_dir = Path(tempfile.mkdtemp(prefix="bench-pipeline-"))
+    shutil.copy(REPO_ROOT / "config.ini", work_dir / "config.ini")
+    os.chdir(work_dir)
+    os.environ["LLM_CACHE"] = "0"
+
+    from benchmarks.stubs import install_stubs
+    install_stubs(args.llm_latency, args.vision_latency)
+
+    results = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "llm_latency": args.llm_latency,
+            "vision_latency": args.vision_latency,
+        },
+        "documents": {},
+    }
+    try:
+        if args.concurrency:
+            results["concurrency"] = run_concurrent(corpus, args.kinds.split(","), args.concurrency,
+                                                    args.workers, work_dir, args.llm_latency, args.vision_latency)
+        else:
+            for name, (pdf, ocr) in corpus.items():
+                for kind in args.kinds.split(","):
+                    runs = []
+                    for _ in range(args.runs):
+                        # Start every run with empty formula / verdict caches.
+                        shutil.rmtree(work_dir / "cache", ignore_errors=True)
+                        runs.append(run_document(pdf, ocr, kind, work_dir / "out"))
+                    results["documents"][f"{name}-{kind}"] = summarize(runs)
+                    print(f"{name}-{kind}: {results['documents'][f'{name}-{kind}']['wall_seconds']:.2f}s",
+                          file=sys.stderr)
+    finally:
+        os.chdir(REPO_ROOT)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(report, encoding="utf-8")
+    else:
+        print(report)
+    if args.save_baseline:
+        args.save_baseline.write_text(report, encoding="utf-8")
+
+    if args.concurrency:
+        for mismatch in results["concurrency"]["mismatches"]:
+            print(f"MISMATCH {mismatch}", file=sys.stderr)
+        if not results["concurrency"]["identical"]:
+            sys.exit(1)
+
+    if baseline is not None:
+        problems = compare(results, baseline, args.tolerance, args.min_seconds)
+        for problem in problems:
+            print(f"REGRESSION {problem}", file=sys.stderr)
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Local stand-ins for Gemini and the LLM backends, so benchmarks measure this
+project's own work plus a fixed, configurable network latency.
+"""
+import json
+import time
+import asyncio
+import hashlib
+
+
+class _StubResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class StubGeminiModels:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def generate_content(self, model=None, contents=None, config=None):
+        time.sleep(self.latency)
+        # Deterministic verdict derived from the image bytes.
+        image = next((part.inline_data.data for part in contents[0]
+                      if getattr(part, "inline_data", None) is not None), b"")
+        useful = hashlib.sha256(image).digest()[0] % 4 != 0
+        return _StubResponse(json.dumps({"is_useful": useful, "reason": "Stub verdict."}))
+
+
+class StubGeminiClient:
+    def __init__(self, latency: float):
+        self.models = StubGeminiModels(latency)
+
+
+class StubLLM:
+    """Answers a rewrite prompt with its own input, after `latency` seconds."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    @staticmethod
+    def _answer(prompt) -> str:
+        prompt = str(prompt)
+        start = prompt.find("### BEGIN INPUT")
+        end = prompt.find("### END INPUT")
+        if start == -1 or end == -1:
+            return prompt
+        return prompt[start + len("### BEGIN INPUT"):end].strip() + "\n"
+
+    def invoke(self, input, config=None):
+        time.sleep(self.latency)
+        return self._answer(input)
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        return self._answer(input)
+
+
+def install_stubs(llm_latency: float = 0.5, vision_latency: float = 0.3):
+    """Route every Gemini and LLM call made in this process to the stubs."""
+    import src.imagecaption as imagecaption
+    from llminit import get_llm_manager
+
+    imagecaption.create_gemini_client = lambda: StubGeminiClient(vision_latency)
+
+    mgr = get_llm_manager()
+    # Responses are not cached, so every run pays the stub latency.
+    mgr.cache = None
+    mgr._instances = {source: StubLLM(llm_latency) for source in mgr.orders["default"]}
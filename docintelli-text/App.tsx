@@ -1,11 +1,11 @@
 
-import React, { useState, useEffect } from 'react';
+import React, { useState } from 'react';
 import SidebarNav from './components/SidebarNav';
 import ConversionView from './components/ConversionView';
 import NotesView from './components/NotesView';
 import SettingsView from './components/SettingsView';
 import HistoryView from './components/HistoryView';
-import { getHistoryFile } from './services/apiService';
+import { getHistoryFile, serverUrl } from './services/apiService';
 import { HistoryFile } from './types';
 
 const App: React.FC = () => {
@@ -13,40 +13,16 @@ const App: React.FC = () => {
   const [ocrEnabled, setOcrEnabled] = useState<boolean>(false);
   const [aiSummarizationEnabled, setAiSummarizationEnabled] = useState<boolean>(true); // Default to ON
   const [loadedHistoryItem, setLoadedHistoryItem] = useState<{pdfUrl: string; markdown: string; filename: string} | null>(null);
-  const [historyPdfBlobUrl, setHistoryPdfBlobUrl] = useState<string | null>(null);
-
-  useEffect(() => {
-    // Cleanup function to revoke the object URL when the component unmounts
-    // or when the URL changes, preventing memory leaks.
-    return () => {
-      if (historyPdfBlobUrl) {
-        URL.revokeObjectURL(historyPdfBlobUrl);
-      }
-    };
-  }, [historyPdfBlobUrl]);
 
   const handleLoadHistoryItem = async (filename: string) => {
-    if (historyPdfBlobUrl) {
-      URL.revokeObjectURL(historyPdfBlobUrl);
-    }
-    
     try {
       const fileData: HistoryFile = await getHistoryFile(filename);
-      const downloadUrl = `http://127.0.0.1:9898${fileData.pdf_url}`;
-
-      // Fetch the PDF content as a Blob to bypass download-forcing headers
-      const pdfResponse = await fetch(downloadUrl);
-      if (!pdfResponse.ok) {
-        throw new Error(`Failed to fetch PDF file. Status: ${pdfResponse.status}`);
-      }
-      const pdfBlob = await pdfResponse.blob();
-
-      // Create a local URL for the blob to be displayed in the viewer
-      const newBlobUrl = URL.createObjectURL(pdfBlob);
-      setHistoryPdfBlobUrl(newBlobUrl);
 
+      // The server sends the PDF inline with range and cache headers, so the
+      // viewer loads it directly: pages render as their bytes arrive and a
+      // repeat view is answered from the browser cache.
       setLoadedHistoryItem({
-        pdfUrl: newBlobUrl,
+        pdfUrl: serverUrl(fileData.pdf_url),
         markdown: fileData.markdown_content,
         filename: fileData.filename,
       });
@@ -58,10 +34,6 @@ const App: React.FC = () => {
   };
 
   const clearLoadedHistory = () => {
-    if (historyPdfBlobUrl) {
-      URL.revokeObjectURL(historyPdfBlobUrl);
-      setHistoryPdfBlobUrl(null);
-    }
     setLoadedHistoryItem(null);
   }
 
@@ -6,7 +6,7 @@ import PdfViewer from './PdfViewer';
 import MarkdownPreview from './MarkdownPreview';
 import ProcessingModal from './ProcessingModal';
 import { processPdf } from '../services/apiService';
-import { ProcessingStep, ProcessingStatus } from '../types';
+import { ProcessingStep, ProcessingStatus, ConversionEvent } from '../types';
 import { INITIAL_PROCESSING_STEPS } from '../constants';
 
 interface ConversionViewProps {
@@ -23,6 +23,7 @@ const ConversionView: React.FC<ConversionViewProps> = ({ ocrEnabled, aiSummariza
   const [isLoading, setIsLoading] = useState<boolean>(false);
   const [error, setError] = useState<string | null>(null);
   const [processingSteps, setProcessingSteps] = useState<ProcessingStep[]>(INITIAL_PROCESSING_STEPS);
+  const [progressNote, setProgressNote] = useState<string | null>(null);
 
   // Derived state to decide what to display
   const displayPdfUrl = loadedItem?.pdfUrl || uploadedPdfUrl;
@@ -71,25 +72,33 @@ const ConversionView: React.FC<ConversionViewProps> = ({ ocrEnabled, aiSummariza
       );
     };
 
-    const sleep = (ms: number) => new Promise(resolve => setTimeout(resolve, ms));
+    const handleEvent = (event: ConversionEvent) => {
+      if (event.event === 'stage' && event.status === 'started' && event.stage) {
+        const stepIndex = INITIAL_PROCESSING_STEPS.findIndex(step => step.stages.includes(event.stage!));
+        if (stepIndex >= 0) updateProgress(stepIndex);
+        setProgressNote(null);
+      } else if (event.event === 'chunk' && event.total) {
+        setProgressNote(`Rewritten ${event.index! + 1} of ${event.total} sections`);
+      } else if (event.event === 'markdown' && event.content !== undefined) {
+        // Show each intermediate version as soon as it arrives.
+        setMarkdownContent(event.content);
+      }
+    };
 
     try {
-      updateProgress(0); await sleep(300);
-      updateProgress(1); await sleep(400);
-      updateProgress(2); await sleep(300);
-      updateProgress(3);
-      const markdown = await processPdf(pdfFile, ocrEnabled, aiSummarizationEnabled);
-      updateProgress(4); await sleep(300);
-      updateProgress(5); await sleep(200);
+      updateProgress(0);
+      const markdown = await processPdf(pdfFile, ocrEnabled, aiSummarizationEnabled, handleEvent);
 
       setMarkdownContent(markdown);
       setProcessingSteps(prevSteps => prevSteps.map(step => ({...step, status: ProcessingStatus.DONE})));
     } catch (err) {
       setError('An error occurred during processing. Please try again.');
+      setMarkdownContent(null);
       setProcessingSteps(INITIAL_PROCESSING_STEPS);
       console.error(err);
     } finally {
       setIsLoading(false);
+      setProgressNote(null);
     }
   }, [pdfFile, ocrEnabled, aiSummarizationEnabled]);
 
@@ -109,7 +118,8 @@ const ConversionView: React.FC<ConversionViewProps> = ({ ocrEnabled, aiSummariza
   return (
     <div className="flex flex-col h-full bg-gray-900 text-gray-200">
       <Header onReset={handleReset} showReset={!!displayPdfUrl} />
-      {isLoading && <ProcessingModal steps={processingSteps} />}
+      {/* The modal only covers the wait for the first Markdown; later updates show in the preview. */}
+      {isLoading && markdownContent === null && <ProcessingModal steps={processingSteps} />}
       <main className="flex-grow p-4 overflow-hidden">
           {!displayPdfUrl ? (
             <div className="h-full flex items-center justify-center">
@@ -136,8 +146,13 @@ const ConversionView: React.FC<ConversionViewProps> = ({ ocrEnabled, aiSummariza
                 </div>
               </div>
               <div className="flex flex-col h-full bg-gray-800 rounded-lg shadow-lg">
-                 <div className="flex-shrink-0 p-3 bg-gray-700/50 rounded-t-lg">
+                 <div className="flex-shrink-0 p-3 bg-gray-700/50 rounded-t-lg flex justify-between items-center">
                     <h2 className="text-lg font-semibold text-gray-300">Extracted Markdown</h2>
+                    {isLoading && (
+                      <span className="text-sm text-indigo-300 animate-pulse">
+                        {progressNote ?? processingSteps.find(step => step.status === ProcessingStatus.IN_PROGRESS)?.name}
+                      </span>
+                    )}
                  </div>
                 <div className="flex-grow overflow-auto">
                   <MarkdownPreview content={displayMarkdown} />
@@ -2,10 +2,12 @@
 import { ProcessingStep, ProcessingStatus } from './types';
 
 export const INITIAL_PROCESSING_STEPS: ProcessingStep[] = [
-  { name: 'Parsing PDF structure', status: ProcessingStatus.PENDING },
-  { name: 'Extracting text and tables', status: ProcessingStatus.PENDING },
-  { name: 'Identifying mathematical formulas', status: ProcessingStatus.PENDING },
-  { name: 'Analyzing images with Gemini AI', status: ProcessingStatus.PENDING, isAiStep: true },
-  { name: 'Converting formulas to LaTeX', status: ProcessingStatus.PENDING },
-  { name: 'Generating final Markdown', status: ProcessingStatus.PENDING },
+  { name: 'Parsing PDF structure', status: ProcessingStatus.PENDING, stages: ['docling'] },
+  { name: 'Extracting text and tables', status: ProcessingStatus.PENDING, stages: ['remove_logos'] },
+  { name: 'Converting formulas to LaTeX', status: ProcessingStatus.PENDING, stages: ['formulas'] },
+  { name: 'Analyzing images with Gemini AI', status: ProcessingStatus.PENDING, isAiStep: true,
+    stages: ['image_triage', 'remove_useless_images'] },
+  { name: 'Rewriting notes with AI', status: ProcessingStatus.PENDING, isAiStep: true,
+    stages: ['join_pages', 'llm_rewrite'] },
+  { name: 'Generating final Markdown', status: ProcessingStatus.PENDING, stages: ['clean_captions', 'prune_images'] },
 ];
@@ -1,15 +1,25 @@
 
-import { HistoryItem, HistoryFile } from './types';
+import { HistoryItem, HistoryFile, ConversionEvent } from '../types';
 
 const API_BASE_URL = 'http://127.0.0.1:9898';
 
-export const processPdf = async (file: File, ocr: boolean, useAi: boolean): Promise<string> => {
+// Absolute URL of a path returned by the server, e.g. HistoryFile.pdf_url.
+export const serverUrl = (path: string): string => `${API_BASE_URL}${path}`;
+
+// Converts through the NDJSON stream, so callers can show progress and the
+// intermediate Markdown while the conversion runs.
+export const processPdf = async (
+  file: File,
+  ocr: boolean,
+  useAi: boolean,
+  onEvent?: (event: ConversionEvent) => void,
+): Promise<string> => {
   const formData = new FormData();
   formData.append('file', file, file.name);
   formData.append('ocr', String(ocr));
+  formData.append('use_ai', String(useAi));
 
-  const endpoint = useAi ? '/convert' : '/convert_raw';
-  const url = `${API_BASE_URL}${endpoint}`;
+  const url = `${API_BASE_URL}/convert_stream`;
 
   try {
     const response = await fetch(url, {
@@ -17,16 +27,41 @@ export const processPdf = async (file: File, ocr: boolean, useAi: boolean): Prom
       body: formData,
     });
 
-    if (!response.ok) {
+    if (!response.ok || !response.body) {
       const errorBody = await response.text();
       console.error('API Error Response:', errorBody);
       throw new Error(`Failed to process PDF. Server responded with ${response.status}: ${response.statusText}`);
     }
 
-    const blob = await response.blob();
-    return await blob.text();
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffered = '';
+    while (true) {
+      const { done, value } = await reader.read();
+      buffered += decoder.decode(value, { stream: !done });
+      const lines = buffered.split('\n');
+      buffered = lines.pop() ?? '';
+      if (done && buffered.trim()) {
+        lines.push(buffered);
+      }
+      for (const line of lines) {
+        if (!line.trim()) continue;
+        const event: ConversionEvent = JSON.parse(line);
+        if (event.event === 'done') {
+          await reader.cancel();
+          return event.content ?? '';
+        }
+        if (event.event === 'error' || event.event === 'gone') {
+          throw new Error(event.detail ?? 'Conversion failed.');
+        }
+        onEvent?.(event);
+      }
+      if (done) {
+        throw new Error('The conversion stream ended without a result.');
+      }
+    }
   } catch (error) {
-    console.error(`An error occurred while calling the ${endpoint} API:`, error);
+    console.error('An error occurred while calling the /convert_stream API:', error);
     throw error;
   }
 };
@@ -9,6 +9,19 @@ export interface ProcessingStep {
   name: string;
   status: ProcessingStatus;
   isAiStep?: boolean;
+  // Server pipeline stages reported as part of this step.
+  stages: string[];
+}
+
+// One line of the NDJSON stream sent by /convert_stream.
+export interface ConversionEvent {
+  event: 'job' | 'stage' | 'markdown' | 'chunk' | 'shard' | 'done' | 'error' | 'gone';
+  stage?: string;
+  status?: string;
+  index?: number;
+  total?: number;
+  content?: string;
+  detail?: string;
 }
 
 export interface HistoryItem {
@@ -24,4 +37,6 @@ export interface HistoryFile {
     filename: string;
     markdown_content: string;
     pdf_url: string;
+    // Raw Markdown of the session, for clients that do not need it inline.
+    markdown_url?: string;
 }
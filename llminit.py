@@ -1,15 +1,60 @@
 import os
+import time
+import asyncio
+import threading
+import httpx
 from configobj import ConfigObj
 from dotenv import load_dotenv
 from langchain_ollama import ChatOllama
 from langchain_groq import ChatGroq
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 from langchain_core.runnables import Runnable
 from langchain_core.output_parsers import PydanticOutputParser
+from src.llmhealth import BackendHealth
+from src.llmcache import LLMResponseCache, response_key
 
 # Load environment variables from .env
 load_dotenv()
 
+# Per-backend defaults; override with `timeout = ...` / `max_concurrency = ...`
+# in the backend's [llms_<source>] section of config.ini.
+DEFAULT_TIMEOUT_SECONDS = 120.0
+DEFAULT_MAX_CONCURRENCY = 4
+# Connection pool shared by every call to one HTTP backend.
+HTTP_POOL_LIMITS = httpx.Limits(max_connections=16, max_keepalive_connections=8)
+# "order": try backends as listed in the fallback order; "latency": try the
+# currently fastest healthy backend first. Set in [routing] or LLM_ROUTING.
+ROUTING_MODES = ("order", "latency")
+# Hedging needs this many recent successes of the primary backend before its
+# latency percentile is trusted as the hedge delay.
+HEDGE_MIN_SAMPLES = 10
+# Responses of backends configured with temperature 0 are deterministic and
+# are served from the persistent response cache when the prompt repeats.
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "1") == "1"
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_llm_manager(config_path='config.ini'):
+    """
+    Process-wide LLMManager for `config_path`. Its clients, connection pools
+    and event loop are built once and reused by every call.
+    """
+    with _managers_lock:
+        mgr = _managers.get(config_path)
+        if mgr is None:
+            mgr = _managers[config_path] = LLMManager(config_path)
+        return mgr
+
+
+def llm_metrics() -> dict:
+    """Per-backend health of the managers created in this process."""
+    with _managers_lock:
+        managers = dict(_managers)
+    return {path: mgr.health_stats() for path, mgr in managers.items()}
+
+
 class LLMManager:
     def __init__(self, config_path='config.ini'):
         self.config = self.load_config(config_path)
@@ -22,6 +67,73 @@ class LLMManager:
         self.DEFAULT_FALLBACK_ORDER = self.orders["default"]
         # self.DEFAULT_FALLBACK_ORDER = defaultcfg
         # self.DEFAULT_FALLBACK_ORDER = ['lmstudio','ollama']
+        self._instances = None
+        self._lock = threading.Lock()
+        self._sync_limits = {}
+        self._async_limits = {}
+        self._loop = None
+        self.health = {}
+        self.routing = os.getenv("LLM_ROUTING") or self.config.get('routing', {}).get('mode', 'order')
+        if self.routing not in ROUTING_MODES:
+            raise ValueError(f"Unknown routing mode '{self.routing}'. Must be one of {list(ROUTING_MODES)}")
+        hedging = self.config.get('hedging', {})
+        self.hedging = {
+            "enabled": os.getenv("LLM_HEDGING", str(hedging.get('enabled', 'false'))).lower() in ("1", "true", "yes"),
+            # Fire the hedge once the primary is slower than this percentile of its recent latency ...
+            "percentile": float(hedging.get('percentile', 0.95)),
+            # ... as long as hedges stay below this fraction of all requests.
+            "max_extra_fraction": float(hedging.get('max_extra_fraction', 0.1)),
+        }
+        self._hedge_counters = {"requests": 0, "hedges_sent": 0, "hedge_wins": 0,
+                                "primary_wins": 0, "skipped_budget": 0}
+        self.cache = LLMResponseCache() if LLM_CACHE_ENABLED else None
+
+    def backend_setting(self, source, key, default):
+        try:
+            return type(default)(self.config[f'llms_{source}'].get(key, default))
+        except (KeyError, ValueError):
+            return default
+
+    def timeout(self, source):
+        return self.backend_setting(source, 'timeout', DEFAULT_TIMEOUT_SECONDS)
+
+    def get_instances(self):
+        """Clients for every backend named in any order, set up on first use."""
+        with self._lock:
+            if self._instances is None:
+                sources = []
+                for order in self.orders.values():
+                    sources += [source for source in order if source not in sources]
+                self._instances = self.setup_llm_with_fallback(sources)
+                for source in self._instances:
+                    self._sync_limits[source] = threading.BoundedSemaphore(
+                        self.backend_setting(source, 'max_concurrency', DEFAULT_MAX_CONCURRENCY)
+                    )
+            return self._instances
+
+    @property
+    def loop(self):
+        """
+        Event loop (on a daemon thread) that every async call runs on, so the
+        async clients and their keep-alive connections stay bound to one loop.
+        """
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="llm-loop", daemon=True).start()
+            return self._loop
+
+    def run(self, coro):
+        """Run a coroutine on the manager's loop from synchronous code and wait for it."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def _async_limit(self, source):
+        # Only touched from the manager's loop.
+        if source not in self._async_limits:
+            self._async_limits[source] = asyncio.Semaphore(
+                self.backend_setting(source, 'max_concurrency', DEFAULT_MAX_CONCURRENCY)
+            )
+        return self._async_limits[source]
 
     def parse_order(self, section):
         try:
@@ -56,30 +168,26 @@ class LLMManager:
                     if not api_key:
                         raise ValueError("OPENROUTER_API_KEY not found")
                         
-                    client = OpenAI(
-                        base_url="https://openrouter.ai/api/v1",
-                        api_key=api_key,
-                    )
+                    client, async_client = self._openai_clients("https://openrouter.ai/api/v1", api_key, source)
                     llm_instances[source] = OpenRouterLLM(
                         client=client,
                         model=cfg['model'],
                         temperature=cfg['temperature'],
                         site_url=cfg['site_url'],
-                        site_name=cfg['site_name']
+                        site_name=cfg['site_name'],
+                        async_client=async_client,
                     )
                 elif source == 'lmstudio':
                     api_key = 'lmstudio'
                     if not api_key:
                         raise ValueError("LMSTUDIO_API_KEY not found")
-                    client = OpenAI(
-                        base_url="http://127.0.0.1:1234/v1",
-                        api_key=api_key,
-                    )
+                    client, async_client = self._openai_clients("http://127.0.0.1:1234/v1", api_key, source)
                     # create and register an LMStudio wrapper so invoke_with_fallback can call it
                     llm_instances[source] = LMStudioLLM(
                         client=client,
                         model=cfg['model'],
-                        temperature=float(cfg.get('temperature', 0.0))
+                        temperature=float(cfg.get('temperature', 0.0)),
+                        async_client=async_client,
                     )
                 elif source == 'groq':
                     api_key = os.getenv('GROQ_API_KEY')
@@ -88,14 +196,16 @@ class LLMManager:
                     groq_client = ChatGroq(
                         model=cfg['model'],
                         temperature=float(cfg['temperature']),
-                        api_key=api_key
+                        api_key=api_key,
+                        timeout=self.timeout(source),
                     )
                     llm_instances[source] = GroqLLMWrapper(groq_client)
                 
                 elif source == 'ollama':
                     llm_instances[source] = ChatOllama(
                         model=cfg['model'],
-                        temperature=float(cfg['temperature'])
+                        temperature=float(cfg['temperature']),
+                        client_kwargs={"timeout": self.timeout(source)},
                     )
                 else:
                     print(f"Unsupported LLM source in fallback: {source}")
@@ -107,40 +217,275 @@ class LLMManager:
             raise Exception("No LLMs could be set up from the fallback order.")
         return llm_instances
 
-    def invoke_with_fallback(self, llm_instances, order_key, input_data, output_model=None):
+    def _openai_clients(self, base_url, api_key, source):
+        """Sync and async OpenAI clients with their own persistent connection pools."""
+        timeout = self.timeout(source)
+        client = OpenAI(
+            base_url=base_url,
+            api_key=api_key,
+            timeout=timeout,
+            http_client=httpx.Client(limits=HTTP_POOL_LIMITS, timeout=timeout),
+        )
+        async_client = AsyncOpenAI(
+            base_url=base_url,
+            api_key=api_key,
+            timeout=timeout,
+            http_client=httpx.AsyncClient(limits=HTTP_POOL_LIMITS, timeout=timeout),
+        )
+        return client, async_client
+
+    def resolve_order(self, order_key):
         # Resolve order key → actual list
         if isinstance(order_key, str):
             if order_key not in self.orders:
                 raise ValueError(f"Unknown fallback order '{order_key}'. Must be one of {list(self.orders.keys())}")
-            fallback_order = self.orders[order_key]
-        else:
-            fallback_order = order_key  # allow passing list directly
+            return self.orders[order_key]
+        return order_key  # allow passing list directly
 
-        for source in fallback_order:
-            if source in llm_instances:
-                try:
-                    llm = llm_instances[source]
-                    if output_model:
-                        llm = llm.with_structured_output(output_model)
+    def _health(self, source):
+        with self._lock:
+            if source not in self.health:
+                self.health[source] = BackendHealth(source)
+            return self.health[source]
 
-                    result = llm.invoke(input_data)
+    def route(self, order_key, llm_instances):
+        """
+        Backends to try, in order: those whose circuit is open are left out,
+        and in "latency" mode the rest are sorted by recent median latency
+        (backends without measurements first, so they get measured). When
+        every circuit is open the plain order is returned as a last resort.
+        Returns (sources, last_resort).
+        """
+        candidates = [source for source in self.resolve_order(order_key) if source in llm_instances]
+        healthy = [source for source in candidates if self._health(source).available()]
+        if not healthy:
+            return candidates, True
+        if self.routing == "latency":
+            healthy.sort(key=lambda source: self._health(source).latency() or 0.0)
+        return healthy, False
+
+    def _cache_key(self, source, input_data):
+        """Response cache key, or None for backends whose output is not deterministic."""
+        cfg = self.config.get(f'llms_{source}', {})
+        try:
+            temperature = float(cfg.get('temperature', 0.0))
+        except ValueError:
+            return None
+        if temperature != 0.0:
+            return None
+        return response_key(source, cfg.get('model', ''), temperature, str(input_data))
 
-                    if output_model:
-                        print(f"✅ Used {source} (structured).")
-                        return result
+    def _cached_response(self, sources, input_data, output_model):
+        """Cached raw response of the first backend in `sources` that has one."""
+        if self.cache is None or output_model:
+            return None
+        keys = {self._cache_key(source, input_data): source for source in sources}
+        keys.pop(None, None)
+        if not keys:
+            return None
+        key, response = self.cache.lookup(list(keys))
+        if key is not None:
+            print(f"💾 Used cached {keys[key]} response.")
+        return response
 
-                    if hasattr(result, 'content'):
-                        result = result.content
-                    if not isinstance(result, str):
-                        raise ValueError(f"Unexpected result type from {source}: {type(result)}")
+    def _store_response(self, source, input_data, result, output_model):
+        if self.cache is None or output_model or not isinstance(result, str):
+            return
+        key = self._cache_key(source, input_data)
+        if key is not None:
+            self.cache.put(key, source, self.config[f'llms_{source}'].get('model', ''), result)
 
-                    print(f"✅ Used {source} (raw).")
-                    return result
-                except Exception as e:
-                    print(f"⚠️ {source} failed: {e}. Trying next...")
-                    continue
+    def discard_cached_response(self, input_data):
+        """Forget every backend's cached answer to `input_data`, e.g. after it failed validation."""
+        if self.cache is None:
+            return
+        keys = [self._cache_key(source, input_data) for source in self.get_instances()]
+        self.cache.delete([key for key in keys if key is not None])
+
+    def health_stats(self):
+        with self._lock:
+            health = dict(self.health)
+        return {
+            "routing": self.routing,
+            "hedging": {**self.hedging, **self._hedge_counters},
+            "cache_enabled": self.cache is not None,
+            "backends": {source: h.stats() for source, h in health.items()},
+        }
+
+    @staticmethod
+    def _check_result(source, result, output_model):
+        if output_model:
+            print(f"✅ Used {source} (structured).")
+            return result
+
+        if hasattr(result, 'content'):
+            result = result.content
+        if not isinstance(result, str):
+            raise ValueError(f"Unexpected result type from {source}: {type(result)}")
+
+        print(f"✅ Used {source} (raw).")
+        return result
+
+    def invoke_with_fallback(self, llm_instances, order_key, input_data, output_model=None):
+        sources, last_resort = self.route(order_key, llm_instances)
+        cached = self._cached_response(sources, input_data, output_model)
+        if cached is not None:
+            return cached
+        for source in sources:
+            health = self._health(source)
+            permit = None if last_resort else health.allow()
+            if not last_resort and permit is None:
+                continue
+            start_time = time.monotonic()
+            try:
+                llm = llm_instances[source]
+                if output_model:
+                    llm = llm.with_structured_output(output_model)
+
+                limit = self._sync_limits.get(source)
+                if limit is None:
+                    result = llm.invoke(input_data)
+                else:
+                    with limit:
+                        result = llm.invoke(input_data)
+                result = self._check_result(source, result, output_model)
+            except Exception as e:
+                health.record_failure(e, time.monotonic() - start_time, permit=permit)
+                print(f"⚠️ {source} failed: {e}. Trying next...")
+                continue
+            health.record_success(time.monotonic() - start_time, permit=permit)
+            self._store_response(source, input_data, result, output_model)
+            return result
         return "❌ All LLMs in fallback chain failed."    
 
+    async def ainvoke_with_fallback(self, llm_instances, order_key, input_data, output_model=None,
+                                    timeout=None):
+        """
+        Async invoke_with_fallback. Each attempt is limited to `timeout`
+        seconds (default: the backend's configured timeout) and to the
+        backend's `max_concurrency` calls in flight. Can be awaited from any
+        event loop; the calls themselves run on the manager's loop.
+        """
+        coro = self._ainvoke_with_fallback(llm_instances, order_key, input_data, output_model, timeout)
+        if asyncio.get_running_loop() is not self.loop:
+            return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self.loop))
+        return await coro
+
+    async def _ainvoke_with_fallback(self, llm_instances, order_key, input_data, output_model, timeout):
+        sources, last_resort = self.route(order_key, llm_instances)
+        cached = self._cached_response(sources, input_data, output_model)
+        if cached is not None:
+            return cached
+        remaining = list(sources)
+        while remaining:
+            source = remaining.pop(0)
+            permit = None if last_resort else self._health(source).allow()
+            if not last_resort and permit is None:
+                continue
+            attempt = self._start_attempt(llm_instances, source, input_data, output_model, timeout, permit)
+            try:
+                if self.hedging["enabled"]:
+                    result = await self._hedge(attempt, source, remaining, last_resort,
+                                               llm_instances, input_data, output_model, timeout)
+                else:
+                    result = await attempt
+            except asyncio.CancelledError:
+                attempt.cancel()
+                raise
+            except asyncio.TimeoutError:
+                print(f"⚠️ {source} timed out. Trying next...")
+                continue
+            except Exception as e:
+                print(f"⚠️ {source} failed: {e}. Trying next...")
+                continue
+            return result
+        return "❌ All LLMs in fallback chain failed."
+
+    async def _hedge(self, attempt, source, remaining, last_resort, llm_instances, input_data,
+                     output_model, timeout):
+        """
+        Wait for `attempt`; if it is slower than the backend's usual
+        `percentile` latency, send the same prompt to the next healthy
+        backend in `remaining` as well and return whichever succeeds first,
+        cancelling the other. The hedge backend is taken out of `remaining`.
+        """
+        self._hedge_counters["requests"] += 1
+        delay = self._health(source).latency(self.hedging["percentile"], min_samples=HEDGE_MIN_SAMPLES)
+        if delay is None or not remaining:
+            return await attempt
+        done, _ = await asyncio.wait({attempt}, timeout=delay)
+        if done:
+            return attempt.result()
+
+        counters = self._hedge_counters
+        if counters["hedges_sent"] >= self.hedging["max_extra_fraction"] * counters["requests"]:
+            counters["skipped_budget"] += 1
+            return await attempt
+        hedge_source = hedge_permit = None
+        for candidate in remaining:
+            hedge_permit = None if last_resort else self._health(candidate).allow()
+            if last_resort or hedge_permit is not None:
+                hedge_source = candidate
+                break
+        if hedge_source is None:
+            return await attempt
+        remaining.remove(hedge_source)
+        counters["hedges_sent"] += 1
+        print(f"⏱️ {source} slower than {delay:.2f}s, hedging with {hedge_source}.")
+        hedge = self._start_attempt(llm_instances, hedge_source, input_data, output_model, timeout, hedge_permit)
+
+        racers = {attempt: source, hedge: hedge_source}
+        error = None
+        try:
+            while racers:
+                done, _ = await asyncio.wait(racers, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    name = racers.pop(task)
+                    if task.exception() is None:
+                        counters["hedge_wins" if task is hedge else "primary_wins"] += 1
+                        return task.result()
+                    error = task.exception()
+                    print(f"⚠️ {name} failed while hedging: {error}")
+        finally:
+            # The loser, or both if the caller itself was cancelled.
+            for task in racers:
+                task.cancel()
+        raise error
+
+    def _start_attempt(self, llm_instances, source, input_data, output_model, timeout, permit):
+        """
+        Task for one attempt. If it is cancelled, even before it started
+        running, its permit is handed back to the backend's circuit breaker.
+        """
+        health = self._health(source)
+        task = asyncio.ensure_future(
+            self._ainvoke_one(llm_instances, source, input_data, output_model, timeout, permit)
+        )
+        task.add_done_callback(lambda t: health.release(permit) if t.cancelled() else None)
+        return task
+
+    async def _ainvoke_one(self, llm_instances, source, input_data, output_model, timeout, permit=None):
+        """One attempt on one backend, recorded in its health statistics."""
+        health = self._health(source)
+        llm = llm_instances[source]
+        if output_model:
+            llm = llm.with_structured_output(output_model)
+
+        async with self._async_limit(source):
+            start_time = time.monotonic()
+            try:
+                result = await asyncio.wait_for(llm.ainvoke(input_data), timeout or self.timeout(source))
+                result = self._check_result(source, result, output_model)
+            except asyncio.TimeoutError as e:
+                health.record_failure(e, time.monotonic() - start_time, timed_out=True, permit=permit)
+                raise
+            except Exception as e:
+                health.record_failure(e, time.monotonic() - start_time, permit=permit)
+                raise
+        health.record_success(time.monotonic() - start_time, permit=permit)
+        self._store_response(source, input_data, result, output_model)
+        return result
+
 
 
 class GroqLLMWrapper(Runnable):
@@ -151,6 +496,9 @@ class GroqLLMWrapper(Runnable):
     def invoke(self, input, config=None):
         return self.groq_client.invoke(input, config=config)
 
+    async def ainvoke(self, input, config=None, **kwargs):
+        return await self.groq_client.ainvoke(input, config=config)
+
     def with_structured_output(self, schema):
         """Wrap Groq with PydanticOutputParser for structured outputs"""
         parser = PydanticOutputParser(pydantic_object=schema)
@@ -169,13 +517,21 @@ class GroqLLMWrapper(Runnable):
                     response = response.content
                 return self.parser.parse(response)
 
+            async def ainvoke(self, prompt, config=None):
+                formatted_prompt = str(prompt) + "\n" + self.parser.get_format_instructions()
+                response = await self.groq_llm.ainvoke(formatted_prompt, config=config)
+                if hasattr(response, "content"):
+                    response = response.content
+                return self.parser.parse(response)
+
         return StructuredGroq(self, parser)
 
 
 class OpenRouterLLM(Runnable):
-    def __init__(self, client, model, temperature, site_url, site_name):
+    def __init__(self, client, model, temperature, site_url, site_name, async_client=None):
         super().__init__()
         self.client = client
+        self.async_client = async_client
         self.model = model
         self.temperature = temperature
         self.site_url = site_url
@@ -199,11 +555,32 @@ class OpenRouterLLM(Runnable):
             print(f"Error during OpenRouter invocation: {e}")
             raise
 
+    async def ainvoke(self, input, config=None, **kwargs):
+        if self.async_client is None:
+            return await super().ainvoke(input, config, **kwargs)
+        prompt = str(input)
+        try:
+            completion = await self.async_client.chat.completions.create(
+                extra_headers={"HTTP-Referer": self.site_url, "X-Title": self.site_name},
+                extra_body={},
+                model=self.model,
+                temperature=float(self.temperature),
+                messages=[{"role": "user", "content": prompt}]
+            )
+            result = completion.choices[0].message.content
+            if not result:
+                raise ValueError("LLM returned an empty response")
+            return result
+        except Exception as e:
+            print(f"Error during OpenRouter invocation: {e}")
+            raise
+
 
 class LMStudioLLM(Runnable):
-    def __init__(self, client, model, temperature):
+    def __init__(self, client, model, temperature, async_client=None):
         super().__init__()
         self.client = client
+        self.async_client = async_client
         self.model = model
         self.temperature = temperature
 
@@ -223,6 +600,24 @@ class LMStudioLLM(Runnable):
             print(f"Error during LMStudio invocation: {e}")
             raise
 
+    async def ainvoke(self, input, config=None, **kwargs):
+        if self.async_client is None:
+            return await super().ainvoke(input, config, **kwargs)
+        prompt = str(input)
+        try:
+            completion = await self.async_client.chat.completions.create(
+                model=self.model,
+                temperature=float(self.temperature),
+                messages=[{"role": "user", "content": prompt}]
+            )
+            result = completion.choices[0].message.content
+            if not result:
+                raise ValueError("LMStudio returned an empty response")
+            return result
+        except Exception as e:
+            print(f"Error during LMStudio invocation: {e}")
+            raise
+
     def with_structured_output(self, schema):
         """Emulate structured output using PydanticOutputParser"""
         parser = PydanticOutputParser(pydantic_object=schema)
@@ -238,6 +633,11 @@ class LMStudioLLM(Runnable):
                 response = self.llm.invoke(formatted_prompt, config=config)
                 return self.parser.parse(response)
 
+            async def ainvoke(self, prompt, config=None):
+                formatted_prompt = str(prompt) + "\n" + self.parser.get_format_instructions()
+                response = await self.llm.ainvoke(formatted_prompt, config=config)
+                return self.parser.parse(response)
+
         return StructuredLMStudio(self, parser)
 # def run_with_fallback(llm_dict, model, prompt, fallback_order):
 #     for name in fallback_order:  # e.g. ["groq", "ollama", "openrouter", "lmstudio"]
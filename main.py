@@ -1,57 +1,171 @@
+import json
+import time
 from pathlib import Path
-from src.pdftomd import convert
-from src.rmlogo import remove_logo_blocks ,clean_caption_md_file
-from src.imgtolat import convert_formula_images_in_md
-from src.imagecaption import analyze_markdown_images
-from src.rmuselessimage import clean_markdown
-from src.notesconverter import rewrite_markdown_file
-
-
-def full_converter(input_pdf:str , output_md:str, ocr: bool = False):
-
+from src.pdftomd import convert, converter_metrics, merge_shards
+from src.rmlogo import strip_logo_blocks, strip_caption_lines
+from src.imgtolat import convert_formula_images
+from src.imagecaption import analyze_markdown_text, summarize_analysis
+from src.rmuselessimage import clean_markdown_text
+from src.notesconverter import rewrite_markdown
+from llminit import llm_metrics
+from src.pipeline import MarkdownDocument, Stage, TextStage, Pipeline
+from src.imageoutput import ImageOutputPolicy, prune_unreferenced_images
+from src.pagerange import count_pages, changed_ranges, split_pages, join_pages
+
+
+def process_metrics() -> dict:
+    """Per-process performance counters, reported back by the job workers."""
+    return {
+        "converter": converter_metrics(),
+        "llm": llm_metrics(),
+    }
+
+
+###########################
+# Stages
+###########################
+def _convert_formulas(doc: MarkdownDocument):
+    doc.text = convert_formula_images(doc.text, doc.path)
+
+
+def _analyze_images(doc: MarkdownDocument):
+    doc.artifacts["analysis"] = analyze_markdown_text(doc.text, str(doc.path.parent))
+
+
+def _remove_useless_images(doc: MarkdownDocument):
+    doc.text = clean_markdown_text(doc.text, doc.artifacts["analysis"])
+
+
+def _rewrite_with_llm(doc: MarkdownDocument):
+    def chunk_done(index, total, markdown):
+        doc.emit("chunk", stage="llm_rewrite", index=index, total=total, content=markdown)
+
+    doc.text = rewrite_markdown(doc.text, order_key="default", on_chunk=chunk_done)
+
+
+def _join_pages(doc: MarkdownDocument):
+    """
+    Keep the Markdown of every converted page as it is at this point (the
+    page cache stores it), splice in the pages reused from an earlier
+    conversion and drop the page markers: everything after this stage works
+    on one ordinary document.
+    """
+    reused = doc.artifacts.get("reuse_pages", {})
+    converted = split_pages(doc.text)
+    if converted is None and not reused:
+        return
+    converted = {page_no: text.strip() for page_no, text in converted or []}
+    doc.artifacts["converted_pages"] = converted
+    doc.artifacts["reused_pages"] = sorted(reused)
+    doc.text = join_pages({**converted, **reused})
+
+
+def _prune_images(doc: MarkdownDocument):
+    removed = prune_unreferenced_images(doc.text, doc.path.parent, doc.workspace)
+    doc.artifacts["pruned_images"] = len(removed)
+
+
+def build_pipeline(use_ai: bool, convert_pages: bool = True) -> Pipeline:
+    """
+    The stages up to join_pages only look at one page at a time; they are
+    left out with `convert_pages=False`, when every page is reused.
+    """
+    stages = []
+    if convert_pages:
+        stages += [
+            TextStage("remove_logos", strip_logo_blocks),
+            Stage("formulas", _convert_formulas),
+            Stage("image_triage", _analyze_images),
+            Stage("remove_useless_images", _remove_useless_images),
+        ]
+    stages.append(Stage("join_pages", _join_pages))
+    if use_ai:
+        stages.append(Stage("llm_rewrite", _rewrite_with_llm))
+    else:
+        stages.append(TextStage("clean_captions", strip_caption_lines))
+    if ImageOutputPolicy.from_env().prune_unreferenced:
+        stages.append(Stage("prune_images", _prune_images))
+    return Pipeline(stages)
+
+
+def _convert_pages(input_path: Path, output_dir: Path, ocr: bool, page_ranges: list) -> Path:
+    """Docling step for several separate page ranges, merged like shards."""
+    if len(page_ranges) == 1:
+        return convert(input_path, output_dir, ocr, page_range=page_ranges[0])
+    outputs = [
+        convert(input_path, output_dir / "shards" / f"{first:05d}-{last:05d}", ocr, page_range=(first, last))
+        for first, last in page_ranges
+    ]
+    return merge_shards(outputs, output_dir)
+
+
+def run_conversion(input_pdf: str, output_md: str, ocr: bool = False, workspace: str = None,
+                   use_ai: bool = True, on_event=None, pages: tuple = None,
+                   shard_outputs: list = None, reuse_pages: dict = None) -> MarkdownDocument:
+    """
+    Every intermediate file (page images, formula crops, analysis report) is
+    written to `workspace`, which defaults to the folder of `output_md`, so
+    concurrent conversions never share scratch files. The Markdown itself
+    stays in memory between stages and is written once at the end.
+    `on_event(dict)` receives stage progress and intermediate Markdown.
+    Only `pages` (1-based, inclusive) are converted when given. When the
+    Docling step already ran in shards, `shard_outputs` lists their Markdown
+    files in page order and they are merged instead of converting again.
+    `reuse_pages` maps page numbers to their Markdown from an earlier
+    conversion, as it was before the LLM rewrite: only the other pages go
+    through Docling, formulas and image triage, then the two are spliced
+    together and the whole document is rewritten (chunks whose text did not
+    change are answered from the LLM response cache). The Markdown of every
+    page that was converted is written to page_markdown.json in the
+    workspace, at the same point.
+    """
     input_path = Path(input_pdf)
-    output_dir = Path("temp")
-    output=convert(input_path, output_dir,ocr)
-
-    # md_file = output_dir / f"{input_path.stem}-with-images.md"
-    remove_logo_blocks(output)
-
-    convert_formula_images_in_md(str(output))
-
-    analysis_results = analyze_markdown_images(str(output))
-    json_report_path = output_dir / "analysis_report.json"
-    with open(json_report_path, 'w', encoding='utf-8') as f:
-        import json
-        json.dump(analysis_results, f, indent=2)
-
-    cleaned_md_path = Path(output_md)
-    clean_markdown(output, json_report_path, cleaned_md_path)
-    rewrite_markdown_file(str(cleaned_md_path), str(cleaned_md_path), order_key="default")
-
-
-def No_ai_converter(input_pdf:str , output_md:str, ocr: bool = False):
-
-    input_path = Path(input_pdf)
-    output_dir = Path("temp")
-    output=convert(input_path, output_dir,ocr)
-
-    # md_file = output_dir / f"{input_path.stem}-with-images.md"
-    remove_logo_blocks(output)
-
-    convert_formula_images_in_md(str(output))
-
-    analysis_results = analyze_markdown_images(str(output))
-    json_report_path = output_dir / "analysis_report.json"
-    with open(json_report_path, 'w', encoding='utf-8') as f:
-        import json
-        json.dump(analysis_results, f, indent=2)
-
-    # Step 5: Clean the markdown file based on JSON report
-    cleaned_md_path = Path(output_md)
-    clean_markdown(output, json_report_path, cleaned_md_path)
-
-    # Step 6: Clean captions from the markdown file (fix here)
-    clean_caption_md_file(cleaned_md_path)
-
-    # rewrite_markdown_file(str(cleaned_md_path), str(cleaned_md_path), order_key="default")
-# full_converter(r"old\preview.pdf", r"final_output.md")
\ No newline at end of file
+    output_dir = Path(workspace) if workspace else Path(output_md).parent
+    reuse_pages = reuse_pages or {}
+
+    if on_event is not None:
+        on_event({"event": "stage", "stage": "docling", "status": "started"})
+    start_time = time.perf_counter()
+    if shard_outputs:
+        output = merge_shards(shard_outputs, output_dir)
+    elif reuse_pages:
+        page_ranges = changed_ranges(count_pages(input_path), reuse_pages)
+        output = _convert_pages(input_path, output_dir, ocr, page_ranges) if page_ranges else None
+    else:
+        output = convert(input_path, output_dir, ocr, page_range=pages)
+    if output is not None:
+        doc = MarkdownDocument.from_file(output, workspace=output_dir, on_event=on_event)
+    else:
+        # Every page is reused: nothing to convert.
+        doc = MarkdownDocument("", Path(output_md), output_dir, on_event=on_event)
+    doc.timings["docling"] = time.perf_counter() - start_time
+    doc.emit("stage", stage="docling", status="finished", seconds=doc.timings["docling"])
+    doc.emit("markdown", stage="docling", content=doc.text)
+
+    doc.artifacts["reuse_pages"] = reuse_pages
+    build_pipeline(use_ai, convert_pages=output is not None).run(doc)
+
+    if "converted_pages" in doc.artifacts:
+        with open(output_dir / "page_markdown.json", 'w', encoding='utf-8') as f:
+            json.dump({str(page_no): text for page_no, text in doc.artifacts["converted_pages"].items()}, f)
+    doc.write(Path(output_md))
+
+    analysis_results = doc.artifacts.get("analysis", [])
+    with open(output_dir / "analysis_report.json", 'w', encoding='utf-8') as f:
+        json.dump({
+            "images": analysis_results,
+            "stats": summarize_analysis(analysis_results),
+            "timings": doc.timings,
+            "reused_pages": doc.artifacts.get("reused_pages", []),
+        }, f, indent=2)
+    return doc
+
+
+def full_converter(input_pdf:str , output_md:str, ocr: bool = False, workspace: str = None, on_event=None, **kwargs):
+    run_conversion(input_pdf, output_md, ocr, workspace, use_ai=True, on_event=on_event, **kwargs)
+
+
+def No_ai_converter(input_pdf:str , output_md:str, ocr: bool = False, workspace: str = None, on_event=None, **kwargs):
+    run_conversion(input_pdf, output_md, ocr, workspace, use_ai=False, on_event=on_event, **kwargs)
+
+# full_converter(r"old\preview.pdf", r"final_output.md")
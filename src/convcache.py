@@ -0,0 +1,222 @@
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from configobj import ConfigObj
+
+_log = logging.getLogger(__name__)
+
+CACHE_ROOT = Path("cache/conversions")
+MAX_CACHE_BYTES = 2 * 1024 ** 3
+# Markdown of single pages as it is before the LLM rewrite, keyed by page
+# fingerprint and page_options().
+PAGE_CACHE_ROOT = Path("cache/pages")
+MAX_PAGE_CACHE_BYTES = 1024 ** 3
+# Bump when a pipeline change makes older cached Markdown stale.
+CACHE_VERSION = 4
+# Options that only change what happens after the pages are joined.
+WHOLE_DOCUMENT_OPTIONS = ("pages", "kind", "llm_models", "llm_order")
+
+IMAGE_LINK_RE = re.compile(r'(!\[[^\]]*\]\()([^)]+)(\))')
+
+
+def options_fingerprint(ocr: bool, kind: str, config_path: str = "config.ini", pages: tuple = None) -> dict:
+    """Everything besides the PDF bytes that changes the converted Markdown."""
+    from src.visionmodel import MODEL_NAME
+    from src.imageoutput import ImageOutputPolicy
+    from src.pagerange import INCREMENTAL_PAGES
+
+    options = {
+        "version": CACHE_VERSION,
+        "ocr": bool(ocr),
+        "kind": kind,
+        "vision_model": MODEL_NAME,
+    }
+    if pages:
+        options["pages"] = list(pages)
+    if INCREMENTAL_PAGES:
+        options["page_mode"] = True
+    image_format = ImageOutputPolicy.from_env().image_format
+    if image_format != "png":
+        options["image_format"] = image_format
+    if kind == "ai":
+        config = ConfigObj(config_path)
+        options["llm_models"] = {
+            section: config[section].get("model")
+            for section in config if section.startswith("llms_")
+        }
+        options["llm_order"] = config.get("default-order", {}).get("order")
+    return options
+
+
+def page_options(options: dict) -> dict:
+    """The part of options_fingerprint() a cached page depends on."""
+    return {name: value for name, value in options.items() if name not in WHOLE_DOCUMENT_OPTIONS}
+
+
+def cache_key(pdf_sha256: str, options: dict) -> str:
+    payload = pdf_sha256 + json.dumps(options, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _resolve_image(ref: str, md_dir: Path):
+    """Image links are either relative to the working directory or to the Markdown file."""
+    for candidate in (Path(ref), md_dir / ref):
+        if candidate.is_file():
+            return candidate
+    return None
+
+
+class ConversionCache:
+    """
+    On-disk cache of finished conversions, one folder per key holding the
+    Markdown, the images it links to and a small meta.json. Entries are
+    evicted least-recently-used once the cache grows past `max_bytes`.
+    """
+
+    def __init__(self, root: Path = CACHE_ROOT, max_bytes: int = MAX_CACHE_BYTES):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def _entry_dir(self, key: str) -> Path:
+        if not re.fullmatch(r"[0-9a-f]{64}", key):
+            raise ValueError(f"Invalid cache key: {key!r}")
+        return self.root / key
+
+    def has(self, key: str) -> bool:
+        """Whether `key` is cached, without counting a lookup."""
+        return (self._entry_dir(key) / "meta.json").exists()
+
+    def restore_text(self, key: str, images_dir: Path):
+        """
+        Copy a cached entry's images into `images_dir` and return its Markdown
+        with the links pointing at them. Returns None on a miss.
+        """
+        images_dir = Path(images_dir)
+        entry = self._entry_dir(key)
+        with self._lock:
+            if not (entry / "meta.json").exists():
+                self._counters["misses"] += 1
+                return None
+            self._counters["hits"] += 1
+            # mtime of meta.json is the LRU clock.
+            os.utime(entry / "meta.json")
+
+            if (entry / "images").exists():
+                shutil.copytree(entry / "images", images_dir, dirs_exist_ok=True)
+            md_text = (entry / "output.md").read_text(encoding="utf-8")
+
+        prefix = images_dir.as_posix()
+
+        def relink(m):
+            ref = m.group(2)
+            if ref.startswith("images/"):
+                ref = f"{prefix}/{ref[len('images/'):]}"
+            return f"{m.group(1)}{ref}{m.group(3)}"
+
+        return IMAGE_LINK_RE.sub(relink, md_text)
+
+    def restore(self, key: str, output_md: Path) -> bool:
+        """
+        Copy a cached conversion next to `output_md`. Returns False on a miss.
+        """
+        output_md = Path(output_md)
+        md_text = self.restore_text(key, output_md.parent / "images")
+        if md_text is None:
+            return False
+        output_md.write_text(md_text, encoding="utf-8")
+        return True
+
+    def store(self, key: str, md_path: Path, options: dict = None):
+        """Copy a finished conversion and the images it references into the cache."""
+        md_path = Path(md_path)
+        self.store_text(key, md_path.read_text(encoding="utf-8"), md_path.parent, options)
+
+    def store_text(self, key: str, md_text: str, base_dir: Path, options: dict = None):
+        """Like store(), for Markdown in memory whose relative links resolve against `base_dir`."""
+        base_dir = Path(base_dir)
+        tmp_dir = self.root / f".{key}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        (tmp_dir / "images").mkdir(parents=True)
+
+        copied = {}
+
+        def collect(m):
+            ref = m.group(2)
+            src = _resolve_image(ref, base_dir)
+            if src is None:
+                return m.group(0)
+            if ref not in copied:
+                name = f"{len(copied):04d}_{src.name}"
+                shutil.copy2(src, tmp_dir / "images" / name)
+                copied[ref] = f"images/{name}"
+            return f"{m.group(1)}{copied[ref]}{m.group(3)}"
+
+        (tmp_dir / "output.md").write_text(IMAGE_LINK_RE.sub(collect, md_text), encoding="utf-8")
+        size = sum(f.stat().st_size for f in tmp_dir.rglob("*") if f.is_file())
+        with open(tmp_dir / "meta.json", "w", encoding="utf-8") as f:
+            json.dump({"key": key, "options": options, "created": time.time(), "bytes": size}, f)
+
+        entry = self._entry_dir(key)
+        with self._lock:
+            shutil.rmtree(entry, ignore_errors=True)
+            os.replace(tmp_dir, entry)
+            self._counters["stores"] += 1
+            self._evict()
+
+    def _entries(self):
+        entries = []
+        for meta_path in self.root.glob("*/meta.json"):
+            try:
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    size = json.load(f).get("bytes", 0)
+                entries.append((meta_path.stat().st_mtime, size, meta_path.parent))
+            except (OSError, ValueError):
+                continue
+        return entries
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            self._counters["evictions"] += 1
+            _log.info(f"Evicted cached conversion {entry.name}")
+
+    def invalidate(self, key: str = None) -> int:
+        """Drop one entry, or every entry when `key` is None. Returns the number removed."""
+        with self._lock:
+            if key is not None:
+                entry = self._entry_dir(key)
+                if not entry.exists():
+                    return 0
+                shutil.rmtree(entry, ignore_errors=True)
+                return 1
+            removed = 0
+            for _, _, entry in self._entries():
+                shutil.rmtree(entry, ignore_errors=True)
+                removed += 1
+            return removed
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._entries()
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                **self._counters,
+                "hit_ratio": self._counters["hits"] / lookups if lookups else None,
+                "entries": len(entries),
+                "bytes": sum(size for _, size, _ in entries),
+                "max_bytes": self.max_bytes,
+            }
@@ -0,0 +1,116 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+
+FORMULA_DB_PATH = Path("cache/formula_latex.sqlite3")
+MAX_FORMULA_ENTRIES = 50000
+# Preload the most used formulas into memory when the cache is opened.
+FORMULA_CACHE_WARM_START = os.getenv("FORMULA_CACHE_WARM_START", "0") == "1"
+WARM_START_ENTRIES = 2000
+
+
+def crop_hash(image_path: Path) -> str:
+    with open(image_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class FormulaCache:
+    """
+    Persistent crop-hash -> LaTeX cache shared by every worker process.
+    Hit/miss counters are kept in the database too, so any process (e.g. the
+    API server) can report the hit ratio. Least-recently-used rows are
+    evicted once the table grows past `max_entries`.
+    """
+
+    def __init__(self, db_path: Path = FORMULA_DB_PATH, max_entries: int = MAX_FORMULA_ENTRIES,
+                 warm_start: bool = FORMULA_CACHE_WARM_START):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS formulas ("
+            " sha256 TEXT PRIMARY KEY,"
+            " latex TEXT NOT NULL,"
+            " hits INTEGER NOT NULL DEFAULT 0,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS formulas_last_used ON formulas (last_used)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._conn.commit()
+        self._memory = {}
+        if warm_start:
+            self._memory = dict(self._conn.execute(
+                "SELECT sha256, latex FROM formulas ORDER BY hits DESC LIMIT ?", (WARM_START_ENTRIES,)
+            ))
+
+    def _bump(self, name: str, amount: int):
+        if amount:
+            self._conn.execute(
+                "INSERT INTO counters (name, value) VALUES (?, ?)"
+                " ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                (name, amount),
+            )
+
+    def get_many(self, hashes: list) -> dict:
+        """Return {sha256: latex} for the hashes already recognized."""
+        found = {h: self._memory[h] for h in hashes if h in self._memory}
+        missing = [h for h in hashes if h not in found]
+        with self._lock:
+            for i in range(0, len(missing), 500):
+                chunk = missing[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                found.update(self._conn.execute(
+                    f"SELECT sha256, latex FROM formulas WHERE sha256 IN ({placeholders})", chunk
+                ))
+            if found:
+                self._conn.executemany(
+                    "UPDATE formulas SET hits = hits + 1, last_used = ? WHERE sha256 = ?",
+                    [(time.time(), h) for h in found],
+                )
+            self._bump("hits", len(found))
+            self._bump("misses", len(hashes) - len(found))
+            self._conn.commit()
+        return found
+
+    def put_many(self, latex_by_hash: dict):
+        if not latex_by_hash:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO formulas (sha256, latex, hits, last_used) VALUES (?, ?, 0, ?)",
+                [(h, latex, now) for h, latex in latex_by_hash.items()],
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM formulas").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM formulas WHERE sha256 IN"
+                " (SELECT sha256 FROM formulas ORDER BY last_used ASC LIMIT ?)",
+                (excess,),
+            )
+            self._bump("evictions", excess)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._conn.execute("SELECT name, value FROM counters"))
+            (entries,) = self._conn.execute("SELECT COUNT(*) FROM formulas").fetchone()
+        hits, misses = counters.get("hits", 0), counters.get("misses", 0)
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "hits": hits,
+            "misses": misses,
+            "evictions": counters.get("evictions", 0),
+            "hit_ratio": hits / (hits + misses) if hits + misses else None,
+        }
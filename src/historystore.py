@@ -0,0 +1,112 @@
+import json
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+
+_log = logging.getLogger(__name__)
+
+HISTORY_DB_PATH = Path("History/history.sqlite3")
+LEGACY_HISTORY_FILE = Path("History/history.json")
+
+
+class HistoryStore:
+    """
+    Conversion history in SQLite (WAL): inserts are single-row appends and
+    lookups by session id or file name use an index, instead of rewriting a
+    JSON file on every conversion. Entries are stored as the same dicts the
+    API returns. An existing history.json is merged in when the store is opened.
+    """
+
+    def __init__(self, db_path: Path = HISTORY_DB_PATH, legacy_json: Path = LEGACY_HISTORY_FILE):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS history ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " session_id TEXT,"
+            " filename_lower TEXT,"
+            " timestamp TEXT,"
+            " entry TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS history_session ON history (session_id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS history_filename ON history (filename_lower)")
+        self._conn.commit()
+        if legacy_json is not None:
+            self._migrate(Path(legacy_json))
+
+    @staticmethod
+    def _row(entry: dict) -> tuple:
+        filename = entry.get("filename")
+        return (
+            entry.get("session_id"),
+            filename.lower() if filename else None,
+            entry.get("timestamp"),
+            json.dumps(entry, ensure_ascii=False),
+        )
+
+    def _migrate(self, legacy_json: Path):
+        """
+        Import the old history.json and move it aside. Entries already in the
+        database (same session, file and timestamp) are skipped, so a file
+        left next to a populated database is merged rather than dropped.
+        """
+        if not legacy_json.exists():
+            return
+        with open(legacy_json, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+        with self._lock:
+            known = set(self._conn.execute("SELECT session_id, filename_lower, timestamp FROM history"))
+            rows = []
+            for entry in entries:
+                row = self._row(entry)
+                if row[:3] not in known:
+                    known.add(row[:3])
+                    rows.append(row)
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT INTO history (session_id, filename_lower, timestamp, entry) VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+        legacy_json.replace(legacy_json.with_name(legacy_json.name + ".migrated"))
+        _log.info(f"Imported {len(rows)} of {len(entries)} history entries from {legacy_json}")
+
+    def append(self, entry: dict):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO history (session_id, filename_lower, timestamp, entry) VALUES (?, ?, ?, ?)",
+                self._row(entry),
+            )
+
+    def entries(self, limit: int = None, offset: int = 0, newest_first: bool = True) -> list:
+        order = "DESC" if newest_first else "ASC"
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT entry FROM history ORDER BY id {order} LIMIT ? OFFSET ?",
+                (-1 if limit is None else limit, offset),
+            ).fetchall()
+        return [json.loads(entry) for (entry,) in rows]
+
+    def count(self) -> int:
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM history").fetchone()
+        return count
+
+    def by_session(self, session_id: str) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT entry FROM history WHERE session_id = ? ORDER BY id", (session_id,)
+            ).fetchall()
+        return [json.loads(entry) for (entry,) in rows]
+
+    def by_filename(self, filename: str) -> list:
+        """Entries recorded for `filename` (case-insensitive), newest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT entry FROM history WHERE filename_lower = ? ORDER BY id DESC",
+                (filename.lower(),),
+            ).fetchall()
+        return [json.loads(entry) for (entry,) in rows]
@@ -4,20 +4,53 @@ import mimetypes
 import json
 import time
 import logging  # <-- Import the logging module
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
 from PIL import Image
 from google import genai
 from google.genai import types
+from google.genai import errors as genai_errors
 import google.api_core.exceptions
 from dotenv import load_dotenv
+from src.ratelimit import TokenBucket, SharedTokenBucket
+from src.verdictcache import VerdictCache, exact_hash, perceptual_hash, hamming_distance
+from src.imagefilter import classify_image
+from src.visionmodel import MODEL_NAME
 
 # --- ADD THIS LINE ---
 # Suppress INFO logs from all 'google' sub-loggers
 logging.getLogger('google').setLevel(logging.WARNING)
 load_dotenv()
 # Configuration
-MODEL_NAME = "gemini-2.5-flash-lite-preview-09-2025"
-REQUESTS_BEFORE_PAUSE = 15
-PAUSE_SECONDS = 30
+# Provider quota and how many requests may be in flight at once.
+REQUESTS_PER_MINUTE = int(os.getenv("GEMINI_REQUESTS_PER_MINUTE", "30"))
+MAX_CONCURRENT_REQUESTS = int(os.getenv("GEMINI_MAX_CONCURRENT_REQUESTS", "4"))
+MAX_RETRIES = 5
+# Point the client at another endpoint, e.g. a local stub server for benchmarks.
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+_rate_limiter = None
+_verdict_cache = None
+
+
+def get_rate_limiter() -> SharedTokenBucket:
+    """
+    Shared through SQLite by every analysis in every worker process, so the
+    whole server stays within one GEMINI_REQUESTS_PER_MINUTE quota. Opened on
+    first use so that importing this module touches no files.
+    """
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = SharedTokenBucket(REQUESTS_PER_MINUTE, name="gemini")
+    return _rate_limiter
+
+
+def get_verdict_cache() -> VerdictCache:
+    global _verdict_cache
+    if _verdict_cache is None:
+        _verdict_cache = VerdictCache()
+    return _verdict_cache
 
 def load_image_bytes(image_path: str):
     """Loads image file data and returns bytes + mime_type, or (None, None) on error."""
@@ -36,10 +69,12 @@ def load_image_bytes(image_path: str):
         print(f"Error loading image {image_path}: {e}")
         return None, None
 
-def call_gemini_vision(client, image_bytes: bytes, mime_type: str, context_text: str):
+def call_gemini_vision(client, image_bytes: bytes, mime_type: str, context_text: str,
+                       limiter: TokenBucket = None):
     """
     Calls the Gemini API via SDK with the image and context to get a structured analysis.
-    Implements exponential backoff for retry attempts.
+    Waits on `limiter` before every attempt and retries transient errors with
+    exponential backoff, honouring the server's Retry-After hint when present.
     """
 
     system_instruction = (
@@ -71,9 +106,10 @@ def call_gemini_vision(client, image_bytes: bytes, mime_type: str, context_text:
         }
     )
 
-    max_retries = 3
     delay = 1
-    for attempt in range(max_retries):
+    for attempt in range(MAX_RETRIES):
+        if limiter is not None:
+            limiter.acquire()
         try:
             response = client.models.generate_content(
                 model=MODEL_NAME,
@@ -85,32 +121,68 @@ def call_gemini_vision(client, image_bytes: bytes, mime_type: str, context_text:
                 return json.loads(text)
             except json.JSONDecodeError:
                 print(f"Invalid JSON from model:\n{text}")
-                return {"is_useful": False, "reason": "Model returned invalid JSON"}
-        except (google.api_core.exceptions.ServiceUnavailable,
+                return {"is_useful": False, "reason": "Model returned invalid JSON", "failed": True}
+        except (genai_errors.APIError,
+                google.api_core.exceptions.ServiceUnavailable,
                 google.api_core.exceptions.DeadlineExceeded,
                 google.api_core.exceptions.InternalServerError) as e:
-            print(f"Transient API error ({attempt+1}/{max_retries}): {e}")
-            if attempt < max_retries - 1:
-                time.sleep(delay)
-                delay *= 2
+            code = getattr(e, "code", None)
+            if isinstance(e, genai_errors.APIError) and code not in RETRYABLE_STATUS_CODES:
+                print(f"Unexpected error: {e}")
+                return {"is_useful": False, "reason": str(e), "failed": True}
+            if attempt == MAX_RETRIES - 1:
+                return {"is_useful": False, "reason": f"API request failed after retries: {e}", "failed": True}
+
+            retry_after = _retry_after_seconds(e)
+            wait = retry_after if retry_after is not None else delay
+            print(f"Transient API error ({attempt+1}/{MAX_RETRIES}), retrying in {wait:.1f}s: {e}")
+            if code == 429 and limiter is not None:
+                # Quota exhausted: hold back every worker, not just this one.
+                limiter.pause(wait)
             else:
-                return {"is_useful": False, "reason": f"API request failed after retries: {e}"}
+                time.sleep(wait)
+            delay *= 2
         except Exception as e:
             print(f"Unexpected error: {e}")
-            return {"is_useful": False, "reason": str(e)}
-    return {"is_useful": False, "reason": "All retries failed."}
+            return {"is_useful": False, "reason": str(e), "failed": True}
+    return {"is_useful": False, "reason": "All retries failed.", "failed": True}
 
-def analyze_markdown_images(md_file_path: str):
-    """
-    Analyze images in a Markdown file using the Gemini Vision model.
-    Loads API key from environment internally and initializes client automatically.
-    """
-    # Setup Gemini client
+
+def _retry_after_seconds(error):
+    """Server-suggested wait from a Retry-After header or a google.rpc.RetryInfo detail."""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if headers:
+        value = headers.get("retry-after")
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+    details = getattr(error, "details", None)
+    if isinstance(details, dict):
+        for detail in details.get("error", {}).get("details", []) or []:
+            if str(detail.get("@type", "")).endswith("RetryInfo"):
+                try:
+                    return float(str(detail.get("retryDelay", "")).rstrip("s"))
+                except ValueError:
+                    pass
+    return None
+
+
+def create_gemini_client():
     api_key = os.getenv("GOOGLE_API_KEY")
     if not api_key:
         raise RuntimeError("Missing GOOGLE_API_KEY in environment variables.")
-    client = genai.Client(api_key=api_key)
+    if GEMINI_BASE_URL:
+        return genai.Client(api_key=api_key, http_options=types.HttpOptions(base_url=GEMINI_BASE_URL))
+    return genai.Client(api_key=api_key)
+
 
+def analyze_markdown_images(md_file_path: str):
+    """
+    Analyze images in a Markdown file using the Gemini Vision model.
+    See analyze_markdown_text.
+    """
     # Read Markdown file
     try:
         with open(md_file_path, 'r', encoding='utf-8') as f:
@@ -122,55 +194,116 @@ def analyze_markdown_images(md_file_path: str):
         print(f"Error reading markdown file: {e}")
         return []
 
-    results = []
-    base_dir = os.path.dirname(md_file_path)
+    return analyze_markdown_text(md_content, os.path.dirname(md_file_path))
+
+
+def analyze_markdown_text(md_content: str, base_dir: str):
+    """
+    Analyze the images linked from Markdown text using the Gemini Vision model.
+    Relative links are resolved against `base_dir`.
+    Loads API key from environment internally and initializes client automatically.
+    Verdicts are reused from the persistent cache for exact and near-duplicate
+    images, and each distinct picture in the document is sent only once.
+    Requests run concurrently within the shared rate limit; results keep the
+    order in which the images appear in the document.
+    """
+    # Setup Gemini client
+    client = create_gemini_client()
+
     image_regex = r'!\[.*?\]\((.*?)\)'
     image_matches = list(re.finditer(image_regex, md_content))
     total_images = len(image_matches)
     print(f"Found {total_images} total images to analyze.")
 
-    request_count = 0
+    verdict_cache = get_verdict_cache()
+    results = []
+    pending = []  # (result index, image bytes, mime type, context) sent to Gemini
+    groups = []   # [sha256, phash, representative result index, member indexes]
 
-    for i, match in enumerate(image_matches):
+    for match in image_matches:
         image_path = match.group(1)
         full_image_path = os.path.normpath(os.path.join(base_dir, image_path)) \
             if not os.path.isabs(image_path) else image_path
+        if not os.path.exists(full_image_path) and os.path.exists(unquote(full_image_path)):
+            # Docling percent-encodes link targets (e.g. spaces in the PDF name).
+            full_image_path = unquote(full_image_path)
+        result = {
+            "image_path": image_path,
+            "full_path": full_image_path,
+        }
+        results.append(result)
 
-        # print(f"\n--- Analyzing image {i+1} of {total_images} ---")
-        # print(f"Found image link: {image_path} -> {full_image_path}")
+        img_bytes, mime_type = load_image_bytes(full_image_path)
+        if not img_bytes:
+            result.update(is_useful=False, reason="Image file could not be loaded.", source="unreadable")
+            continue
+
+        verdict = classify_image(image_path, img_bytes)
+        if verdict:
+            result.update(verdict, source="heuristic")
+            continue
+
+        sha256 = exact_hash(img_bytes)
+        phash = perceptual_hash(img_bytes)
+        verdict, source = verdict_cache.lookup(sha256, phash)
+        if verdict:
+            result.update(is_useful=verdict["is_useful"], reason=verdict["reason"], source=source)
+            continue
+
+        # Repeated logos and footer art within this document: ask once.
+        group = next((g for g in groups if g[0] == sha256 or (
+            phash is not None and g[1] is not None
+            and hamming_distance(phash, g[1]) <= verdict_cache.max_distance)), None)
+        if group:
+            group[3].append(len(results) - 1)
+            continue
 
         context_start = max(0, match.start() - 500)
         context_end = min(len(md_content), match.end() + 500)
         context_text = md_content[context_start:context_end]
+        groups.append([sha256, phash, len(results) - 1, []])
+        pending.append((len(results) - 1, img_bytes, mime_type, context_text))
 
-        img_bytes, mime_type = load_image_bytes(full_image_path)
-        if img_bytes:
-            # Rate limiting
-            if request_count >= REQUESTS_BEFORE_PAUSE:
-                print(f"Reached {REQUESTS_BEFORE_PAUSE} requests — pausing for {PAUSE_SECONDS} seconds...")
-                time.sleep(PAUSE_SECONDS)
-                request_count = 0
-
-            analysis = call_gemini_vision(client, img_bytes, mime_type, context_text)
-            request_count += 1
-
-            results.append({
-                "image_path": image_path,
-                "full_path": full_image_path,
-                "is_useful": analysis.get("is_useful", False),
-                "reason": analysis.get("reason", "Analysis missing reason or failed.")
-            })
-        else:
-            results.append({
-                "image_path": image_path,
-                "full_path": full_image_path,
-                "is_useful": False,
-                "reason": "Image file could not be loaded."
-            })
+    limiter = get_rate_limiter()
+
+    def analyze(item):
+        _, img_bytes, mime_type, context_text = item
+        return call_gemini_vision(client, img_bytes, mime_type, context_text, limiter=limiter)
+
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as pool:
+        analyses = list(pool.map(analyze, pending))
+
+    for (sha256, phash, index, members), analysis in zip(groups, analyses):
+        verdict = {
+            "is_useful": analysis.get("is_useful", False),
+            "reason": analysis.get("reason", "Analysis missing reason or failed."),
+        }
+        if not analysis.get("failed"):
+            verdict_cache.store(sha256, phash, verdict)
+        results[index].update(verdict, source="error" if analysis.get("failed") else "gemini")
+        for member in members:
+            results[member].update(verdict, source="document-duplicate")
 
     return results
 
 
+def summarize_analysis(results: list) -> dict:
+    """Per-source counts, Gemini calls made/saved and the verdict-cache hit rate."""
+    sources = {}
+    for result in results:
+        sources[result.get("source", "gemini")] = sources.get(result.get("source", "gemini"), 0) + 1
+    remote = sources.get("gemini", 0) + sources.get("error", 0)
+    cached = sources.get("cache-exact", 0) + sources.get("cache-near", 0) + sources.get("document-duplicate", 0)
+    analyzed = len(results) - sources.get("unreadable", 0)
+    return {
+        "images": len(results),
+        "sources": sources,
+        "remote_calls": remote,
+        "remote_calls_saved": analyzed - remote,
+        "cache_hit_rate": cached / analyzed if analyzed else None,
+    }
+
+
 # if __name__ == "__main__":
 #     print("--- Markdown Image Analyzer ---")
 
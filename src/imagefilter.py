@@ -0,0 +1,61 @@
+import io
+import re
+from PIL import Image
+
+# Docling picture classes that are never worth keeping / always worth keeping.
+DECORATIVE_CLASSES = {"logo", "icon", "signature", "stamp", "qr_code", "bar_code"}
+INFORMATIVE_CLASSES = {
+    "bar_chart", "line_chart", "pie_chart", "flow_chart", "map",
+    "chemistry_markush_structure", "chemistry_molecular_structure",
+}
+
+MIN_SIDE_PX = 24           # smaller than this is an icon or bullet
+MIN_AREA_PX = 48 * 48
+MAX_ASPECT_RATIO = 12.0    # thinner than this is a rule, divider or arrow
+MAX_FLAT_COLOURS = 2       # one or two colours: solid shape or blank box
+MIN_ENTROPY = 1.0          # bits; near-uniform images carry no information
+MIN_CHART_SIDE_PX = 120    # classified charts smaller than this still go to Gemini
+
+# pdftomd.convert names pictures "<doc>-picture-<class>-<n>.png".
+PICTURE_CLASS_RE = re.compile(r'(?:^|-)picture-([a-z_]+)-\d+\.\w+$')
+
+
+def picture_class_from_path(image_path: str):
+    match = PICTURE_CLASS_RE.search(image_path.replace("\\", "/").rsplit("/", 1)[-1])
+    return match.group(1) if match else None
+
+
+def classify_image(image_path: str, image_bytes: bytes):
+    """
+    Cheap local verdict for obviously decorative or obviously informative images.
+    Returns a {"is_useful", "reason"} dict, or None when the image is ambiguous
+    and should be sent to the vision model.
+    """
+    label = picture_class_from_path(image_path)
+    if label in DECORATIVE_CLASSES:
+        return {"is_useful": False, "reason": f"Classified by Docling as {label}."}
+
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            width, height = img.size
+            if min(width, height) < MIN_SIDE_PX or width * height < MIN_AREA_PX:
+                return {"is_useful": False, "reason": f"Too small to be informative ({width}x{height})."}
+            if max(width, height) / max(1, min(width, height)) > MAX_ASPECT_RATIO:
+                return {"is_useful": False, "reason": f"Extreme aspect ratio ({width}x{height}), likely a divider."}
+
+            # Downscale before the pixel statistics; they do not need full resolution.
+            sample = img.convert("RGB")
+            sample.thumbnail((128, 128))
+            colours = sample.getcolors(maxcolors=MAX_FLAT_COLOURS)
+            if colours is not None:
+                return {"is_useful": False, "reason": f"Only {len(colours)} colour(s), likely a decorative shape."}
+            entropy = sample.convert("L").entropy()
+            if entropy < MIN_ENTROPY:
+                return {"is_useful": False, "reason": f"Near-uniform image (entropy {entropy:.2f} bits)."}
+    except Exception:
+        # Undecodable here does not mean useless; let the vision model decide.
+        return None
+
+    if label in INFORMATIVE_CLASSES and min(width, height) >= MIN_CHART_SIDE_PX:
+        return {"is_useful": True, "reason": f"Classified by Docling as {label}."}
+    return None
@@ -0,0 +1,109 @@
+import os
+import re
+from pathlib import Path
+
+# Extension and PIL format name per supported encoder.
+IMAGE_FORMATS = {
+    "png": ("png", "PNG"),
+    "webp": ("webp", "WEBP"),
+    "jpeg": ("jpg", "JPEG"),
+}
+
+IMAGE_LINK_RE = re.compile(r'!\[[^\]]*\]\(([^)]+)\)')
+# Files a conversion writes per element; page renders are left alone because
+# they are produced on request and cached.
+ELEMENT_IMAGE_RE = re.compile(r'(-picture-[a-z_]+-\d+|-table-\d+|^formula_\d+)\.(png|webp|jpg)$')
+
+
+class ImageOutputPolicy:
+    """
+    Which images a conversion writes to disk and how they are encoded.
+    By default only the pictures the Markdown links to are written; full
+    page renders and table crops are not referenced by the Markdown and are
+    rendered on request instead (see `render_page`).
+    """
+
+    def __init__(self, page_images: bool = False, table_images: bool = False,
+                 prune_unreferenced: bool = True, image_format: str = "png",
+                 quality: int = 85, compress_level: int = 1):
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f"Unsupported image format {image_format!r}, expected one of {sorted(IMAGE_FORMATS)}.")
+        self.page_images = page_images
+        self.table_images = table_images
+        # Drop the pictures the pipeline removed from the Markdown once it has finished.
+        self.prune_unreferenced = prune_unreferenced
+        self.image_format = image_format
+        self.quality = quality
+        # zlib level for PNG; 1 is several times faster than PIL's default of 6
+        # for a few percent more bytes.
+        self.compress_level = compress_level
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            page_images=os.getenv("SAVE_PAGE_IMAGES", "0") == "1",
+            table_images=os.getenv("SAVE_TABLE_IMAGES", "0") == "1",
+            prune_unreferenced=os.getenv("PRUNE_UNREFERENCED_IMAGES", "1") == "1",
+            image_format=os.getenv("IMAGE_FORMAT", "png").lower(),
+            quality=int(os.getenv("IMAGE_QUALITY", "85")),
+            compress_level=int(os.getenv("IMAGE_COMPRESS_LEVEL", "1")),
+        )
+
+    @property
+    def extension(self) -> str:
+        return IMAGE_FORMATS[self.image_format][0]
+
+    def save(self, image, path_without_suffix: Path) -> Path:
+        """Encode a PIL image next to `path_without_suffix` and return the file written."""
+        extension, pil_format = IMAGE_FORMATS[self.image_format]
+        path = Path(f"{path_without_suffix}.{extension}")
+        if pil_format == "PNG":
+            image.save(path, pil_format, compress_level=self.compress_level)
+        elif pil_format == "JPEG":
+            image.convert("RGB").save(path, pil_format, quality=self.quality, optimize=True)
+        else:
+            image.save(path, pil_format, quality=self.quality, method=4)
+        return path
+
+
+def render_page(pdf_path: Path, page_no: int, output_path: Path, scale: float = 2.0,
+                policy: ImageOutputPolicy = None) -> Path:
+    """
+    Render one 1-based page of the PDF with pdfium and encode it with the
+    policy's encoder. Used to serve page images only when they are asked for.
+    """
+    import pypdfium2 as pdfium
+
+    policy = policy or ImageOutputPolicy.from_env()
+    pdf = pdfium.PdfDocument(str(pdf_path))
+    try:
+        if not 1 <= page_no <= len(pdf):
+            raise ValueError(f"Page {page_no} is outside the document (1-{len(pdf)}).")
+        image = pdf[page_no - 1].render(scale=scale).to_pil()
+    finally:
+        pdf.close()
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    return policy.save(image, output_path.with_suffix(""))
+
+
+def prune_unreferenced_images(markdown: str, md_dir: Path, workspace: Path) -> list:
+    """
+    Delete the picture, table and formula files in `workspace` that the
+    finished Markdown no longer links to. Returns the removed paths.
+    """
+    md_dir, workspace = Path(md_dir), Path(workspace)
+    referenced = set()
+    for ref in IMAGE_LINK_RE.findall(markdown):
+        for candidate in (Path(ref), md_dir / ref):
+            if candidate.is_file():
+                referenced.add(candidate.resolve())
+    removed = []
+    for folder in (workspace, workspace / "formulas"):
+        if not folder.is_dir():
+            continue
+        for f in folder.iterdir():
+            if ELEMENT_IMAGE_RE.search(f.name) and f.resolve() not in referenced:
+                f.unlink()
+                removed.append(f)
+    return removed
@@ -1,7 +1,11 @@
+import os
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from pix2text import Pix2Text
 import logging
+from src.formulacache import FormulaCache, crop_hash
 import onnxruntime
 import warnings
 # --- Suppress warnings and info logs ---
@@ -17,47 +21,172 @@ for noisy_logger in ["pix2text", "cnocr", "cnstd", "rapidocr"]:
 
 # Silence root and fastai/transformers-level logs
 logging.getLogger().setLevel(logging.ERROR)
-def convert_formula_images_in_md(md_path, output_path=None):
+
+FORMULA_PATTERN = re.compile(r'\$\$!\[Formula\]\(([^)]+\.(?:png|jpg|jpeg|gif|bmp))\)\$\$')
+# Crops per model call, and how many batches run at once.
+FORMULA_BATCH_SIZE = int(os.getenv("FORMULA_BATCH_SIZE", "8"))
+FORMULA_WORKERS = int(os.getenv("FORMULA_WORKERS", "2"))
+# ONNX Runtime intra-op threads per inference, so workers x threads ~ cores.
+FORMULA_INTRA_OP_THREADS = max(1, (os.cpu_count() or 1) // max(1, FORMULA_WORKERS))
+
+_p2t = None
+_p2t_lock = threading.Lock()
+_formula_cache = None
+
+
+def get_formula_cache() -> FormulaCache:
+    global _formula_cache
+    with _p2t_lock:
+        if _formula_cache is None:
+            _formula_cache = FormulaCache()
+    return _formula_cache
+
+
+def _formula_session_threads(p2t) -> set:
+    """intra_op_num_threads of the formula recognizer's ONNX sessions (empty if not inspectable)."""
+    latex_ocr = getattr(getattr(p2t, "text_formula_ocr", None), "latex_ocr", None)
+    model = getattr(latex_ocr, "model", None)
+    threads = set()
+    for part in ("encoder", "decoder", "decoder_with_past"):
+        session = getattr(getattr(model, part, None), "session", None)
+        if session is not None:
+            threads.add(session.get_session_options().intra_op_num_threads)
+    return threads
+
+
+def get_pix2text():
+    """Process-wide Pix2Text instance; loading the models is the expensive part."""
+    global _p2t
+    with _p2t_lock:
+        if _p2t is None:
+            session_options = onnxruntime.SessionOptions()
+            session_options.intra_op_num_threads = FORMULA_INTRA_OP_THREADS
+            # Pix2Text -> TextFormulaOCR ("text_formula") -> LatexOCR ("formula"),
+            # whose more_model_configs go to ORTModelForVision2Seq.from_pretrained.
+            try:
+                _p2t = Pix2Text.from_config(
+                    total_configs={"text_formula": {"formula": {
+                        "more_model_configs": {"session_options": session_options},
+                    }}},
+                    log_level='ERROR',
+                )
+            except Exception as e:
+                print(f"Could not apply ONNX Runtime thread settings ({e}); using defaults.")
+                _p2t = Pix2Text(log_level='ERROR')
+            threads = _formula_session_threads(_p2t)
+            if threads != {FORMULA_INTRA_OP_THREADS}:
+                print(f"Formula model runs with intra-op threads {sorted(threads) or 'unknown'}, "
+                      f"expected {FORMULA_INTRA_OP_THREADS}.")
+    return _p2t
+
+
+def _resolve_formula_image(img_rel_path: str, md_path: Path) -> Path:
+    img_path = Path(img_rel_path)
+
+    # --- Auto-fix redundant "temp/temp" path case ---
+    # If the Markdown file's parent folder name appears at the start of image path, drop it
+    md_parent = md_path.parent.name
+    parts = img_path.parts
+    if len(parts) > 1 and parts[0].lower() == md_parent.lower():
+        img_path = Path(*parts[1:])
+
+    # Resolve full path correctly
+    return (md_path.parent / img_path).resolve()
+
+
+def recognize_formulas(image_paths: list) -> dict:
     """
-    Convert formula images in Markdown file to LaTeX using Pix2Text.
+    Recognize formula crops in batches across a thread pool sharing one model.
+    Returns {path: latex} for the crops that were recognized.
+    """
+    p2t = get_pix2text()
+    batches = [image_paths[i:i + FORMULA_BATCH_SIZE]
+               for i in range(0, len(image_paths), FORMULA_BATCH_SIZE)]
+
+    def recognize_batch(batch):
+        try:
+            return list(zip(batch, p2t.recognize_formula([str(p) for p in batch], batch_size=len(batch))))
+        except Exception as e:
+            print(f"Batch formula recognition failed ({e}); retrying one by one.")
+        results = []
+        for path in batch:
+            try:
+                results.append((path, p2t.recognize_formula(str(path))))
+            except Exception as e:
+                print(f"Error converting {path.name}: {e}")
+        return results
+
+    latex_by_path = {}
+    with ThreadPoolExecutor(max_workers=FORMULA_WORKERS) as pool:
+        for batch_results in pool.map(recognize_batch, batches):
+            for path, latex in batch_results:
+                latex = (latex or "").strip()
+                if latex:
+                    latex_by_path[path] = latex
+    return latex_by_path
+
+
+def convert_formula_images(content: str, md_path) -> str:
+    """
+    Convert formula images in Markdown text to LaTeX using Pix2Text.
+    Image links are resolved relative to `md_path`, the file the text belongs to.
+    All crops are collected first, looked up in the LaTeX cache, the rest are
+    recognized in batches, and everything is spliced back in one pass.
     Handles redundant folder prefixes like 'temp/temp/formulas/...'.
     """
     md_path = Path(md_path).resolve()
-    output_path = Path(output_path).resolve() if output_path else md_path
 
-    p2t = Pix2Text(log_level='ERROR')
+    resolved = {}
+    for match in FORMULA_PATTERN.finditer(content):
+        img_rel_path = match.group(1)
+        if img_rel_path in resolved:
+            continue
+        full_img_path = _resolve_formula_image(img_rel_path, md_path)
+        if not full_img_path.exists():
+            print(f"Warning: Image not found - {full_img_path}")
+            continue
+        resolved[img_rel_path] = full_img_path
 
-    with open(md_path, 'r', encoding='utf-8') as f:
-        content = f.read()
+    if not resolved:
+        return content
 
-    pattern = r'\$\$!\[Formula\]\(([^)]+\.(?:png|jpg|jpeg|gif|bmp))\)\$\$'
+    # Identical crops (the same equation repeated on every slide) are looked
+    # up by content hash and only the unseen ones go through the model.
+    cache = get_formula_cache()
+    hash_by_path = {path: crop_hash(path) for path in dict.fromkeys(resolved.values())}
+    latex_by_hash = cache.get_many(list(set(hash_by_path.values())))
+    unseen = {}
+    for path, digest in hash_by_path.items():
+        if digest not in latex_by_hash:
+            unseen.setdefault(digest, path)
+    if unseen:
+        recognized = recognize_formulas(list(unseen.values()))
+        new_latex = {digest: recognized[path] for digest, path in unseen.items() if path in recognized}
+        cache.put_many(new_latex)
+        latex_by_hash.update(new_latex)
+    latex_by_path = {path: latex_by_hash.get(digest) for path, digest in hash_by_path.items()}
 
     def replace_formula(match):
-        img_rel_path = match.group(1)
-        img_path = Path(img_rel_path)
+        full_img_path = resolved.get(match.group(1))
+        latex_code = latex_by_path.get(full_img_path)
+        if not latex_code:
+            return match.group(0)
+        return f"$$\n{latex_code}\n$$"
 
-        # --- Auto-fix redundant "temp/temp" path case ---
-        # If the Markdown file's parent folder name appears at the start of image path, drop it
-        md_parent = md_path.parent.name
-        parts = img_path.parts
-        if len(parts) > 1 and parts[0].lower() == md_parent.lower():
-            img_path = Path(*parts[1:])
+    return FORMULA_PATTERN.sub(replace_formula, content)
 
-        # Resolve full path correctly
-        full_img_path = (md_path.parent / img_path).resolve()
 
-        if not full_img_path.exists():
-            print(f"Warning: Image not found - {full_img_path}")
-            return match.group(0)
+def convert_formula_images_in_md(md_path, output_path=None):
+    """
+    Convert formula images in Markdown file to LaTeX using Pix2Text.
+    """
+    md_path = Path(md_path).resolve()
+    output_path = Path(output_path).resolve() if output_path else md_path
 
-        try:
-            latex_code = p2t.recognize(str(full_img_path), show_bar=False).strip()
-            return latex_code or match.group(0)
-        except Exception as e:
-            print(f"Error converting {full_img_path.name}: {e}")
-            return match.group(0)
+    with open(md_path, 'r', encoding='utf-8') as f:
+        content = f.read()
 
-    new_content = re.sub(pattern, replace_formula, content)
+    new_content = convert_formula_images(content, md_path)
 
     with open(output_path, 'w', encoding='utf-8') as f:
         f.write(new_content)
@@ -0,0 +1,392 @@
+import os
+import time
+import uuid
+import logging
+import threading
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import Future, ProcessPoolExecutor
+import psutil
+from src.pagerange import count_pages, plan_shards, changed_ranges
+
+_log = logging.getLogger(__name__)
+
+# Each worker holds its own copy of the Docling, Pix2Text and OCR models.
+RAM_PER_WORKER_BYTES = 3 * 1024 ** 3
+# Jobs allowed to wait for a free worker before submissions are refused.
+MAX_QUEUED_JOBS = 8
+# Finished jobs are forgotten after this long.
+JOB_RETENTION_SECONDS = 3600
+# Progress events kept per job; older ones are dropped (the final Markdown is
+# always read from disk, so nothing is lost for the client).
+MAX_EVENTS_PER_JOB = 500
+# Documents longer than this are converted by several workers in parallel,
+# each taking at least this many pages.
+SHARD_PAGES = int(os.getenv("SHARD_PAGES", "40"))
+
+
+class QueueFullError(Exception):
+    """Raised when the queue is at capacity; the API turns this into a 429."""
+
+
+def default_worker_count() -> int:
+    """Size the pool to the CPU count, capped by how many model sets fit in RAM."""
+    cpus = os.cpu_count() or 1
+    by_ram = psutil.virtual_memory().available // RAM_PER_WORKER_BYTES
+    return max(1, min(cpus, int(by_ram)))
+
+
+###########################
+# Worker-side functions (run inside the pool processes)
+###########################
+_event_queue = None
+
+
+def _init_worker(event_queue=None, setup=None):
+    global _event_queue
+    _event_queue = event_queue
+
+    from src.pdftomd import warm_converters
+    from src.imgtolat import get_pix2text, get_formula_cache
+    warm_converters()
+    get_pix2text()
+    get_formula_cache()
+    if setup is not None:
+        setup()
+
+
+def _worker_report():
+    from main import process_metrics
+    return {"pid": os.getpid(), "metrics": process_metrics()}
+
+
+def _emit(job_id: str, event: dict):
+    if _event_queue is not None:
+        _event_queue.put((job_id, {**event, "time": time.time()}))
+
+
+def _convert_shard(job_id: str, input_pdf: str, shard_dir: str, ocr: bool, page_range: tuple) -> str:
+    """Run only the Docling step for one page range, into its own folder."""
+    from src.pdftomd import convert
+
+    start_time = time.perf_counter()
+    output = convert(Path(input_pdf), Path(shard_dir), ocr, page_range=page_range)
+    _emit(job_id, {"event": "shard", "pages": list(page_range), "status": "finished",
+                   "seconds": time.perf_counter() - start_time})
+    return str(output)
+
+
+def _run_job(job_id: str, kind: str, input_pdf: str, output_md: str, ocr: bool, workspace: str,
+             pages: tuple = None, shard_outputs: list = None, reuse_pages: dict = None):
+    from main import full_converter, No_ai_converter
+
+    converter = full_converter if kind == "ai" else No_ai_converter
+    converter(input_pdf, output_md, ocr, workspace=workspace,
+              on_event=lambda event: _emit(job_id, event),
+              pages=pages, shard_outputs=shard_outputs, reuse_pages=reuse_pages)
+    report = _worker_report()
+    report["output_md"] = output_md
+    return report
+
+
+###########################
+# Parent-side queue
+###########################
+class JobQueue:
+    def __init__(self, max_workers: int = None, max_queued: int = MAX_QUEUED_JOBS, worker_setup=None):
+        self.max_workers = max_workers or default_worker_count()
+        self.max_queued = max_queued
+        # Picklable callable run in every worker once it has loaded its models.
+        self.worker_setup = worker_setup
+        self._executor = None
+        self._jobs = {}
+        self._worker_metrics = {}
+        self._lock = threading.Lock()
+        self._event_queue = None
+
+    def start(self):
+        # "spawn" keeps the workers independent of the server's threads and of
+        # any model state already loaded in the parent.
+        context = multiprocessing.get_context("spawn")
+        self._event_queue = context.Queue()
+        threading.Thread(target=self._drain_events, args=(self._event_queue,), daemon=True).start()
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self._event_queue, self.worker_setup),
+        )
+        # One warm-up call per worker so every process loads its models before
+        # the first real upload arrives.
+        for _ in range(self.max_workers):
+            self._executor.submit(_worker_report).add_done_callback(self._record_worker_report)
+        _log.info(f"Started conversion pool with {self.max_workers} worker(s).")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if self._event_queue is not None:
+            self._event_queue.put(None)
+            self._event_queue = None
+
+    def _drain_events(self, event_queue):
+        """Move progress events sent by the workers onto their jobs."""
+        while True:
+            item = event_queue.get()
+            if item is None:
+                return
+            job_id, event = item
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None:
+                    continue
+                job["event_count"] += 1
+                job["events"].append(event)
+                del job["events"][:-MAX_EVENTS_PER_JOB]
+
+    def _record_worker_report(self, future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        report = future.result()
+        with self._lock:
+            self._worker_metrics[report["pid"]] = report["metrics"]
+
+    def _prune(self):
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        for job_id in [j for j, job in self._jobs.items()
+                       if job["finished_at"] and job["finished_at"] < cutoff]:
+            del self._jobs[job_id]
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if not job["future"].done())
+
+    def _submit_sharded(self, job_id: str, kind: str, input_pdf: str, output_md: str, ocr: bool,
+                        workspace: str, shards: list, reuse_pages: dict = None) -> Future:
+        """
+        Convert each page range on its own worker, then run the rest of the
+        pipeline once on the merged result. Returns a future for the whole job.
+        """
+        job_future = Future()
+        job_future.set_running_or_notify_cancel()
+        shard_futures = [
+            self._executor.submit(
+                _convert_shard, job_id, input_pdf,
+                str(Path(workspace) / "shards" / f"{first:05d}-{last:05d}"), ocr, (first, last),
+            )
+            for first, last in shards
+        ]
+        remaining = [len(shard_futures)]
+        remaining_lock = threading.Lock()
+
+        def copy_result(fut):
+            if fut.cancelled():
+                job_future.set_exception(RuntimeError("Job was cancelled."))
+            elif fut.exception() is not None:
+                job_future.set_exception(fut.exception())
+            else:
+                job_future.set_result(fut.result())
+
+        def shard_done(fut):
+            with remaining_lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            failed = [f for f in shard_futures if f.cancelled() or f.exception() is not None]
+            if failed:
+                copy_result(failed[0])
+                return
+            try:
+                final = self._executor.submit(
+                    _run_job, job_id, kind, input_pdf, output_md, ocr, workspace,
+                    shard_outputs=[f.result() for f in shard_futures], reuse_pages=reuse_pages,
+                )
+            except RuntimeError as e:
+                job_future.set_exception(e)
+                return
+            final.add_done_callback(copy_result)
+
+        for fut in shard_futures:
+            fut.add_done_callback(shard_done)
+        return job_future
+
+    def submit(self, kind: str, input_pdf: str, output_md: str, ocr: bool = False,
+               workspace: str = None, meta: dict = None, on_done=None, pages: tuple = None,
+               reuse_pages: dict = None) -> str:
+        """
+        Queue a conversion and return its job id.
+        All intermediate files go to `workspace` (default: the folder of `output_md`).
+        `on_done(job)` is called in the parent once the job has succeeded.
+        Only `pages` (1-based, inclusive) are converted when given; long page
+        spans are split into shards that run on several workers at once.
+        `reuse_pages` ({page_no: Markdown from the page cache}) skips those
+        pages; each run of other pages is converted as its own shard.
+        Raises ValueError if `pages` lies outside the document.
+        """
+        if self._executor is None:
+            raise RuntimeError("Job queue has not been started.")
+
+        try:
+            page_count = count_pages(input_pdf)
+        except Exception as e:
+            # Let Docling report unreadable files; just do not shard them.
+            _log.warning(f"Could not count pages of {input_pdf}: {e}")
+            shards = [pages] if pages else [None]
+            reuse_pages = None
+        else:
+            if reuse_pages:
+                shards = changed_ranges(page_count, reuse_pages)
+            else:
+                shards = plan_shards(page_count, pages, SHARD_PAGES, self.max_workers)
+
+        with self._lock:
+            self._prune()
+            pending = sum(1 for job in self._jobs.values() if not job["future"].done())
+            if pending >= self.max_workers + self.max_queued:
+                raise QueueFullError(f"{pending} conversions already pending.")
+
+            job_id = uuid.uuid4().hex
+            workspace = workspace or str(Path(output_md).parent)
+            if len(shards) > 1:
+                future = self._submit_sharded(job_id, kind, input_pdf, output_md, bool(ocr), workspace,
+                                              shards, reuse_pages=reuse_pages)
+            else:
+                future = self._executor.submit(_run_job, job_id, kind, input_pdf, output_md, bool(ocr),
+                                               workspace, pages=shards[0] if pages and shards else None,
+                                               reuse_pages=reuse_pages)
+            self._jobs[job_id] = {
+                "job_id": job_id,
+                "kind": kind,
+                "output_md": output_md,
+                "workspace": workspace,
+                "meta": meta or {},
+                "shards": len(shards),
+                "submitted_at": time.time(),
+                "finished_at": None,
+                "error": None,
+                "future": future,
+                "post_processing": True,
+                "events": [],
+                "event_count": 0,
+            }
+
+        def _finished(fut):
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None:
+                    return
+                job["finished_at"] = time.time()
+                if fut.cancelled():
+                    job["error"] = "Job was cancelled."
+                elif fut.exception() is not None:
+                    job["error"] = str(fut.exception())
+            if job["error"] is None:
+                self._record_worker_report(fut)
+                if on_done is not None:
+                    try:
+                        on_done(job)
+                    except Exception as e:
+                        _log.error(f"Post-processing for job {job_id} failed: {e}")
+            else:
+                _log.warning(f"Job {job_id} failed: {job['error']}")
+            with self._lock:
+                job["post_processing"] = False
+
+        future.add_done_callback(_finished)
+        return job_id
+
+    def add_completed(self, kind: str, output_md: str, workspace: str = None, meta: dict = None) -> str:
+        """Register a job whose output already exists (e.g. restored from cache)."""
+        future = Future()
+        future.set_result({"output_md": output_md})
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._prune()
+            self._jobs[job_id] = {
+                "job_id": job_id,
+                "kind": kind,
+                "output_md": output_md,
+                "workspace": workspace or str(Path(output_md).parent),
+                "meta": meta or {},
+                "shards": 0,
+                "submitted_at": time.time(),
+                "finished_at": time.time(),
+                "error": None,
+                "future": future,
+                "post_processing": False,
+                "events": [],
+                "event_count": 0,
+            }
+        return job_id
+
+    def active_workspaces(self) -> list:
+        """Workspaces of jobs still converting or still being post-processed."""
+        with self._lock:
+            return [job["workspace"] for job in self._jobs.values()
+                    if not job["future"].done() or job["post_processing"]]
+
+    def future(self, job_id: str):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job["future"] if job else None
+
+    def events(self, job_id: str, since: int = 0):
+        """
+        Progress events of a job numbered from `since` onwards, as
+        (next_since, events), or None if the job is unknown.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            first = job["event_count"] - len(job["events"])
+            start = max(since, first)
+            return job["event_count"], job["events"][start - first:]
+
+    def get(self, job_id: str):
+        """Public view of a job, or None if unknown."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            future = job["future"]
+            error = job["error"]
+            if future.done() and error is None:
+                # The done-callback may not have run yet.
+                if future.cancelled():
+                    error = "Job was cancelled."
+                elif future.exception() is not None:
+                    error = str(future.exception())
+            if future.done():
+                status = "failed" if error else "done"
+            elif future.running():
+                status = "running"
+            else:
+                status = "queued"
+            return {
+                "job_id": job_id,
+                "kind": job["kind"],
+                "status": status,
+                "error": error,
+                "submitted_at": job["submitted_at"],
+                "finished_at": job["finished_at"],
+                "output_md": job["output_md"],
+                "workspace": job["workspace"],
+                "shards": job["shards"],
+                **job["meta"],
+            }
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = sum(1 for job in self._jobs.values() if not job["future"].done())
+            return {
+                "workers": self.max_workers,
+                "pending": pending,
+                "capacity": self.max_workers + self.max_queued,
+                "tracked_jobs": len(self._jobs),
+            }
+
+    def worker_metrics(self) -> dict:
+        with self._lock:
+            return {str(pid): metrics for pid, metrics in self._worker_metrics.items()}
@@ -0,0 +1,136 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+
+LLM_CACHE_DB_PATH = Path("cache/llm_responses.sqlite3")
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", 30 * 24 * 3600))
+MAX_LLM_CACHE_BYTES = int(os.getenv("MAX_LLM_CACHE_BYTES", 256 * 1024 ** 2))
+
+
+def response_key(source: str, model: str, temperature: float, prompt: str) -> str:
+    payload = json.dumps([source, model, float(temperature), hashlib.sha256(prompt.encode("utf-8")).hexdigest()])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    Persistent (backend, model, temperature, prompt) -> response cache shared
+    by every worker process. Entries expire after `ttl_seconds`; once the
+    stored responses exceed `max_bytes` the least recently used are evicted.
+    Hit/miss counters live in the database so the API server can report them.
+    """
+
+    def __init__(self, db_path: Path = LLM_CACHE_DB_PATH, ttl_seconds: float = LLM_CACHE_TTL_SECONDS,
+                 max_bytes: int = MAX_LLM_CACHE_BYTES):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " source TEXT,"
+            " model TEXT,"
+            " response TEXT NOT NULL,"
+            " bytes INTEGER NOT NULL,"
+            " created REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._conn.commit()
+
+    def _bump(self, name: str, amount: int = 1):
+        if amount:
+            self._conn.execute(
+                "INSERT INTO counters (name, value) VALUES (?, ?)"
+                " ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                (name, amount),
+            )
+
+    def lookup(self, keys: list):
+        """
+        First of `keys` (in order) with a live cached response, as
+        (key, response), or (None, None). Counts as one hit or one miss.
+        """
+        now = time.time()
+        with self._lock:
+            placeholders = ",".join("?" * len(keys))
+            found = dict(self._conn.execute(
+                f"SELECT key, response FROM responses WHERE key IN ({placeholders}) AND created >= ?",
+                (*keys, now - self.ttl_seconds),
+            ))
+            key = next((k for k in keys if k in found), None)
+            if key is not None:
+                self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self._bump("hits" if key is not None else "misses")
+            self._conn.commit()
+        return key, found.get(key)
+
+    def put(self, key: str, source: str, model: str, response: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, source, model, response, bytes, created, last_used)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, source, model, response, len(response.encode("utf-8")), now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        expired = self._conn.execute(
+            "DELETE FROM responses WHERE created < ?", (now - self.ttl_seconds,)
+        ).rowcount
+        self._bump("expired", expired)
+        (total,) = self._conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM responses").fetchone()
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for key, size in self._conn.execute(
+            "SELECT key, bytes FROM responses ORDER BY last_used ASC"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        self._bump("evictions", evicted)
+
+    def delete(self, keys: list) -> int:
+        with self._lock:
+            removed = self._conn.executemany("DELETE FROM responses WHERE key = ?", [(k,) for k in keys]).rowcount
+            self._conn.commit()
+        return removed
+
+    def clear(self) -> int:
+        with self._lock:
+            removed = self._conn.execute("DELETE FROM responses").rowcount
+            self._conn.commit()
+        return removed
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._conn.execute("SELECT name, value FROM counters"))
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM responses"
+            ).fetchone()
+        hits, misses = counters.get("hits", 0), counters.get("misses", 0)
+        return {
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": hits,
+            "misses": misses,
+            "expired": counters.get("expired", 0),
+            "evictions": counters.get("evictions", 0),
+            "hit_ratio": hits / (hits + misses) if hits + misses else None,
+        }
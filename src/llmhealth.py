@@ -0,0 +1,193 @@
+import re
+import time
+import threading
+from collections import deque
+
+# Rolling window of recent calls used for latency percentiles and error rate.
+HEALTH_WINDOW = 50
+# Consecutive failures that open a backend's circuit.
+FAILURE_THRESHOLD = 3
+# How long an open circuit skips the backend; doubles on every re-open.
+BASE_COOLDOWN_SECONDS = 15.0
+MAX_COOLDOWN_SECONDS = 300.0
+
+
+# Exception classes the backend SDKs (openai, groq, google) raise for HTTP 429.
+RATE_LIMIT_ERROR_NAMES = frozenset({"RateLimitError", "ResourceExhausted", "TooManyRequests"})
+# Fallback for wrapped errors that only keep the message.
+RATE_LIMIT_MESSAGE_RE = re.compile(r"\b429\b.{0,40}too many requests|\brate[ _-]?limit(ed)?\b",
+                                   re.IGNORECASE)
+
+
+def _status_code(error):
+    for candidate in (error, getattr(error, "response", None)):
+        for attr in ("status_code", "status", "code"):
+            status = getattr(candidate, attr, None)
+            if isinstance(status, int):
+                return status
+    return None
+
+
+def is_rate_limited(error) -> bool:
+    """Whether `error`, or an exception it was raised from, is an HTTP 429."""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if _status_code(error) == 429:
+            return True
+        if any(cls.__name__ in RATE_LIMIT_ERROR_NAMES for cls in type(error).__mro__):
+            return True
+        if RATE_LIMIT_MESSAGE_RE.search(str(error)):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def retry_after_seconds(error):
+    """Server-suggested wait from a Retry-After header, if the error carries one."""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if headers:
+        value = headers.get("retry-after")
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+    return None
+
+
+def _percentile(sorted_values: list, fraction: float):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+class Permit:
+    """
+    Handed out by BackendHealth.allow() for one call and given back with its
+    outcome. `trial` marks the single call let through while half-open.
+    """
+
+    __slots__ = ("trial",)
+
+    def __init__(self, trial: bool = False):
+        self.trial = trial
+
+
+class BackendHealth:
+    """
+    Rolling latency / error statistics and a circuit breaker for one LLM
+    backend. The circuit opens after FAILURE_THRESHOLD consecutive failures,
+    or at once on a 429, and the backend is skipped until the cooldown ends.
+    Then a single trial call is let through (half-open): success closes the
+    circuit, failure re-opens it with twice the cooldown. While the circuit
+    is not closed only the call holding the trial permit settles it; calls
+    started earlier (e.g. cancelled hedge losers) are merely counted.
+    """
+
+    def __init__(self, source: str):
+        self.source = source
+        self._lock = threading.Lock()
+        self._window = deque(maxlen=HEALTH_WINDOW)  # (ok, latency seconds)
+        self._consecutive_failures = 0
+        self._open_until = 0.0
+        self._cooldown = BASE_COOLDOWN_SECONDS
+        self._trial = None
+        self.counters = {"calls": 0, "failures": 0, "timeouts": 0, "rate_limited": 0,
+                         "circuit_opened": 0, "skipped": 0}
+
+    def state(self, now: float = None) -> str:
+        now = time.monotonic() if now is None else now
+        if self._open_until == 0.0:
+            return "closed"
+        return "open" if now < self._open_until else "half-open"
+
+    def allow(self):
+        """
+        A Permit for one call now, or None if the backend is to be skipped.
+        When half-open the permit is the trial slot, held until it is passed
+        back to record_success(), record_failure() or release().
+        """
+        with self._lock:
+            state = self.state()
+            if state == "closed":
+                return Permit()
+            if state == "half-open" and self._trial is None:
+                self._trial = Permit(trial=True)
+                return self._trial
+            self.counters["skipped"] += 1
+            return None
+
+    def available(self) -> bool:
+        """Like allow(), without claiming anything; used for routing decisions."""
+        with self._lock:
+            state = self.state()
+            return state == "closed" or (state == "half-open" and self._trial is None)
+
+    def release(self, permit):
+        """Give back the permit of a call that was abandoned (e.g. cancelled)."""
+        with self._lock:
+            if permit is not None and permit is self._trial:
+                self._trial = None
+
+    def _settles(self, permit) -> bool:
+        """Whether the outcome of the call holding `permit` decides the circuit state."""
+        if permit is not None and permit is self._trial:
+            self._trial = None
+            return True
+        return self.state() == "closed"
+
+    def record_success(self, latency: float, permit=None):
+        with self._lock:
+            self.counters["calls"] += 1
+            self._window.append((True, latency))
+            self._consecutive_failures = 0
+            if self._settles(permit):
+                self._open_until = 0.0
+                self._cooldown = BASE_COOLDOWN_SECONDS
+
+    def record_failure(self, error=None, latency: float = None, timed_out: bool = False, permit=None):
+        with self._lock:
+            self.counters["calls"] += 1
+            self.counters["failures"] += 1
+            self._window.append((False, latency))
+            self._consecutive_failures += 1
+            rate_limited = error is not None and is_rate_limited(error)
+            if timed_out:
+                self.counters["timeouts"] += 1
+            if rate_limited:
+                self.counters["rate_limited"] += 1
+
+            was_trial = permit is not None and permit is self._trial
+            if not self._settles(permit):
+                return
+            if rate_limited or was_trial or self._consecutive_failures >= FAILURE_THRESHOLD:
+                cooldown = (retry_after_seconds(error) if rate_limited else None) or self._cooldown
+                self._open_until = time.monotonic() + cooldown
+                self._cooldown = min(MAX_COOLDOWN_SECONDS, self._cooldown * 2)
+                self.counters["circuit_opened"] += 1
+
+    def latency(self, fraction: float = 0.5, min_samples: int = 1):
+        """
+        Latency percentile of the recent successful calls, or None with fewer
+        than `min_samples` of them.
+        """
+        with self._lock:
+            latencies = sorted(latency for ok, latency in self._window if ok)
+        if len(latencies) < min_samples:
+            return None
+        return _percentile(latencies, fraction)
+
+    def stats(self) -> dict:
+        with self._lock:
+            latencies = sorted(latency for ok, latency in self._window if ok)
+            errors = sum(1 for ok, _ in self._window if not ok)
+            now = time.monotonic()
+            return {
+                **self.counters,
+                "state": self.state(now),
+                "open_for_seconds": max(0.0, self._open_until - now) if self._open_until else 0.0,
+                "error_rate": errors / len(self._window) if self._window else None,
+                "latency_p50": _percentile(latencies, 0.5),
+                "latency_p95": _percentile(latencies, 0.95),
+            }
@@ -1,14 +1,47 @@
 import os
 import re
 import sys
+import asyncio
+import hashlib
 import logging
 from typing import List
 from typing import Optional 
-from llminit import LLMManager
+from llminit import LLMManager, get_llm_manager
 # === Configuration ===
 INPUT_PATH = r"final_output.md"
 OUTPUT_PATH = r"final_output2.md"
 ORDER_KEY = "default"
+# Long documents are rewritten in heading-aligned chunks of at most this size,
+# each with the heading of the section before it as read-only context.
+CHUNK_MAX_CHARS = 6000
+# A chunk ends before a heading the heading itself picks as a boundary (about
+# one in CHUNK_BOUNDARY_EVERY), once it holds CHUNK_MIN_CHARS. Boundaries thus
+# follow the sections rather than a running character count, and an edit only
+# changes the chunk it falls in.
+CHUNK_MIN_CHARS = 1500
+CHUNK_BOUNDARY_EVERY = 4
+# Chunks in flight at once (each backend also caps its own concurrency).
+CHUNK_WORKERS = 4
+LLM_FAILURE_PREFIX = "❌"
+PLACEHOLDER_RE = re.compile(r'__(?:MATH_DISPLAY|MATH_INLINE|IMAGE)_\d+__')
+PLACEHOLDER_KIND_RE = re.compile(r'__(MATH_DISPLAY|MATH_INLINE|IMAGE)_\d+__')
+ESCAPED_PLACEHOLDER_RE = re.compile(r'(?:\\?_){2}[A-Z\\_]+?\d+(?:\\?_){2}')
+IMAGE_LINK_PATH_RE = re.compile(r'!\[([^\]]*)\]\(([^)]+)\)')
+IMAGE_PLACEHOLDER_PATH_RE = re.compile(r'\[Image\]\(([^)]+)\)')
+PLACEHOLDER_LINE_TOKENS = frozenset({'screenshot', 'other', 'bar chart', 'chart', 'image', 'temp\\temp', 'temp/temp'})
+PLACEHOLDER_LINE_RE = re.compile(r'\s*(screenshot|other|bar chart|chart)\s*', flags=re.IGNORECASE)
+HEADING_LINE_RE = re.compile(r'(?m)^(#{1,6}\s.*)$')
+HEADING_PREFIX_RE = re.compile(r'#{1,6}\s')
+BARE_HEADING_RE = re.compile(r'#{1,6}')
+# Said about images when the model sees their links (the whole-document prompt)
+# and when it only sees __IMAGE_n__ tokens (chunk prompts).
+IMAGE_CAPTION_RULE = "If an image is present, keep it with a short caption."
+IMAGE_TOKEN_RULE = (
+    "Images are given as __IMAGE_n__ tokens whose content you cannot see: keep each token "
+    "where it is and do not caption or describe it."
+)
+# Leading characters of a section's body that count towards its duplicate key.
+SECTION_KEY_CHARS = 200
 
 
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
@@ -21,14 +54,16 @@ def normalize_image_paths(md: str) -> str:
     def fix_path(p: str) -> str:
         return p.replace("\\", "/")
 
-    md = re.sub(
-        r'!\[([^\]]*)\]\(([^)]+)\)',
+    # Nothing to fix without a backslash; skips two scans of the whole text.
+    if "\\" not in md:
+        return md
+
+    md = IMAGE_LINK_PATH_RE.sub(
         lambda m: f'![{m.group(1)}]({fix_path(m.group(2))})',
         md
     )
 
-    md = re.sub(
-        r'\[Image\]\(([^)]+)\)',
+    md = IMAGE_PLACEHOLDER_PATH_RE.sub(
         lambda m: f'[Image]({fix_path(m.group(1))})',
         md
     )
@@ -36,14 +71,15 @@ def normalize_image_paths(md: str) -> str:
     return md
 
 
+def is_placeholder_line(ln: str) -> bool:
+    return ln.strip().lower() in PLACEHOLDER_LINE_TOKENS or PLACEHOLDER_LINE_RE.fullmatch(ln) is not None
+
+
 def remove_placeholder_lines(md: str) -> str:
     lines = md.splitlines()
     keep = []
-    placeholder_tokens = {'screenshot', 'other', 'bar chart', 'chart', 'image', 'temp\\temp', 'temp/temp'}
     for ln in lines:
-        if ln.strip().lower() in placeholder_tokens:
-            continue
-        if re.fullmatch(r'\s*(screenshot|other|bar chart|chart)\s*', ln, flags=re.IGNORECASE):
+        if is_placeholder_line(ln):
             continue
         if len(ln.strip().split()) == 1 and ln.strip().lower() in {'other', 'screenshot'}:
             continue
@@ -64,7 +100,7 @@ def collapse_consecutive_duplicates(md: str) -> str:
 
 
 def dedupe_adjacent_identical_sections(md: str) -> str:
-    parts = re.split(r'(?m)^(#{1,6}\s.*)$', md)
+    parts = HEADING_LINE_RE.split(md)
     out_parts = []
     seen = set()
     i = 0
@@ -75,7 +111,7 @@ def dedupe_adjacent_identical_sections(md: str) -> str:
             continue
         heading = parts[i]
         content = parts[i + 1] if (i + 1) < len(parts) else ""
-        key = heading.strip() + "::" + content.strip()[:200]
+        key = heading.strip() + "::" + content.strip()[:SECTION_KEY_CHARS]
         if key in seen:
             i += 2
             continue
@@ -105,27 +141,118 @@ def preserve_math_blocks(md: str) -> tuple[str, dict]:
     return md, token_map
 
 
+def preserve_image_links(md: str) -> tuple[str, dict]:
+    token_map = {}
+
+    def repl_image(m):
+        token = f"__IMAGE_{len(token_map)}__"
+        token_map[token] = m.group(0)
+        return token
+
+    md = re.sub(r'!\[[^\]]*\]\([^)]+\)', repl_image, md)
+    return md, token_map
+
+
 def restore_math_blocks(md: str, token_map: dict) -> str:
-    for token, math in token_map.items():
-        md = md.replace(token, math)
-    return md
+    # One scan for all placeholders instead of one str.replace per token.
+    if not token_map:
+        return md
+    return PLACEHOLDER_RE.sub(lambda m: token_map.get(m.group(0), m.group(0)), md)
+
+
+def _section_bounds(lines: list) -> list:
+    """
+    Line ranges [start, end) of the pieces re.split(HEADING_LINE_RE, ...)
+    would cut "\n".join(lines) into: text, heading, text, heading, ..., text.
+    A line of bare '#'s is a heading only together with the line after it,
+    because the pattern's \\s then matches the newline.
+    """
+    bounds = []
+    start = 0
+    k = 0
+    while k < len(lines):
+        line = lines[k]
+        end = None
+        if line.startswith("#"):
+            if HEADING_PREFIX_RE.match(line):
+                end = k + 1
+            elif BARE_HEADING_RE.fullmatch(line) and k + 1 < len(lines):
+                end = k + 2
+        if end is None:
+            k += 1
+            continue
+        bounds.append((start, k))
+        bounds.append((k, end))
+        start = k = end
+    bounds.append((start, len(lines)))
+    return bounds
 
 
 def local_clean(md_text: str) -> str:
-    md_text = normalize_image_paths(md_text)
-    md_text = remove_placeholder_lines(md_text)
-    md_text = collapse_consecutive_duplicates(md_text)
-    md_text = dedupe_adjacent_identical_sections(md_text)
-    md_text = re.sub(r'\n{3,}', '\n\n', md_text)
-    md_text = "\n".join([ln.rstrip() for ln in md_text.splitlines()])
-    md_text = md_text.strip() + "\n"
-    return md_text
+    """
+    Same result as applying normalize_image_paths, remove_placeholder_lines,
+    collapse_consecutive_duplicates, dedupe_adjacent_identical_sections, a
+    blank-line collapse and a per-line rstrip one after the other, but the
+    document is split into lines once and every rule runs in the same scan
+    (plus one walk over the section boundaries).
+    """
+    lines = []
+    prev = None
+    last_kept = None
+    last_appended = False
+    for ln in normalize_image_paths(md_text).splitlines():
+        if is_placeholder_line(ln):
+            continue
+        stripped = ln.strip()
+        last_kept = ln
+        last_appended = stripped != prev
+        if last_appended:
+            lines.append(ln)
+            prev = stripped
+    # The step-by-step version re-joins and re-splits between rules, which
+    # loses a trailing empty line.
+    if last_kept == "" and last_appended:
+        lines.pop()
+
+    # Drop repeated (section, start of following section) pairs.
+    bounds = _section_bounds(lines)
+    seen = set()
+    kept = []
+    i = 0
+    while i < len(bounds):
+        start, end = bounds[i]
+        text = "\n".join(lines[start:end]).strip()
+        if not text:
+            kept.append(bounds[i])
+            i += 1
+            continue
+        pair = bounds[i:i + 2]
+        following = "\n".join(lines[pair[1][0]:pair[1][1]]).strip() if len(pair) == 2 else ""
+        key = text + "::" + following[:SECTION_KEY_CHARS]
+        if key not in seen:
+            seen.add(key)
+            kept.extend(pair)
+        i += 2
+
+    # Collapse runs of empty lines to one and strip trailing whitespace.
+    out = []
+    prev_empty = False
+    for start, end in kept:
+        for ln in lines[start:end]:
+            if ln == "":
+                if prev_empty:
+                    continue
+                prev_empty = True
+            else:
+                prev_empty = False
+            out.append(ln.rstrip())
+    return "\n".join(out).strip() + "\n"
 
 
 ###########################
 # LLM orchestration
 ###########################
-def prepare_llm_prompt(clean_md: str) -> str:
+def prepare_llm_prompt(clean_md: str, image_rule: str = IMAGE_CAPTION_RULE) -> str:
     system_instructions = (
         "You are a helpful assistant that rewrites raw lecture notes into clear, concise, "
         "and well-structured Markdown suitable for study/teaching. "
@@ -140,29 +267,212 @@ def prepare_llm_prompt(clean_md: str) -> str:
     user_payload = (
         "Input markdown below. Produce rewritten markdown only — no extra commentary. "
         "Keep math and image links intact. Keep examples and list them with bolded labels. "
-        "If a heading is duplicated, merge content. If an image is present, keep it with a short caption."
+        "If a heading is duplicated, merge content."
     )
+    if image_rule:
+        user_payload += f" {image_rule}"
     return f"{system_instructions}\n\n{user_payload}\n\n### BEGIN INPUT\n\n{clean_md}\n\n### END INPUT\n\n### OUTPUT:"
 
 
-def call_llm_manager(clean_md: str, order_key: str = "default", timeout_seconds: int = 30) -> str:
+def setup_llm_manager():
     if LLMManager is None:
         raise RuntimeError("LLMManager module could not be imported. Skipping LLM step.")
 
-    mgr = LLMManager()
-    # logging.info("Setting up LLM instances from config...")
-    llm_instances = mgr.setup_llm_with_fallback(fallback_order=None)
+    # Shared per process: config, clients and connection pools are set up once.
+    mgr = get_llm_manager()
+    llm_instances = mgr.get_instances()
     if not llm_instances:
         raise RuntimeError("No LLMs available after setup.")
+    return mgr, llm_instances
+
+
+def call_llm_manager(clean_md: str, order_key: str = "default", timeout_seconds: int = 30) -> str:
+    mgr, llm_instances = setup_llm_manager()
 
     prompt = prepare_llm_prompt(clean_md)
     # logging.info("Invoking LLM(s) in fallback order...")
-    result = mgr.invoke_with_fallback(llm_instances, order_key, prompt)
+    result = mgr.run(mgr.ainvoke_with_fallback(llm_instances, order_key, prompt, timeout=timeout_seconds))
     if not isinstance(result, str):
         raise ValueError("LLM returned unexpected non-string result.")
     return result
 
 
+###########################
+# Chunked rewrite
+###########################
+def _split_paragraphs(text: str, max_chars: int) -> list:
+    pieces = []
+    current = ""
+    for paragraph in re.split(r'(?<=\n\n)', text):
+        if current and len(current) + len(paragraph) > max_chars:
+            pieces.append(current)
+            current = ""
+        current += paragraph
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def _is_boundary_heading(section: str) -> bool:
+    if not HEADING_PREFIX_RE.match(section):
+        return False
+    heading = section.split("\n", 1)[0].strip()
+    return hashlib.sha256(heading.encode("utf-8")).digest()[0] % CHUNK_BOUNDARY_EVERY == 0
+
+
+def split_markdown_sections(md: str, max_chars: int = CHUNK_MAX_CHARS, min_chars: int = CHUNK_MIN_CHARS) -> list:
+    """
+    Split Markdown into chunks at `#` headings. A chunk ends before a
+    boundary heading once it holds `min_chars`, or where the next section
+    would take it past `max_chars`; a single oversized section is split at
+    blank lines. "".join(chunks) == md.
+    """
+    chunks = []
+    current = ""
+    for section in re.split(r'(?m)^(?=#{1,6}\s)', md):
+        if not section:
+            continue
+        if current and len(current) >= min_chars and _is_boundary_heading(section):
+            chunks.append(current)
+            current = ""
+        pieces = [section] if len(section) <= max_chars else _split_paragraphs(section, max_chars)
+        for piece in pieces:
+            if current and len(current) + len(piece) > max_chars:
+                chunks.append(current)
+                current = ""
+            current += piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def chunk_context(chunks: list, index: int) -> str:
+    """
+    Read-only context of a chunk: the last heading before it. Unlike the text
+    around it, this stays the same when the previous chunk is edited, so the
+    prompt (and the response cache key) of a chunk depends on its own text.
+    """
+    for chunk in reversed(chunks[:index]):
+        headings = HEADING_LINE_RE.findall(chunk)
+        if headings:
+            # Placeholders belong to the other chunk's numbering.
+            return PLACEHOLDER_RE.sub("", headings[-1]).strip()
+    return ""
+
+
+def localize_placeholders(chunk: str) -> tuple:
+    """
+    `chunk` with its placeholders renumbered from 0 in order of appearance,
+    and the map from the new tokens back to the document's. A formula added
+    earlier in the document then leaves this chunk's prompt unchanged.
+    """
+    renamed = {}
+
+    def rename(m):
+        token = m.group(0)
+        if token not in renamed:
+            renamed[token] = f"__{m.group(1)}_{len(renamed)}__"
+        return renamed[token]
+
+    local_chunk = PLACEHOLDER_KIND_RE.sub(rename, chunk)
+    return local_chunk, {local: token for token, local in renamed.items()}
+
+
+def prepare_chunk_prompt(chunk: str, context: str = "") -> str:
+    prompt = prepare_llm_prompt(chunk, image_rule=IMAGE_TOKEN_RULE)
+    placeholder_rules = (
+        "The input is one part of a longer document. Tokens such as __MATH_DISPLAY_0__, "
+        "__MATH_INLINE_3__ or __IMAGE_2__ stand for formulas and images: copy every token "
+        "exactly once and unchanged, and do not add tokens that are not in the input."
+    )
+    if context:
+        placeholder_rules += (
+            "\n\n### PREVIOUS SECTION HEADING (for continuity only — do not rewrite or repeat it)\n\n"
+            f"{context}\n\n### END CONTEXT"
+        )
+    return f"{placeholder_rules}\n\n{prompt}"
+
+
+def _image_paths(md: str) -> set:
+    return {path for _, path in IMAGE_LINK_PATH_RE.findall(md)}
+
+
+def rewrite_whole(clean_md: str, order_key: str = "default"):
+    """
+    Rewrite a document that fits in one chunk in one call, with the
+    original prompt and its images and formulas left in place. Returns None
+    if the rewrite failed or changed the set of image links.
+    """
+    mgr, llm_instances = setup_llm_manager()
+    prompt = prepare_llm_prompt(clean_md)
+    output = mgr.run(mgr.ainvoke_with_fallback(llm_instances, order_key, prompt))
+    if (not output or not isinstance(output, str) or output.startswith(LLM_FAILURE_PREFIX)
+            or _image_paths(clean_md) != _image_paths(output)):
+        logging.warning("Rewrite unusable; keeping the local clean.")
+        mgr.discard_cached_response(prompt)
+        return None
+    return output
+
+
+def _unescape_placeholder(m) -> str:
+    # Markdown-minded models like to escape the underscores (\_\_IMAGE\_2\_\_).
+    token = m.group(0).replace("\\", "")
+    return token if PLACEHOLDER_RE.fullmatch(token) else m.group(0)
+
+
+def _chunk_output_is_valid(chunk: str, output) -> bool:
+    if not output or not isinstance(output, str) or output.startswith(LLM_FAILURE_PREFIX):
+        return False
+    return set(PLACEHOLDER_RE.findall(chunk)) == set(PLACEHOLDER_RE.findall(output))
+
+
+def rewrite_chunks(chunks: list, order_key: str = "default", on_chunk=None) -> list:
+    """
+    Rewrite chunks concurrently on the LLM manager's event loop, at most
+    CHUNK_WORKERS at a time. Each chunk starts its fallback chain at a
+    different backend so the load is spread across them. Returns the
+    rewritten text per chunk, in order, or None where the rewrite failed or
+    lost a placeholder. `on_chunk(index, output)` is called as each chunk
+    finishes, in completion order.
+    """
+    mgr, llm_instances = setup_llm_manager()
+    order = mgr.orders[order_key] if isinstance(order_key, str) else order_key
+    order = [source for source in order if source in llm_instances] or list(llm_instances)
+
+    async def rewrite(index, limit):
+        chunk, to_document = localize_placeholders(chunks[index])
+        shift = index % len(order)
+        chunk_order = order[shift:] + order[:shift]
+        prompt = prepare_chunk_prompt(chunk, chunk_context(chunks, index))
+        try:
+            async with limit:
+                output = await mgr.ainvoke_with_fallback(llm_instances, chunk_order, prompt)
+        except Exception as e:
+            logging.warning("Chunk %d rewrite failed: %s", index, e)
+            return index, None
+        if isinstance(output, str):
+            # Markdown-minded models like to escape the underscores.
+            output = ESCAPED_PLACEHOLDER_RE.sub(_unescape_placeholder, output)
+        if not _chunk_output_is_valid(chunk, output):
+            logging.warning("Chunk %d rewrite unusable; keeping the local clean.", index)
+            # Do not replay the unusable answer from the response cache next time.
+            mgr.discard_cached_response(prompt)
+            return index, None
+        return index, restore_math_blocks(output, to_document)
+
+    async def rewrite_all():
+        limit = asyncio.Semaphore(CHUNK_WORKERS)
+        results = [None] * len(chunks)
+        for next_done in asyncio.as_completed([rewrite(index, limit) for index in range(len(chunks))]):
+            index, output = await next_done
+            results[index] = output
+            if on_chunk is not None:
+                on_chunk(index, output)
+        return results
+
+    return mgr.run(rewrite_all())
+
+
 ###########################
 # Main logic
 ###########################
@@ -174,28 +484,55 @@ def rewrite_markdown_file(input_path: str, output_path: str, order_key: str = "d
     with open(input_path, "r", encoding="utf-8") as f:
         raw_md = f.read()
 
+    final_md = rewrite_markdown(raw_md, order_key=order_key)
+
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write(final_md)
+
+    logging.info("Wrote rewritten markdown to: %s", output_path)
+
+
+def rewrite_markdown(raw_md: str, order_key: str = "default", on_chunk=None) -> str:
+    """
+    Clean Markdown locally, then have the LLM rewrite it chunk by chunk
+    (falls back to the local clean for any chunk that fails).
+    `on_chunk(index, total, markdown)` receives each chunk's final Markdown
+    as soon as it is ready.
+    """
     masked_md, token_map = preserve_math_blocks(raw_md)
-    cleaned = local_clean(masked_md)
-    cleaned = restore_math_blocks(cleaned, token_map)
+    cleaned_masked = local_clean(masked_md)
+    cleaned = restore_math_blocks(cleaned_masked, token_map)
+
+    # Images are masked as well so the LLM cannot mangle their paths.
+    llm_input, image_map = preserve_image_links(cleaned_masked)
+    token_map.update(image_map)
+    chunks = split_markdown_sections(llm_input)
+
+    def chunk_done(index, output):
+        if on_chunk is not None:
+            on_chunk(index, len(chunks), restore_math_blocks(output or chunks[index], token_map))
 
     try:
-        final_md = call_llm_manager(cleaned, order_key=order_key)
-        if final_md and isinstance(final_md, str):
-            logging.info("LLM returned rewritten markdown.")
+        if len(chunks) == 1:
+            rewritten = [rewrite_whole(cleaned, order_key=order_key)]
+            chunk_done(0, rewritten[0])
         else:
-            logging.warning("LLM returned empty or invalid output. Falling back to local clean.")
-            final_md = cleaned
+            rewritten = rewrite_chunks(chunks, order_key=order_key, on_chunk=chunk_done)
     except Exception as e:
         logging.warning("LLM rewrite failed or unavailable: %s", e)
+        rewritten = [None] * len(chunks)
+
+    if not any(rewritten):
+        logging.warning("LLM returned empty or invalid output. Falling back to local clean.")
         final_md = cleaned
+    else:
+        logging.info("LLM rewrote %d of %d chunk(s).", sum(1 for r in rewritten if r), len(chunks))
+        pieces = [output.strip() + "\n\n" if output else chunk for chunk, output in zip(chunks, rewritten)]
+        final_md = restore_math_blocks("".join(pieces).strip(), token_map)
 
     if not final_md.endswith("\n"):
         final_md += "\n"
-
-    with open(output_path, "w", encoding="utf-8") as f:
-        f.write(final_md)
-
-    logging.info("Wrote rewritten markdown to: %s", output_path)
+    return final_md
 
 
 # if __name__ == "__main__":
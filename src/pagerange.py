@@ -0,0 +1,134 @@
+import os
+import re
+import hashlib
+from pathlib import Path
+
+# Kept free of Docling imports: the API server uses it to validate requests
+# and plan shards without loading the conversion stack.
+
+# Docling Markdown carries a marker per page, and the per-page stages (formulas,
+# image triage) keep pages apart until the markers are dropped before the LLM
+# rewrite. The Markdown of each page at that point is cached, so a re-upload
+# only converts the pages that changed.
+INCREMENTAL_PAGES = os.getenv("INCREMENTAL_PAGES", "1").lower() not in ("0", "false", "no")
+PAGE_MARKER_RE = re.compile(r'^<!-- page (\d+) -->[ \t]*$', re.MULTILINE)
+
+
+def parse_page_range(pages: str):
+    """
+    "12-40" or "7" -> (first, last), 1-based and inclusive as Docling expects.
+    Empty or None means the whole document.
+    """
+    if pages is None or not str(pages).strip():
+        return None
+    match = re.fullmatch(r'\s*(\d+)\s*(?:-\s*(\d+)\s*)?', str(pages))
+    if not match:
+        raise ValueError(f"Invalid page range {pages!r}, expected e.g. '5' or '12-40'.")
+    first = int(match.group(1))
+    last = int(match.group(2) or first)
+    if first < 1 or last < first:
+        raise ValueError(f"Invalid page range {pages!r}.")
+    return first, last
+
+
+def count_pages(input_doc_path: Path) -> int:
+    import pypdfium2 as pdfium
+
+    pdf = pdfium.PdfDocument(str(input_doc_path))
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+
+def plan_shards(page_count: int, page_range=None, shard_pages: int = 40, max_shards: int = 1) -> list:
+    """
+    Split the pages to convert into at most `max_shards` contiguous ranges of
+    at least `shard_pages` pages each. A single range means "do not shard".
+    """
+    first, last = page_range or (1, page_count)
+    last = min(last, page_count)
+    if first > last:
+        raise ValueError(f"Page range starts after the last page ({page_count}).")
+    total = last - first + 1
+    shards = max(1, min(max_shards, total // max(1, shard_pages)))
+    size = -(-total // shards)
+    return [(start, min(start + size - 1, last)) for start in range(first, last + 1, size)]
+
+
+def changed_ranges(page_count: int, known_pages) -> list:
+    """Contiguous (first, last) runs of the pages not in `known_pages`."""
+    ranges = []
+    for page_no in range(1, page_count + 1):
+        if page_no in known_pages:
+            continue
+        if ranges and ranges[-1][1] == page_no - 1:
+            ranges[-1] = (ranges[-1][0], page_no)
+        else:
+            ranges.append((page_no, page_no))
+    return ranges
+
+
+def page_fingerprints(input_doc_path: Path) -> list:
+    """
+    SHA-256 per page of what it draws: the position of every page object, the
+    raw data of its images and its text. pdfium does not hand out the content
+    stream itself, so the parsed page objects stand in for it.
+    """
+    import pypdfium2 as pdfium
+
+    pdf = pdfium.PdfDocument(str(input_doc_path))
+    try:
+        prints = []
+        for index in range(len(pdf)):
+            page = pdf[index]
+            textpage = page.get_textpage()
+            try:
+                digest = hashlib.sha256()
+                digest.update(f"{page.get_size()}{page.get_rotation()}".encode())
+                for obj in page.get_objects(max_depth=8):
+                    digest.update(f"{obj.type}:{','.join(f'{v:.2f}' for v in obj.get_pos())};".encode())
+                    if isinstance(obj, pdfium.PdfImage):
+                        digest.update(bytes(obj.get_data(decode_simple=False)))
+                digest.update(textpage.get_text_range().encode("utf-8"))
+                prints.append(digest.hexdigest())
+            finally:
+                textpage.close()
+                page.close()
+        return prints
+    finally:
+        pdf.close()
+
+
+def page_marker(page_no: int) -> str:
+    return f"<!-- page {page_no} -->"
+
+
+def split_pages(md: str):
+    """
+    [(page_no, markdown)] for Markdown carrying page markers, in order, or
+    None without any. Text before the first marker belongs to that page.
+    """
+    matches = list(PAGE_MARKER_RE.finditer(md))
+    if not matches:
+        return None
+    pages = []
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(md)
+        text = md[match.end():end]
+        if i == 0:
+            text = md[:match.start()] + text
+        pages.append((int(match.group(1)), text))
+    return pages
+
+
+def join_pages(pages, markers: bool = False) -> str:
+    """Markdown of {page_no: markdown} in page order, with or without page markers."""
+    parts = []
+    for page_no, text in sorted(dict(pages).items()):
+        text = text.strip()
+        if markers:
+            parts.append(f"{page_marker(page_no)}\n\n{text}" if text else page_marker(page_no))
+        elif text:
+            parts.append(text)
+    return "\n\n".join(parts) + "\n"
@@ -1,6 +1,11 @@
+import re
+import shutil
 import logging
 from collections.abc import Iterable
+from contextvars import ContextVar
 from pathlib import Path
+from urllib.parse import quote, unquote
+import threading
 import time
 from docling_core.types.doc import DocItemLabel, DoclingDocument, NodeItem, TextItem, ImageRefMode, PictureItem, TableItem
 from docling.datamodel.base_models import InputFormat, ItemAndImageEnrichmentElement
@@ -8,13 +13,30 @@ from docling.datamodel.pipeline_options import PdfPipelineOptions
 from docling.document_converter import DocumentConverter, PdfFormatOption
 from docling.models.base_model import BaseItemAndImageEnrichmentModel
 from docling.pipeline.standard_pdf_pipeline import StandardPdfPipeline
-from docling_core.types.doc import PictureClassificationData
+from docling_core.types.doc import PictureClassificationData, ImageRef
+from src.imageoutput import ImageOutputPolicy
+from src.pagerange import INCREMENTAL_PAGES, join_pages
 
 
 _log = logging.getLogger(__name__)
 
 IMAGE_RESOLUTION_SCALE = 2.0
 
+# Files written per conversion whose numbering restarts in every shard; merging
+# renumbers them so a sharded run names its files exactly like a single run.
+NUMBERED_FILE_RES = {
+    "picture": re.compile(r'^(?P<stem>.+)-picture-(?P<group>[a-z_]+)-(?P<n>\d+)\.\w+$'),
+    "table": re.compile(r'^(?P<stem>.+)-table-(?P<n>\d+)\.\w+$'),
+    "formula": re.compile(r'^formula_(?P<n>\d+)\.png$'),
+}
+IMAGE_SUFFIXES = {".png", ".webp", ".jpg"}
+IMAGE_LINK_RE = re.compile(r'(!\[[^\]]*\]\()([^)]+)(\))')
+
+# Where the formula enrichment model writes its crops for the conversion that
+# is currently running in this thread/context. Converters are shared, so the
+# destination cannot live on the pipeline itself.
+_formula_target: ContextVar[dict] = ContextVar("formula_target")
+
 class ExampleFormulaUnderstandingPipelineOptions(PdfPipelineOptions):
     do_formula_understanding: bool = True
     generate_page_images: bool = True
@@ -25,11 +47,8 @@ class ExampleFormulaUnderstandingPipelineOptions(PdfPipelineOptions):
 class ExampleFormulaUnderstandingEnrichmentModel(BaseItemAndImageEnrichmentModel):
     images_scale = 2
 
-    def __init__(self, enabled: bool, output_dir: Path):
+    def __init__(self, enabled: bool):
         self.enabled = enabled
-        self.output_dir = output_dir
-        self.formula_dir = output_dir / "formulas"
-        self.formula_dir.mkdir(parents=True, exist_ok=True)
 
     def is_processable(self, doc: DoclingDocument, element: NodeItem) -> bool:
         return (
@@ -46,24 +65,28 @@ class ExampleFormulaUnderstandingEnrichmentModel(BaseItemAndImageEnrichmentModel
         if not self.enabled:
             return
 
-        for idx, enrich_element in enumerate(element_batch):
+        target = _formula_target.get()
+        formula_dir = target["output_dir"] / "formulas"
+        formula_dir.mkdir(parents=True, exist_ok=True)
+        for enrich_element in element_batch:
+            # Numbered per conversion, not per batch, so later batches do not
+            # overwrite earlier crops.
+            target["count"] += 1
             img = enrich_element.image
-            img_path = self.formula_dir / f"formula_{idx+1}.png"
-            img.save(img_path)
-            enrich_element.item.text = f"![Formula]({img_path.as_posix()})"
+            img_name = f"formula_{target['count']}.png"
+            img.save(formula_dir / img_name)
+            # Relative to the Markdown file, which is written into the same workspace.
+            enrich_element.item.text = f"![Formula](formulas/{img_name})"
             yield enrich_element.item
 
 class CombinedPipeline(StandardPdfPipeline):
-    output_dir: Path = Path("scratch")
-
     def __init__(self, pipeline_options: ExampleFormulaUnderstandingPipelineOptions):
         super().__init__(pipeline_options)
         self.pipeline_options: ExampleFormulaUnderstandingPipelineOptions
         self.enrichment_pipe.append(ExampleFormulaUnderstandingEnrichmentModel(
-           
                 enabled=self.pipeline_options.do_formula_understanding,
-                output_dir=self.output_dir,)
             )
+        )
         
         if self.pipeline_options.do_formula_understanding:
             self.keep_backend = True
@@ -72,54 +95,204 @@ class CombinedPipeline(StandardPdfPipeline):
     def get_default_options(cls) -> ExampleFormulaUnderstandingPipelineOptions:
         return ExampleFormulaUnderstandingPipelineOptions()
 
-def convert(input_doc_path: Path = None, output_dir: Path = None, OCR: bool = False) -> Path:
-    logging.getLogger('docling').setLevel(logging.WARNING)
-    logging.getLogger('docling_defaults').setLevel(logging.WARNING)
-    # input_doc_path = Path(r"old\preview.pdf")
-    # output_dir = Path("scratch")
-    # input_doc_path = Path(r"old\preview.pdf")
-    # output_dir = Path("scratch")
-    output_dir.mkdir(parents=True, exist_ok=True)
+# ----------------------------------------------------------
+# Warm converter registry
+# ----------------------------------------------------------
+# Building a DocumentConverter and initialising its pipeline loads the layout,
+# table and picture-classifier models, which dominates the latency of small
+# documents. Converters are therefore built once per set of pipeline options
+# and reused for the lifetime of the process.
+_converters = {}
+_converters_lock = threading.Lock()
+_metrics = {
+    "converters_loaded": 0,
+    "load_seconds_total": 0.0,
+    "conversions": 0,
+    "convert_seconds_total": 0.0,
+    "convert_seconds_last": None,
+    "image_files_written": 0,
+    "image_bytes_written": 0,
+    "image_seconds_total": 0.0,
+}
+
+
+def _converter_key(ocr: bool = False, images_scale: float = IMAGE_RESOLUTION_SCALE,
+                   picture_classification: bool = True, page_images: bool = False) -> tuple:
+    return (bool(ocr), float(images_scale), bool(picture_classification), bool(page_images))
 
+
+def _build_pipeline_options(ocr: bool, images_scale: float, picture_classification: bool,
+                            page_images: bool) -> ExampleFormulaUnderstandingPipelineOptions:
     pipeline_options = ExampleFormulaUnderstandingPipelineOptions()
     pipeline_options.do_formula_understanding = True
-    pipeline_options.images_scale = IMAGE_RESOLUTION_SCALE
-    pipeline_options.generate_page_images = True
+    pipeline_options.images_scale = images_scale
+    # Page renders are only kept on the document when page or table images are
+    # written; picture crops and formula crops do not need them.
+    pipeline_options.generate_page_images = page_images
     pipeline_options.generate_picture_images = True
-    pipeline_options.do_picture_classification = True
-    pipeline_options.do_ocr = OCR
+    pipeline_options.do_picture_classification = picture_classification
+    pipeline_options.do_ocr = ocr
     # pipeline_options.do_picture_description =True
-    CombinedPipeline.output_dir = output_dir
+    return pipeline_options
 
-    doc_converter = DocumentConverter(
-        format_options={
-            InputFormat.PDF: PdfFormatOption(
-                pipeline_cls=CombinedPipeline,
-                pipeline_options=pipeline_options,
-            )
-        }
+
+def get_converter(ocr: bool = False, images_scale: float = IMAGE_RESOLUTION_SCALE,
+                  picture_classification: bool = True, page_images: bool = False) -> DocumentConverter:
+    """
+    Return the process-wide DocumentConverter for the given pipeline options,
+    building it and loading its models on first use.
+    """
+    key = _converter_key(ocr, images_scale, picture_classification, page_images)
+    with _converters_lock:
+        doc_converter = _converters.get(key)
+        if doc_converter is not None:
+            return doc_converter
+
+        start_time = time.time()
+        doc_converter = DocumentConverter(
+            format_options={
+                InputFormat.PDF: PdfFormatOption(
+                    pipeline_cls=CombinedPipeline,
+                    pipeline_options=_build_pipeline_options(*key),
+                )
+            }
+        )
+        # Force model loading now instead of on the first convert() call.
+        doc_converter.initialize_pipeline(InputFormat.PDF)
+        load_time = time.time() - start_time
+
+        _converters[key] = doc_converter
+        _metrics["converters_loaded"] += 1
+        _metrics["load_seconds_total"] += load_time
+        _log.info(f"Docling converter {key} loaded in {load_time:.2f} seconds.")
+        return doc_converter
+
+
+def warm_converters(ocr_modes=(False, True)):
+    """Preload converters for the given OCR modes (called at server start-up)."""
+    logging.getLogger('docling').setLevel(logging.WARNING)
+    logging.getLogger('docling_defaults').setLevel(logging.WARNING)
+    policy = ImageOutputPolicy.from_env()
+    for ocr in ocr_modes:
+        get_converter(ocr=ocr, page_images=policy.page_images or policy.table_images)
+
+
+def converter_metrics() -> dict:
+    """Snapshot of model load time versus conversion time for this process."""
+    with _converters_lock:
+        metrics = dict(_metrics)
+        metrics["loaded_keys"] = [
+            {"ocr": k[0], "images_scale": k[1], "picture_classification": k[2], "page_images": k[3]}
+            for k in _converters
+        ]
+    conversions = metrics["conversions"]
+    metrics["convert_seconds_avg"] = (
+        metrics["convert_seconds_total"] / conversions if conversions else None
     )
+    return metrics
+
+
+def merge_shards(shard_outputs: list, output_dir: Path) -> Path:
+    """
+    Merge the Markdown of shards converted into their own folders (in page
+    order) into `output_dir`. Page images keep their page numbers; picture,
+    table and formula files are renumbered to continue across shards, and the
+    links in the Markdown are rewritten to match.
+    """
+    output_dir = Path(output_dir)
+    offsets = {}
+    parts = []
+    md_name = None
+    for shard_md in map(Path, shard_outputs):
+        shard_dir = shard_md.parent
+        md_name = md_name or shard_md.name
+        renamed = {}
+        files = [f for f in shard_dir.iterdir() if f.suffix in IMAGE_SUFFIXES]
+        files += list((shard_dir / "formulas").glob("*.png"))
+        counts = {}
+        for f in files:
+            for kind, pattern in NUMBERED_FILE_RES.items():
+                match = pattern.match(f.name)
+                if not match:
+                    continue
+                group = (kind, match.groupdict().get("group"))
+                n = int(match.group("n")) + offsets.get(group, 0)
+                counts[group] = max(counts.get(group, 0), int(match.group("n")))
+                name = f.name[:match.start("n")] + str(n) + f.name[match.end("n"):]
+                rel = f"formulas/{name}" if kind == "formula" else name
+                renamed[f.relative_to(shard_dir).as_posix()] = rel
+                (output_dir / rel).parent.mkdir(parents=True, exist_ok=True)
+                shutil.move(str(f), str(output_dir / rel))
+                break
+            else:
+                # Page images are already named by their page number.
+                renamed[f.name] = f.name
+                shutil.move(str(f), str(output_dir / f.name))
+        for group, count in counts.items():
+            offsets[group] = offsets.get(group, 0) + count
+
+        def relink(m):
+            # Docling percent-encodes link targets ("Lecture%203-picture-...").
+            ref = unquote(m.group(2))
+            if ref not in renamed:
+                return m.group(0)
+            target = quote(renamed[ref]) if ref != m.group(2) else renamed[ref]
+            return f"{m.group(1)}{target}{m.group(3)}"
+
+        parts.append(IMAGE_LINK_RE.sub(relink, shard_md.read_text(encoding="utf-8")))
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+    merged = output_dir / md_name
+    merged.write_text("\n\n".join(part.strip("\n") for part in parts) + "\n", encoding="utf-8")
+    return merged
+
+
+def convert(input_doc_path: Path = None, output_dir: Path = None, OCR: bool = False,
+            page_range: tuple = None, image_policy: ImageOutputPolicy = None,
+            page_markers: bool = INCREMENTAL_PAGES) -> Path:
+    """
+    Convert the PDF (or only the 1-based inclusive `page_range`) into
+    `output_dir` and return the path of the Markdown with image references.
+    `image_policy` decides which images are written and how they are encoded.
+    With `page_markers`, every page is exported on its own behind a
+    `<!-- page N -->` line.
+    """
+    logging.getLogger('docling').setLevel(logging.WARNING)
+    logging.getLogger('docling_defaults').setLevel(logging.WARNING)
+    # input_doc_path = Path(r"old\preview.pdf")
+    # output_dir = Path("scratch")
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    policy = image_policy or ImageOutputPolicy.from_env()
+    doc_converter = get_converter(ocr=OCR, page_images=policy.page_images or policy.table_images)
 
     start_time = time.time()
-    conv_res = doc_converter.convert(input_doc_path)
+    token = _formula_target.set({"output_dir": output_dir, "count": 0})
+    try:
+        if page_range:
+            conv_res = doc_converter.convert(input_doc_path, page_range=tuple(page_range))
+        else:
+            conv_res = doc_converter.convert(input_doc_path)
+    finally:
+        _formula_target.reset(token)
     doc_filename = conv_res.input.file.stem
+    image_start = time.time()
+    written = []
 
-    # Save page images
-    for page_no, page in conv_res.document.pages.items():
-        page_image_filename = output_dir / f"{doc_filename}-{page_no}.png"
-        with page_image_filename.open("wb") as fp:
-            page.image.pil_image.save(fp, format="PNG")
+    # Save page images (by default they are rendered on request instead)
+    if policy.page_images:
+        for page_no, page in conv_res.document.pages.items():
+            written.append(policy.save(page.image.pil_image, output_dir / f"{doc_filename}-{page_no}"))
 
-    # Save images of figures and tables
     # Save images of figures and tables
     table_counter = 0
     picture_counters = {}  # Dynamic per-category counters
     for element, _level in conv_res.document.iterate_items():
-        if isinstance(element, TableItem):
+        if isinstance(element, TableItem) and policy.table_images:
             table_counter += 1
-            element_image_filename = output_dir / f"{doc_filename}-table-{table_counter}.png"
-            with element_image_filename.open("wb") as fp:
-                element.get_image(conv_res.document).save(fp, "PNG")
+            table_image = element.get_image(conv_res.document)
+            if table_image is not None:
+                written.append(policy.save(table_image, output_dir / f"{doc_filename}-table-{table_counter}"))
         if isinstance(element, PictureItem):
             # Extract top classification
             classification = 'other'
@@ -130,18 +303,44 @@ def convert(input_doc_path: Path = None, output_dir: Path = None, OCR: bool = Fa
             if classification not in picture_counters:
                 picture_counters[classification] = 0
             picture_counters[classification] += 1
-            element_image_filename = output_dir / f"{doc_filename}-picture-{classification}-{picture_counters[classification]}.png"
-            with element_image_filename.open("wb") as fp:
-                element.get_image(conv_res.document).save(fp, "PNG")
+            picture_image = element.get_image(conv_res.document)
+            if picture_image is None:
+                continue
+            element_image_filename = policy.save(
+                picture_image,
+                output_dir / f"{doc_filename}-picture-{classification}-{picture_counters[classification]}",
+            )
+            written.append(element_image_filename)
+            # Link the Markdown straight to this file so the Docling class
+            # travels with the image (used by the local image pre-filter).
+            if element.image is None:
+                element.image = ImageRef.from_pil(picture_image, dpi=int(72 * IMAGE_RESOLUTION_SCALE))
+            element.image.uri = Path(element_image_filename.name)
     # # Save Markdown with embedded images
     # md_filename_embedded = output_dir / f"{doc_filename}-with-images.md"
     # conv_res.document.save_as_markdown(md_filename_embedded, image_mode=ImageRefMode.EMBEDDED)
 
     # Save Markdown with referenced images
+    # (export rather than save_as_markdown, which would re-encode every picture
+    # into an _artifacts folder under an anonymous name)
+    if page_markers:
+        markdown = join_pages({
+            page_no: conv_res.document.export_to_markdown(image_mode=ImageRefMode.REFERENCED, page_no=page_no)
+            for page_no in conv_res.document.pages
+        }, markers=True)
+    else:
+        markdown = conv_res.document.export_to_markdown(image_mode=ImageRefMode.REFERENCED)
     md_filename_referenced = output_dir / f"{doc_filename}-with-image-refs.md"
-    conv_res.document.save_as_markdown(md_filename_referenced, image_mode=ImageRefMode.REFERENCED)
+    md_filename_referenced.write_text(markdown, encoding="utf-8")
 
     end_time = time.time() - start_time
+    with _converters_lock:
+        _metrics["image_files_written"] += len(written)
+        _metrics["image_bytes_written"] += sum(f.stat().st_size for f in written)
+        _metrics["image_seconds_total"] += time.time() - image_start
+        _metrics["conversions"] += 1
+        _metrics["convert_seconds_total"] += end_time
+        _metrics["convert_seconds_last"] = end_time
     _log.info(f"Document converted in {end_time:.2f} seconds.")
     # _log.info(f"Markdown saved at: {md_filename_embedded}, {md_filename_referenced}")
     # _log.info(f"Formula images saved in: {output_dir/'formulas'}")
@@ -0,0 +1,82 @@
+import time
+import logging
+from pathlib import Path
+
+_log = logging.getLogger(__name__)
+
+
+class MarkdownDocument:
+    """
+    The Markdown being converted, kept in memory while it moves through the
+    stages. `path` is where the text came from; relative image links are
+    resolved against it. Stages can leave results for later stages in
+    `artifacts` (e.g. the image analysis report). Progress is reported
+    through `on_event(dict)`, if given.
+    """
+
+    def __init__(self, text: str, path: Path, workspace: Path, on_event=None):
+        self.text = text
+        self.path = Path(path)
+        self.workspace = Path(workspace)
+        self.artifacts = {}
+        self.timings = {}
+        self.on_event = on_event
+
+    @classmethod
+    def from_file(cls, path: Path, workspace: Path = None, on_event=None):
+        path = Path(path)
+        return cls(path.read_text(encoding="utf-8"), path, workspace or path.parent, on_event)
+
+    def emit(self, event: str, **data):
+        if self.on_event is not None:
+            self.on_event({"event": event, **data})
+
+    def write(self, output_path: Path):
+        Path(output_path).write_text(self.text, encoding="utf-8")
+
+
+class Stage:
+    """One named transformation of a MarkdownDocument; `fn(doc)` updates it in place."""
+
+    def __init__(self, name: str, fn):
+        self.name = name
+        self.fn = fn
+
+    def run(self, doc: MarkdownDocument):
+        self.fn(doc)
+
+
+class TextStage(Stage):
+    """Stage for a plain `str -> str` function."""
+
+    def __init__(self, name: str, fn):
+        def apply(doc):
+            doc.text = fn(doc.text)
+        super().__init__(name, apply)
+
+
+class Checkpoint(Stage):
+    """Writes the current text to disk, e.g. to inspect an intermediate result."""
+
+    def __init__(self, output_path: Path):
+        super().__init__(f"checkpoint:{Path(output_path).name}", lambda doc: doc.write(output_path))
+
+
+class Pipeline:
+    def __init__(self, stages: list):
+        self.stages = stages
+
+    def run(self, doc: MarkdownDocument) -> MarkdownDocument:
+        for index, stage in enumerate(self.stages):
+            doc.emit("stage", stage=stage.name, status="started", index=index, total=len(self.stages))
+            text_before = doc.text
+            start_time = time.perf_counter()
+            stage.run(doc)
+            elapsed = time.perf_counter() - start_time
+            doc.timings[stage.name] = elapsed
+            _log.info(f"Stage {stage.name} finished in {elapsed:.2f} seconds.")
+            doc.emit("stage", stage=stage.name, status="finished", index=index,
+                     total=len(self.stages), seconds=elapsed)
+            if doc.text is not text_before and doc.text != text_before:
+                doc.emit("markdown", stage=stage.name, content=doc.text)
+        return doc
@@ -0,0 +1,122 @@
+import time
+import sqlite3
+import threading
+from pathlib import Path
+
+RATE_LIMIT_DB_PATH = Path("cache/rate_limits.sqlite3")
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate_per_minute` requests are allowed per
+    minute on average, with bursts of up to `burst` requests.
+    `pause()` stops every caller for a while, e.g. after the provider sent a
+    429 with a Retry-After hint.
+    """
+
+    def __init__(self, rate_per_minute: float, burst: int = None):
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = float(burst if burst is not None else max(1, int(rate_per_minute // 6)))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate_per_second)
+        self._updated = now
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._refill(now)
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate_per_second
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Hold back all callers for `seconds` and drop the tokens saved up meanwhile."""
+        with self._lock:
+            now = time.monotonic()
+            self._paused_until = max(self._paused_until, now + seconds)
+            self._tokens = 0.0
+            self._updated = self._paused_until
+
+
+class SharedTokenBucket:
+    """
+    TokenBucket whose state lives in SQLite, so every process opening the
+    same `db_path` and `name` (e.g. all conversion workers) draws from one
+    quota instead of each process getting a full quota of its own.
+    """
+
+    def __init__(self, rate_per_minute: float, burst: int = None, name: str = "default",
+                 db_path: Path = RATE_LIMIT_DB_PATH):
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = float(burst if burst is not None else max(1, int(rate_per_minute // 6)))
+        self.name = name
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # Autocommit; acquire() takes the write lock itself with BEGIN IMMEDIATE.
+        self._conn = sqlite3.connect(str(self.db_path), timeout=30, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            " name TEXT PRIMARY KEY,"
+            " tokens REAL NOT NULL,"
+            " updated REAL NOT NULL,"
+            " paused_until REAL NOT NULL)"
+        )
+        self._conn.execute("INSERT OR IGNORE INTO buckets VALUES (?, ?, ?, 0)", (name, self.capacity, time.time()))
+
+    def _take(self) -> float:
+        """Take a token if one is available and return 0, otherwise how long to wait."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                tokens, updated, paused_until = self._conn.execute(
+                    "SELECT tokens, updated, paused_until FROM buckets WHERE name = ?", (self.name,)
+                ).fetchone()
+                # Wall-clock time: monotonic clocks are not comparable across processes.
+                now = time.time()
+                if now < paused_until:
+                    wait = paused_until - now
+                else:
+                    tokens = min(self.capacity, tokens + max(0.0, now - updated) * self.rate_per_second)
+                    if tokens >= 1:
+                        tokens -= 1
+                        wait = 0.0
+                    else:
+                        wait = (1 - tokens) / self.rate_per_second
+                    self._conn.execute("UPDATE buckets SET tokens = ?, updated = ? WHERE name = ?",
+                                       (tokens, now, self.name))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return wait
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        while (wait := self._take()) > 0:
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Hold back all callers in every process for `seconds` and drop the saved-up tokens."""
+        until = time.time() + seconds
+        with self._lock:
+            self._conn.execute(
+                "UPDATE buckets SET paused_until = MAX(paused_until, ?), tokens = 0,"
+                " updated = MAX(paused_until, ?) WHERE name = ?",
+                (until, until, self.name),
+            )
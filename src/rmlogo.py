@@ -1,13 +1,14 @@
 from pathlib import Path
+import io
 import re
 
-def remove_logo_blocks(md_path: str):
+BANNED_CAPTIONS = {"other", "bar chart", "screenshot", "remote sensing"}
+
+
+def strip_logo_blocks(text: str) -> str:
     """
     Remove 'logo' lines and the image line immediately after each.
     """
-    p = Path(md_path)
-    text = p.read_text(encoding="utf-8")
-
     # Pattern:
     #   line with 'logo'
     #   optional blank line(s)
@@ -18,37 +19,47 @@ def remove_logo_blocks(md_path: str):
 
     # Optional: collapse 3+ newlines to 2
     cleaned = re.sub(r'\n{3,}', '\n\n', cleaned)
+    return cleaned
+
 
-    p.write_text(cleaned, encoding="utf-8")
+def remove_logo_blocks(md_path: str):
+    """
+    Remove 'logo' lines and the image line immediately after each.
+    """
+    p = Path(md_path)
+    text = p.read_text(encoding="utf-8")
+    p.write_text(strip_logo_blocks(text), encoding="utf-8")
     # print(f"Removed all 'logo' blocks from {p}")
 
+
+def strip_caption_lines(text: str) -> str:
+    """
+    Removes lines that only contain: 'other', 'bar chart', 'screenshot', or 'remote sensing'.
+    """
+    # Split exactly like file.readlines() so the output matches the file-based version.
+    lines = io.StringIO(text, newline="\n").readlines()
+    # Keep line if it’s not one of the banned words
+    return "".join(line for line in lines if line.strip().lower() not in BANNED_CAPTIONS)
+
+
 def clean_caption_md_file(input_path: str, output_path: str = None):
     """
     Removes lines that only contain: 'other', 'bar chart', 'screenshot', or 'remote sensing'
     from a Markdown file.
     """
-    banned = {"other", "bar chart", "screenshot", "remote sensing"}
-
     input_path = Path(input_path)
     if not input_path.exists():
         raise FileNotFoundError(f"File not found: {input_path}")
 
     with open(input_path, "r", encoding="utf-8") as f:
-        lines = f.readlines()
-
-    cleaned_lines = []
-    for line in lines:
-        stripped = line.strip().lower()
-        # Keep line if it’s not one of the banned words
-        if stripped not in banned:
-            cleaned_lines.append(line)
+        text = f.read()
 
     # If no output_path given, overwrite input file
     if output_path is None:
         output_path = input_path
 
     with open(output_path, "w", encoding="utf-8") as f:
-        f.writelines(cleaned_lines)
+        f.write(strip_caption_lines(text))
 
     # print(f"Cleaned file saved to: {output_path}")
 
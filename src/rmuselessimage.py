@@ -6,7 +6,20 @@ def clean_markdown(md_path: Path, json_path: Path, output_path: Path):
     # Load JSON data
     with open(json_path, "r", encoding="utf-8") as f:
         data = json.load(f)
+    # Reports carry {"images": [...], "stats": {...}}; older ones are a bare list.
+    if isinstance(data, dict):
+        data = data.get("images", [])
 
+    # Read Markdown content
+    md_text = md_path.read_text(encoding="utf-8")
+
+    # Write output
+    output_path.write_text(clean_markdown_text(md_text, data), encoding="utf-8")
+    # print(f"\n✅ Cleaned Markdown saved to: {output_path}")
+
+
+def clean_markdown_text(md_text: str, data: list) -> str:
+    """Drop images judged useless in the analysis results and point the rest at their full path."""
     # Build lookup dicts
     useful_lookup = {}
     fullpath_lookup = {}
@@ -15,9 +28,6 @@ def clean_markdown(md_path: Path, json_path: Path, output_path: Path):
         useful_lookup[normalized] = entry["is_useful"]
         fullpath_lookup[normalized] = entry["full_path"]
 
-    # Read Markdown content
-    md_text = md_path.read_text(encoding="utf-8")
-
     # Regex pattern to match Markdown image syntax: ![Alt](path)
     image_pattern = re.compile(r'!\[(.*?)\]\((.*?)\)')
 
@@ -46,10 +56,7 @@ def clean_markdown(md_path: Path, json_path: Path, output_path: Path):
 
     # Clean up excess blank lines
     cleaned_md = re.sub(r'\n{3,}', '\n\n', cleaned_md).strip()
-
-    # Write output
-    output_path.write_text(cleaned_md, encoding="utf-8")
-    # print(f"\n✅ Cleaned Markdown saved to: {output_path}")
+    return cleaned_md
 
 
 # Example usage
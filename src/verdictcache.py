@@ -0,0 +1,149 @@
+import io
+import time
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from PIL import Image
+
+VERDICT_DB_PATH = Path("cache/image_verdicts.sqlite3")
+# Two images whose 64-bit dHash differs in at most this many bits are treated
+# as the same picture (re-encoded logo, slightly different crop, ...).
+NEAR_DUPLICATE_DISTANCE = 4
+PHASH_BANDS = NEAR_DUPLICATE_DISTANCE + 1
+MAX_VERDICT_ENTRIES = 100000
+
+BAND_COLUMNS = ", ".join(f"band{band}" for band in range(PHASH_BANDS))
+BAND_ASSIGNMENTS = ", ".join(f"band{band} = ?" for band in range(PHASH_BANDS))
+BAND_MATCH = " OR ".join(f"band{band} = ?" for band in range(PHASH_BANDS))
+
+
+def exact_hash(image_bytes: bytes) -> str:
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def perceptual_hash(image_bytes: bytes):
+    """64-bit difference hash (dHash) of the image, or None if it cannot be decoded."""
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            small = img.convert("L").resize((9, 8), Image.LANCZOS)
+    except Exception:
+        return None
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    # SQLite integers are signed 64-bit.
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin((a ^ b) & 0xFFFFFFFFFFFFFFFF).count("1")
+
+
+def phash_bands(phash: int) -> list:
+    """
+    The hash cut into PHASH_BANDS slices of 12-13 bits. Two hashes at most
+    NEAR_DUPLICATE_DISTANCE bits apart agree on at least one whole slice, so
+    near-duplicate candidates can be found through an index on each slice.
+    """
+    bands, start = [], 0
+    for band in range(PHASH_BANDS):
+        width = (64 - start) // (PHASH_BANDS - band)
+        bands.append((phash >> start) & ((1 << width) - 1))
+        start += width
+    return bands
+
+
+class VerdictCache:
+    """
+    Persistent store of Gemini usefulness verdicts, looked up first by the
+    exact SHA-256 of the image bytes and then by perceptual-hash distance.
+    Near-duplicates are searched in the database, so verdicts stored by other
+    processes are found too. Least-recently-used rows are evicted once the
+    table grows past `max_entries`.
+    """
+
+    def __init__(self, db_path: Path = VERDICT_DB_PATH, max_distance: int = NEAR_DUPLICATE_DISTANCE,
+                 max_entries: int = MAX_VERDICT_ENTRIES):
+        if max_distance >= PHASH_BANDS:
+            raise ValueError(f"max_distance must be below {PHASH_BANDS}, got {max_distance}")
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS verdicts ("
+            " sha256 TEXT PRIMARY KEY,"
+            " phash INTEGER,"
+            " is_useful INTEGER NOT NULL,"
+            " reason TEXT,"
+            " created REAL)"
+        )
+        # Databases written before eviction and banded lookups lack these.
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(verdicts)")}
+        if "last_used" not in columns:
+            self._conn.execute("ALTER TABLE verdicts ADD COLUMN last_used REAL")
+            for band in range(PHASH_BANDS):
+                self._conn.execute(f"ALTER TABLE verdicts ADD COLUMN band{band} INTEGER")
+            rows = self._conn.execute("SELECT sha256, phash FROM verdicts").fetchall()
+            self._conn.executemany(
+                f"UPDATE verdicts SET last_used = created, {BAND_ASSIGNMENTS} WHERE sha256 = ?",
+                [(*(phash_bands(phash) if phash is not None else [None] * PHASH_BANDS), sha) for sha, phash in rows],
+            )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS verdicts_last_used ON verdicts (last_used)")
+        for band in range(PHASH_BANDS):
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS verdicts_band{band} ON verdicts (band{band})")
+        self._conn.commit()
+
+    def lookup(self, sha256: str, phash):
+        """Return (verdict, "cache-exact" | "cache-near") or (None, None)."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT sha256, is_useful, reason FROM verdicts WHERE sha256 = ?", (sha256,)
+            ).fetchone()
+            source = "cache-exact"
+            if not row and phash is not None:
+                source = "cache-near"
+                candidates = self._conn.execute(
+                    f"SELECT sha256, is_useful, reason, phash FROM verdicts WHERE {BAND_MATCH}",
+                    phash_bands(phash),
+                ).fetchall()
+                best_distance = self.max_distance + 1
+                for candidate in candidates:
+                    distance = hamming_distance(phash, candidate[3])
+                    if distance < best_distance:
+                        row, best_distance = candidate, distance
+            if not row:
+                return None, None
+            self._conn.execute("UPDATE verdicts SET last_used = ? WHERE sha256 = ?", (time.time(), row[0]))
+            self._conn.commit()
+            return {"is_useful": bool(row[1]), "reason": row[2]}, source
+
+    def store(self, sha256: str, phash, verdict: dict):
+        now = time.time()
+        bands = phash_bands(phash) if phash is not None else [None] * PHASH_BANDS
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO verdicts (sha256, phash, is_useful, reason, created, last_used, {BAND_COLUMNS})"
+                f" VALUES (?, ?, ?, ?, ?, ?, {', '.join('?' * PHASH_BANDS)})",
+                (sha256, phash, int(bool(verdict.get("is_useful"))), verdict.get("reason"), now, now, *bands),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM verdicts").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM verdicts WHERE sha256 IN"
+                " (SELECT sha256 FROM verdicts ORDER BY last_used ASC LIMIT ?)",
+                (excess,),
+            )
@@ -0,0 +1,5 @@
+# Kept free of SDK imports: the API server reads the model name for cache
+# keys without loading google.genai or opening the rate-limit database.
+
+# Gemini model that judges whether an image is useful.
+MODEL_NAME = "gemini-2.5-flash-lite-preview-09-2025"
@@ -0,0 +1,285 @@
+import os
+import time
+import shutil
+import hashlib
+import logging
+import threading
+from collections import Counter
+from pathlib import Path
+
+_log = logging.getLogger(__name__)
+
+# Folders whose entries are per-conversion workspaces.
+WORKSPACE_ROOTS = (Path("temp_sessions"), Path("temp"))
+# Workspaces nobody has opened for this long are deleted.
+WORKSPACE_TTL_SECONDS = float(os.getenv("WORKSPACE_TTL_HOURS", "168")) * 3600
+# Past this total, least recently used workspaces are deleted until it fits.
+MAX_WORKSPACE_BYTES = int(os.getenv("MAX_WORKSPACE_BYTES", str(20 * 1024 ** 3)))
+# A fresh upload folder may not have its job yet; never evict one this young for quota.
+MIN_WORKSPACE_AGE_SECONDS = 300
+GC_INTERVAL_SECONDS = float(os.getenv("WORKSPACE_GC_INTERVAL", "600"))
+# Identical files with these suffixes are hardlinked to a single copy.
+DEDUPE_SUFFIXES = frozenset({".png", ".jpg", ".jpeg", ".webp", ".pdf"})
+# Touched whenever a workspace is served; its mtime is the LRU clock.
+ACCESS_MARKER = ".last_access"
+HASH_CHUNK_BYTES = 1024 ** 2
+
+
+def _inode(stat: os.stat_result) -> tuple:
+    return stat.st_dev, stat.st_ino
+
+
+class WorkspaceManager:
+    """
+    Keeps the workspaces under `roots` (one folder or file per entry) in
+    bounds. Entries not accessed for `ttl_seconds` are deleted, then the
+    least recently used ones until all of them fit in `max_bytes`. Identical
+    images and PDFs in what remains are hardlinked to one copy. Workspaces
+    returned by `in_use()` are never modified. Once started, a collection
+    runs every `interval` seconds in a background thread.
+    """
+
+    def __init__(self, roots=WORKSPACE_ROOTS, in_use=None, ttl_seconds: float = WORKSPACE_TTL_SECONDS,
+                 max_bytes: int = MAX_WORKSPACE_BYTES, interval: float = GC_INTERVAL_SECONDS):
+        self.roots = [Path(root).resolve() for root in roots]
+        self.in_use = in_use or (lambda: ())
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        # (device, inode, size, mtime_ns) -> sha256, so unchanged files are hashed once.
+        self._digests = {}
+        self._counters = {"runs": 0, "expired": 0, "evicted": 0, "freed_bytes": 0,
+                          "deduplicated_files": 0, "deduplicated_bytes": 0}
+        self._last_run = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="workspace-gc")
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+    def _run(self):
+        while True:
+            try:
+                self.collect()
+            except Exception as e:
+                _log.error(f"Workspace collection failed: {e}")
+            if self._stop.wait(self.interval):
+                return
+
+    def _workspace_of(self, path: Path):
+        path = Path(path).resolve()
+        for root in self.roots:
+            if path != root and path.is_relative_to(root):
+                return root / path.relative_to(root).parts[0]
+        return None
+
+    def touch(self, path):
+        """Mark the workspace holding `path` as just used."""
+        workspace = self._workspace_of(path)
+        if workspace is None or not workspace.is_dir():
+            return
+        try:
+            (workspace / ACCESS_MARKER).touch()
+        except OSError as e:
+            _log.warning(f"Could not mark {workspace} as used: {e}")
+
+    def _workspaces(self):
+        for root in self.roots:
+            if root.is_dir():
+                yield from root.iterdir()
+
+    @staticmethod
+    def _files(workspace: Path) -> list:
+        """[(path, stat)] of the regular files in a workspace."""
+        paths = workspace.rglob("*") if workspace.is_dir() else [workspace]
+        files = []
+        for path in paths:
+            try:
+                stat = path.lstat()
+            except OSError:
+                continue
+            if path.is_file() and not path.is_symlink():
+                files.append((path, stat))
+        return files
+
+    @staticmethod
+    def _last_access(workspace: Path, files: list) -> float:
+        """mtime of the access marker, or of the workspace itself if it has none."""
+        marker = workspace / ACCESS_MARKER
+        for path, stat in files:
+            if path == marker:
+                return stat.st_mtime
+        try:
+            return workspace.lstat().st_mtime
+        except OSError:
+            return 0.0
+
+    def _digest(self, path: Path, stat: os.stat_result):
+        key = (*_inode(stat), stat.st_size, stat.st_mtime_ns)
+        digest = self._digests.get(key)
+        if digest is None:
+            sha256 = hashlib.sha256()
+            try:
+                with open(path, "rb") as f:
+                    while chunk := f.read(HASH_CHUNK_BYTES):
+                        sha256.update(chunk)
+            except OSError:
+                return None
+            digest = self._digests[key] = sha256.hexdigest()
+        return digest
+
+    def _remove(self, entry: list, refs: Counter) -> int:
+        """Delete one workspace and return the bytes that actually became free."""
+        _, workspace, files = entry
+        freed = 0
+        for _, stat in files:
+            refs[_inode(stat)] -= 1
+            if refs[_inode(stat)] == 0:
+                freed += stat.st_size
+        if workspace.is_dir() and not workspace.is_symlink():
+            shutil.rmtree(workspace, ignore_errors=True)
+        else:
+            workspace.unlink(missing_ok=True)
+        self._counters["freed_bytes"] += freed
+        return freed
+
+    def _dedupe(self, entries: list, refs: Counter) -> int:
+        """Hardlink identical files across `entries` to one copy; returns the bytes saved."""
+        by_size = {}
+        for entry in entries:
+            for i, (path, stat) in enumerate(entry[2]):
+                if stat.st_size and path.suffix.lower() in DEDUPE_SUFFIXES:
+                    by_size.setdefault(stat.st_size, []).append((entry[2], i))
+
+        saved = 0
+        for size, candidates in by_size.items():
+            if len(candidates) < 2:
+                continue
+            originals = {}
+            for files, i in candidates:
+                path, stat = files[i]
+                digest = self._digest(path, stat)
+                if digest is None:
+                    continue
+                original_path, original = originals.setdefault((stat.st_dev, digest), (path, stat))
+                if _inode(original) == _inode(stat):
+                    continue
+                link = path.with_name(f".{path.name}.link")
+                try:
+                    os.link(original_path, link)
+                    os.replace(link, path)
+                except OSError as e:
+                    link.unlink(missing_ok=True)
+                    _log.warning(f"Could not hardlink {path} to {original_path}: {e}")
+                    continue
+                refs[_inode(stat)] -= 1
+                if refs[_inode(stat)] == 0:
+                    saved += size
+                refs[_inode(original)] += 1
+                files[i] = (path, original)
+                self._counters["deduplicated_files"] += 1
+        self._counters["deduplicated_bytes"] += saved
+        return saved
+
+    def collect(self) -> dict:
+        """Run one expiry, deduplication and quota pass now; returns its summary."""
+        with self._lock:
+            start_time = time.time()
+            protected = {self._workspace_of(path) for path in self.in_use()}
+            refs = Counter()
+            sizes = {}
+            entries = []
+            for workspace in self._workspaces():
+                files = self._files(workspace)
+                for _, stat in files:
+                    refs[_inode(stat)] += 1
+                    sizes[_inode(stat)] = stat.st_size
+                entries.append([self._last_access(workspace, files), workspace, files])
+            entries.sort(key=lambda entry: entry[0])
+            total = sum(sizes.values())
+
+            kept = []
+            expired = evicted = 0
+            for entry in entries:
+                if entry[1] not in protected and start_time - entry[0] > self.ttl_seconds:
+                    total -= self._remove(entry, refs)
+                    expired += 1
+                    _log.info(f"Removed expired workspace {entry[1].name}")
+                else:
+                    kept.append(entry)
+
+            # Young folders may still be receiving an upload; leave them alone.
+            settled = [entry for entry in kept
+                       if entry[1] not in protected and start_time - entry[0] >= MIN_WORKSPACE_AGE_SECONDS]
+            for last_access, workspace, _ in settled:
+                # Relinking touches the folder; pin its last access first.
+                marker = workspace / ACCESS_MARKER
+                if workspace.is_dir() and not marker.exists():
+                    marker.touch()
+                    os.utime(marker, (last_access, last_access))
+            saved = self._dedupe(settled, refs)
+            total -= saved
+
+            for entry in kept:
+                if total <= self.max_bytes:
+                    break
+                if entry[1] in protected or start_time - entry[0] < MIN_WORKSPACE_AGE_SECONDS:
+                    continue
+                total -= self._remove(entry, refs)
+                evicted += 1
+                _log.info(f"Evicted workspace {entry[1].name} to stay under {self.max_bytes} bytes")
+
+            self._digests = {key: digest for key, digest in self._digests.items() if refs[key[:2]] > 0}
+            self._counters["runs"] += 1
+            self._counters["expired"] += expired
+            self._counters["evicted"] += evicted
+            self._last_run = {
+                "time": start_time,
+                "seconds": time.time() - start_time,
+                "workspaces": len(entries) - expired - evicted,
+                "bytes": total,
+                "expired": expired,
+                "evicted": evicted,
+                "deduplicated_bytes": saved,
+            }
+            return dict(self._last_run)
+
+    def stats(self) -> dict:
+        """Disk use per root (hardlinked files counted once), free space and collector counters."""
+        roots = {}
+        seen = set()
+        apparent = 0
+        for root in self.roots:
+            workspaces = 0
+            used = 0
+            if root.is_dir():
+                for workspace in root.iterdir():
+                    workspaces += 1
+                    for _, stat in self._files(workspace):
+                        apparent += stat.st_size
+                        if _inode(stat) not in seen:
+                            seen.add(_inode(stat))
+                            used += stat.st_size
+            roots[str(root)] = {"workspaces": workspaces, "bytes": used}
+        disk = shutil.disk_usage(next((root for root in self.roots if root.is_dir()), Path.cwd()))
+        with self._lock:
+            return {
+                "roots": roots,
+                "bytes": sum(root["bytes"] for root in roots.values()),
+                "apparent_bytes": apparent,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "disk_total_bytes": disk.total,
+                "disk_free_bytes": disk.free,
+                **self._counters,
+                "last_run": self._last_run,
+            }
@@ -0,0 +1,55 @@
+import pytest
+
+from src import formulacache
+from src.formulacache import FormulaCache, crop_hash
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(formulacache.time, "time", lambda: now[0])
+    return now
+
+
+def test_crop_hash_depends_only_on_the_bytes(tmp_path):
+    (tmp_path / "a.png").write_bytes(b"crop")
+    (tmp_path / "b.png").write_bytes(b"crop")
+    (tmp_path / "c.png").write_bytes(b"other crop")
+    assert crop_hash(tmp_path / "a.png") == crop_hash(tmp_path / "b.png") != crop_hash(tmp_path / "c.png")
+
+
+def test_hits_and_misses_are_counted_across_workers(tmp_path, clock):
+    db_path = tmp_path / "formulas.sqlite3"
+    worker, server = FormulaCache(db_path=db_path), FormulaCache(db_path=db_path)
+    worker.put_many({"h1": "x^2", "h2": r"\frac{a}{b}"})
+
+    assert worker.get_many(["h1", "h2", "h3"]) == {"h1": "x^2", "h2": r"\frac{a}{b}"}
+    stats = server.stats()
+    assert (stats["entries"], stats["hits"], stats["misses"]) == (2, 2, 1)
+    assert stats["hit_ratio"] == pytest.approx(2 / 3)
+
+
+def test_least_recently_used_formulas_are_evicted(tmp_path, clock):
+    cache = FormulaCache(db_path=tmp_path / "formulas.sqlite3", max_entries=2)
+    cache.put_many({"h1": "a"})
+    clock[0] += 1
+    cache.put_many({"h2": "b"})
+    clock[0] += 1
+    cache.get_many(["h1"])
+    clock[0] += 1
+    cache.put_many({"h3": "c"})
+
+    assert cache.get_many(["h1", "h2", "h3"]) == {"h1": "a", "h3": "c"}
+    assert cache.stats()["evictions"] == 1
+
+
+def test_warm_start_loads_the_most_used_formulas(tmp_path, clock, monkeypatch):
+    monkeypatch.setattr(formulacache, "WARM_START_ENTRIES", 1)
+    db_path = tmp_path / "formulas.sqlite3"
+    cache = FormulaCache(db_path=db_path)
+    cache.put_many({"h1": "a", "h2": "b"})
+    cache.get_many(["h2"])
+
+    warm = FormulaCache(db_path=db_path, warm_start=True)
+    assert warm._memory == {"h2": "b"}
+    assert warm.get_many(["h2"]) == {"h2": "b"}
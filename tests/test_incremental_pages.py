@@ -0,0 +1,88 @@
+import json
+
+import pytest
+
+main = pytest.importorskip("main")
+
+from src import notesconverter
+from src.pagerange import join_pages
+
+PAGES_V1 = {
+    1: "## Introduction\n\nWhat the course covers.",
+    2: "## Vectors\n\nA vector has a length and a direction.",
+    3: "## Matrices\n\nA matrix is a grid of numbers.",
+    4: "## Summary\n\nVectors and matrices.",
+}
+# The re-upload: one corrected slide.
+PAGES_V2 = {**PAGES_V1, 3: "## Matrices\n\nA matrix is a rectangular grid of numbers."}
+
+
+@pytest.fixture
+def fake_models(monkeypatch):
+    """
+    Docling, Pix2Text, Gemini and the LLMs replaced by deterministic fakes.
+    Returns the document being "converted", the page ranges Docling was
+    asked for and the chunks sent to the LLM.
+    """
+    document = {}
+    converted = []
+    rewritten = []
+
+    def convert(input_path, output_dir, ocr=False, page_range=None):
+        first, last = page_range or (1, len(document))
+        converted.append((first, last))
+        output_dir.mkdir(parents=True, exist_ok=True)
+        md = output_dir / "lecture-with-image-refs.md"
+        md.write_text(join_pages({n: document[n] for n in range(first, last + 1)}, markers=True), encoding="utf-8")
+        return md
+
+    def rewrite_chunks(chunks, order_key="default", on_chunk=None):
+        rewritten.extend(chunks)
+        return [chunk.upper() for chunk in chunks]
+
+    def rewrite_whole(clean_md, order_key="default"):
+        rewritten.append(clean_md)
+        return clean_md.upper()
+
+    monkeypatch.setattr(main, "convert", convert)
+    monkeypatch.setattr(main, "count_pages", lambda input_path: len(document))
+    monkeypatch.setattr(main, "convert_formula_images", lambda text, path: text)
+    monkeypatch.setattr(main, "analyze_markdown_text", lambda text, base_dir: [])
+    monkeypatch.setattr(notesconverter, "rewrite_chunks", rewrite_chunks)
+    monkeypatch.setattr(notesconverter, "rewrite_whole", rewrite_whole)
+    return document, converted, rewritten
+
+
+def _run(tmp_path, name, reuse_pages=None):
+    workspace = tmp_path / name
+    workspace.mkdir()
+    output_md = workspace / "lecture.md"
+    main.run_conversion(str(tmp_path / "lecture.pdf"), str(output_md), workspace=str(workspace),
+                        use_ai=True, reuse_pages=reuse_pages)
+    with open(workspace / "page_markdown.json", "r", encoding="utf-8") as f:
+        pages = {int(page_no): text for page_no, text in json.load(f).items()}
+    return output_md.read_text(encoding="utf-8"), pages
+
+
+def test_reupload_converts_only_the_changed_page(fake_models, tmp_path):
+    document, converted, rewritten = fake_models
+    document.update(PAGES_V1)
+    _, cached_pages = _run(tmp_path, "first")
+    assert sorted(cached_pages) == [1, 2, 3, 4]
+
+    document.update(PAGES_V2)
+    converted.clear()
+    rewritten.clear()
+    reuse = {page_no: text for page_no, text in cached_pages.items() if page_no != 3}
+    incremental, converted_pages = _run(tmp_path, "incremental", reuse)
+    assert converted == [(3, 3)]
+    assert sorted(converted_pages) == [3]
+    # The rewrite sees one ordinary document, not one chunk per page.
+    assert len(rewritten) == 1
+    assert "<!-- page" not in rewritten[0]
+
+    converted.clear()
+    full, _ = _run(tmp_path, "full")
+    assert converted == [(1, 4)]
+    assert incremental == full
+    assert "A MATRIX IS A RECTANGULAR GRID OF NUMBERS." in full
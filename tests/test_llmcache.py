@@ -0,0 +1,71 @@
+import pytest
+
+from src import llmcache
+from src.llmcache import LLMResponseCache, response_key
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(llmcache.time, "time", lambda: now[0])
+    return now
+
+
+def test_key_covers_backend_model_temperature_and_prompt():
+    base = response_key("groq", "kimi-k2", 0.0, "Rewrite this.")
+    assert base == response_key("groq", "kimi-k2", 0, "Rewrite this.")
+    assert len({
+        base,
+        response_key("ollama", "kimi-k2", 0.0, "Rewrite this."),
+        response_key("groq", "qwen3", 0.0, "Rewrite this."),
+        response_key("groq", "kimi-k2", 0.2, "Rewrite this."),
+        response_key("groq", "kimi-k2", 0.0, "Rewrite that."),
+    }) == 5
+
+
+def test_lookup_returns_the_first_cached_key_in_order(tmp_path, clock):
+    cache = LLMResponseCache(db_path=tmp_path / "llm.sqlite3")
+    cache.put("fallback", "ollama", "qwen3", "from ollama")
+    cache.put("primary", "groq", "kimi-k2", "from groq")
+
+    assert cache.lookup(["primary", "fallback"]) == ("primary", "from groq")
+    assert cache.lookup(["missing", "fallback"]) == ("fallback", "from ollama")
+    assert cache.lookup(["missing"]) == (None, None)
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (2, 1)
+
+
+def test_entries_expire_after_the_ttl(tmp_path, clock):
+    cache = LLMResponseCache(db_path=tmp_path / "llm.sqlite3", ttl_seconds=60)
+    cache.put("key", "groq", "kimi-k2", "answer")
+    clock[0] += 59
+    assert cache.lookup(["key"]) == ("key", "answer")
+    clock[0] += 2
+    assert cache.lookup(["key"]) == (None, None)
+    cache.put("other", "groq", "kimi-k2", "answer")
+    assert cache.stats()["expired"] == 1
+
+
+def test_least_recently_used_responses_are_evicted_past_max_bytes(tmp_path, clock):
+    cache = LLMResponseCache(db_path=tmp_path / "llm.sqlite3", max_bytes=25)
+    cache.put("a", "groq", "kimi-k2", "x" * 10)
+    clock[0] += 1
+    cache.put("b", "groq", "kimi-k2", "x" * 10)
+    clock[0] += 1
+    cache.lookup(["a"])
+    clock[0] += 1
+    cache.put("c", "groq", "kimi-k2", "x" * 10)
+
+    assert cache.lookup(["b"]) == (None, None)
+    assert cache.lookup(["a"])[0] == "a" and cache.lookup(["c"])[0] == "c"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_workers_share_entries_and_counters(tmp_path, clock):
+    db_path = tmp_path / "llm.sqlite3"
+    worker, server = LLMResponseCache(db_path=db_path), LLMResponseCache(db_path=db_path)
+    worker.put("key", "groq", "kimi-k2", "answer")
+    assert server.lookup(["key"]) == ("key", "answer")
+    assert worker.stats()["hits"] == 1
+    assert server.delete(["key"]) == 1
+    assert worker.lookup(["key"]) == (None, None)
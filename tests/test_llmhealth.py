@@ -0,0 +1,107 @@
+import pytest
+
+from src import llmhealth
+from src.llmhealth import BackendHealth, FAILURE_THRESHOLD, BASE_COOLDOWN_SECONDS, is_rate_limited
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(llmhealth.time, "monotonic", lambda: now[0])
+    return now
+
+
+def _open(health):
+    for _ in range(FAILURE_THRESHOLD):
+        health.record_failure(RuntimeError("boom"), 0.1, permit=health.allow())
+
+
+def test_circuit_opens_after_consecutive_failures_and_skips_the_backend(clock):
+    health = BackendHealth("groq")
+    _open(health)
+    assert health.state() == "open"
+    assert health.allow() is None
+    assert health.counters["skipped"] == 1
+
+
+def test_half_open_lets_one_trial_through_and_its_success_closes(clock):
+    health = BackendHealth("groq")
+    _open(health)
+    clock[0] += BASE_COOLDOWN_SECONDS
+    trial = health.allow()
+    assert trial is not None and trial.trial
+    assert health.allow() is None
+    health.record_success(0.2, permit=trial)
+    assert health.state() == "closed"
+
+
+def test_failed_trial_reopens_with_a_longer_cooldown(clock):
+    health = BackendHealth("groq")
+    _open(health)
+    clock[0] += BASE_COOLDOWN_SECONDS
+    health.record_failure(RuntimeError("still down"), 0.1, permit=health.allow())
+    assert health.state() == "open"
+    clock[0] += BASE_COOLDOWN_SECONDS
+    assert health.state() == "open"
+    clock[0] += BASE_COOLDOWN_SECONDS
+    assert health.state() == "half-open"
+
+
+def test_only_the_trial_holder_settles_a_half_open_circuit(clock):
+    health = BackendHealth("groq")
+    straggler = health.allow()  # started while the circuit was closed, e.g. a hedge loser
+    _open(health)
+    clock[0] += BASE_COOLDOWN_SECONDS
+    trial = health.allow()
+
+    health.release(straggler)
+    assert health.allow() is None, "a cancelled straggler must not free the trial slot"
+    health.record_failure(RuntimeError("late"), 5.0, permit=straggler)
+    assert health.state() == "half-open"
+    health.record_success(0.1, permit=None)
+    assert health.state() == "half-open"
+
+    health.release(trial)
+    assert health.allow() is not None
+
+
+def test_rate_limit_opens_at_once_for_the_retry_after_time(clock):
+    class Response:
+        status_code = 429
+        headers = {"retry-after": "40"}
+
+    class RateLimited(Exception):
+        response = Response()
+
+    health = BackendHealth("gemini")
+    health.record_failure(RateLimited("slow down"), 0.1, permit=health.allow())
+    assert health.state() == "open"
+    assert health.counters["rate_limited"] == 1
+    clock[0] += 39
+    assert health.state() == "open"
+    clock[0] += 1
+    assert health.state() == "half-open"
+
+
+@pytest.mark.parametrize("error, expected", [
+    (type("RateLimitError", (Exception,), {})("quota"), True),
+    (Exception("Error code: 429 - Too Many Requests"), True),
+    (Exception("rate limit exceeded for model"), True),
+    (Exception("request 14290 failed"), False),
+    (Exception("answer took 429.5 ms and failed"), False),
+])
+def test_is_rate_limited(error, expected):
+    assert is_rate_limited(error) is expected
+
+
+def test_is_rate_limited_looks_through_wrapped_errors():
+    class RateLimitError(Exception):
+        pass
+
+    try:
+        try:
+            raise RateLimitError()
+        except RateLimitError as e:
+            raise ValueError("LLM call failed") from e
+    except ValueError as wrapped:
+        assert is_rate_limited(wrapped)
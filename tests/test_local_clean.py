@@ -0,0 +1,103 @@
+import random
+import re
+
+import pytest
+
+notesconverter = pytest.importorskip("src.notesconverter")
+
+
+# The step-by-step local_clean as it was before the single-scan rewrite.
+def _normalize_image_paths(md):
+    md = re.sub(r'!\[([^\]]*)\]\(([^)]+)\)', lambda m: f'![{m.group(1)}]({m.group(2).replace(chr(92), "/")})', md)
+    return re.sub(r'\[Image\]\(([^)]+)\)', lambda m: f'[Image]({m.group(1).replace(chr(92), "/")})', md)
+
+
+def _remove_placeholder_lines(md):
+    placeholder_tokens = {'screenshot', 'other', 'bar chart', 'chart', 'image', 'temp\\temp', 'temp/temp'}
+    keep = []
+    for ln in md.splitlines():
+        if ln.strip().lower() in placeholder_tokens:
+            continue
+        if re.fullmatch(r'\s*(screenshot|other|bar chart|chart)\s*', ln, flags=re.IGNORECASE):
+            continue
+        keep.append(ln)
+    return "\n".join(keep)
+
+
+def _collapse_consecutive_duplicates(md):
+    out, prev = [], None
+    for ln in md.splitlines():
+        if ln.strip() == prev:
+            continue
+        out.append(ln)
+        prev = ln.strip()
+    return "\n".join(out)
+
+
+def _dedupe_adjacent_identical_sections(md):
+    parts = re.split(r'(?m)^(#{1,6}\s.*)$', md)
+    out_parts, seen, i = [], set(), 0
+    while i < len(parts):
+        if parts[i].strip() == "":
+            out_parts.append(parts[i])
+            i += 1
+            continue
+        content = parts[i + 1] if (i + 1) < len(parts) else ""
+        key = parts[i].strip() + "::" + content.strip()[:200]
+        if key not in seen:
+            seen.add(key)
+            out_parts.extend([parts[i], content])
+        i += 2
+    return "".join(out_parts)
+
+
+def reference_clean(md_text):
+    md_text = _normalize_image_paths(md_text)
+    md_text = _remove_placeholder_lines(md_text)
+    md_text = _collapse_consecutive_duplicates(md_text)
+    md_text = _dedupe_adjacent_identical_sections(md_text)
+    md_text = re.sub(r'\n{3,}', '\n\n', md_text)
+    md_text = "\n".join([ln.rstrip() for ln in md_text.splitlines()])
+    return md_text.strip() + "\n"
+
+
+LINES = [
+    "", "", "", " ", "\t", "   ",
+    "# Title", "## Vectors", "## Vectors ", "### Matrices", "####### not a heading", "#no space",
+    "A vector has a length.", "A vector has a length.  ", "  A vector has a length.",
+    "Image", "image", " Chart ", "bar chart", "Screenshot", "other", "temp\\temp", "temp/temp", "Other things",
+    "![Image](figures\\chart-1.png)", "![](a\\b\\c.png)", "[Image](x\\y.png)", "See [Image](x\\y.png) here.",
+    "$$x = 1$$", "Inline $a_1$ math.", "- item", "- item", "| a | b |", "text with trailing tab\t",
+]
+
+
+def _random_document(rng):
+    lines = []
+    for _ in range(rng.randrange(60)):
+        if lines and rng.random() < 0.2:
+            # Repeat an earlier run of lines, as repeated slide headers do.
+            start = rng.randrange(len(lines))
+            lines.extend(lines[start:start + rng.randrange(1, 6)])
+        else:
+            lines.append(rng.choice(LINES))
+    text = "\n".join(lines)
+    return text + rng.choice(["", "\n", "\n\n", " \n", "\r\n"])
+
+
+def test_local_clean_matches_the_step_by_step_version():
+    rng = random.Random(2024)
+    for _ in range(5000):
+        md = _random_document(rng)
+        assert notesconverter.local_clean(md) == reference_clean(md), repr(md)
+
+
+@pytest.mark.parametrize("md", [
+    "",
+    "\n\n\n",
+    "## A\n\ntext\n\n## A\n\ntext\n",
+    "## A\n\ntext\n## B\n\nmore\n## A\n\ntext\n## B\n\nmore\n",
+    "line\nline\n line \n\n\n\nnext\n",
+    "Image\n![Image](a\\b.png)\nchart\n",
+])
+def test_local_clean_edge_cases(md):
+    assert notesconverter.local_clean(md) == reference_clean(md)
@@ -0,0 +1,37 @@
+import pytest
+
+pytest.importorskip("docling")
+
+from src.pdftomd import merge_shards
+
+
+def _shard(root, name, picture_bytes, formula_bytes):
+    """A shard folder as convert() leaves it for a PDF called "Lecture 3.pdf"."""
+    shard_dir = root / "shards" / name
+    (shard_dir / "formulas").mkdir(parents=True)
+    (shard_dir / "Lecture 3-picture-chart-1.png").write_bytes(picture_bytes)
+    (shard_dir / "formulas" / "formula_1.png").write_bytes(formula_bytes)
+    md = shard_dir / "Lecture 3-with-image-refs.md"
+    md.write_text(
+        f"## Shard {name}\n\n"
+        "![Image](Lecture%203-picture-chart-1.png)\n\n"
+        "![Formula](formulas/formula_1.png)\n",
+        encoding="utf-8",
+    )
+    return md
+
+
+def test_merge_renumbers_percent_encoded_links(tmp_path):
+    first = _shard(tmp_path, "00001-00002", b"picture one", b"formula one")
+    second = _shard(tmp_path, "00003-00004", b"picture two", b"formula two")
+
+    merged = merge_shards([first, second], tmp_path).read_text(encoding="utf-8")
+
+    shard_one, shard_two = merged.split("## Shard 00003-00004")
+    assert "![Image](Lecture%203-picture-chart-1.png)" in shard_one
+    assert "![Formula](formulas/formula_1.png)" in shard_one
+    assert "![Image](Lecture%203-picture-chart-2.png)" in shard_two
+    assert "![Formula](formulas/formula_2.png)" in shard_two
+    assert (tmp_path / "Lecture 3-picture-chart-1.png").read_bytes() == b"picture one"
+    assert (tmp_path / "Lecture 3-picture-chart-2.png").read_bytes() == b"picture two"
+    assert (tmp_path / "formulas" / "formula_2.png").read_bytes() == b"formula two"
@@ -0,0 +1,143 @@
+import asyncio
+
+import pytest
+
+notesconverter = pytest.importorskip("src.notesconverter")
+
+from src.llmcache import LLMResponseCache, response_key
+
+
+def _document(edit: str = "") -> str:
+    sections = []
+    for n in range(1, 25):
+        body = f"Topic {n} explained with the formula $x_{n} = {n}$. " * 12
+        if n == 9:
+            body += edit
+        sections.append(f"## Topic {n}\n\n{body.strip()}\n\n")
+    return "".join(sections)
+
+
+class EchoManager:
+    """LLMManager stand-in that answers every chunk with its own input, through a real response cache."""
+
+    orders = {"default": ["echo"]}
+
+    def __init__(self, cache: LLMResponseCache):
+        self.cache = cache
+        self.sent = []
+        self.loop = asyncio.new_event_loop()
+
+    def run(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    async def ainvoke_with_fallback(self, llm_instances, order, prompt):
+        key = response_key("echo", "echo-1", 0.0, prompt)
+        _, response = self.cache.lookup([key])
+        if response is None:
+            self.sent.append(prompt)
+            response = prompt.split("### BEGIN INPUT\n\n", 1)[1].split("\n\n### END INPUT", 1)[0]
+            self.cache.put(key, "echo", "echo-1", response)
+        return response
+
+    def discard_cached_response(self, prompt):
+        pass
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    mgr = EchoManager(LLMResponseCache(db_path=tmp_path / "llm.sqlite3"))
+    monkeypatch.setattr(notesconverter, "setup_llm_manager", lambda: (mgr, {"echo": None}))
+    yield mgr
+    mgr.loop.close()
+
+
+def test_chunks_are_lossless_and_bounded():
+    md = _document()
+    chunks = notesconverter.split_markdown_sections(md)
+    assert "".join(chunks) == md
+    assert len(chunks) > 2
+    assert all(len(chunk) <= notesconverter.CHUNK_MAX_CHARS for chunk in chunks)
+
+
+def test_editing_one_section_requeries_only_its_chunk(manager):
+    original = notesconverter.rewrite_markdown(_document())
+    first_misses = manager.cache.stats()["misses"]
+    assert first_misses == len(manager.sent) > 2
+
+    edited = notesconverter.rewrite_markdown(_document(edit="One more formula: $y = 2x$."))
+    assert manager.cache.stats()["misses"] - first_misses == 1
+    assert "One more formula: $y = 2x$." in edited
+    assert "One more formula" not in original
+
+
+def test_short_document_gets_the_whole_document_prompt(manager):
+    md = "## Vectors\n\nA vector $v$ has a length.\n\n![Image](figure-1.png)\n"
+    result = notesconverter.rewrite_markdown(md)
+
+    (prompt,) = manager.sent
+    assert prompt == notesconverter.prepare_llm_prompt(notesconverter.local_clean(md))
+    assert "one part of a longer document" not in prompt
+    assert "![Image](figure-1.png)" in prompt
+    assert result == notesconverter.local_clean(md)
+
+
+def test_chunk_prompt_does_not_ask_for_image_captions():
+    prompt = notesconverter.prepare_chunk_prompt("## Vectors\n\n__IMAGE_0__\n")
+    assert notesconverter.IMAGE_CAPTION_RULE not in prompt
+    assert notesconverter.IMAGE_TOKEN_RULE in prompt
+
+
+def test_placeholders_are_numbered_per_chunk_and_restored():
+    chunk = "## Vectors\n\n__MATH_INLINE_7__ and __IMAGE_3__, then __MATH_INLINE_7__ again.\n"
+    local, to_document = notesconverter.localize_placeholders(chunk)
+    assert local == "## Vectors\n\n__MATH_INLINE_0__ and __IMAGE_1__, then __MATH_INLINE_0__ again.\n"
+    assert notesconverter.restore_math_blocks(local, to_document) == chunk
+
+
+@pytest.mark.parametrize("output, valid", [
+    ("Rewritten: __MATH_INLINE_0__ beside __IMAGE_1__.", True),
+    ("Rewritten: __MATH_INLINE_0__ without the image.", False),
+    ("Rewritten: __MATH_INLINE_0__, __IMAGE_1__ and __MATH_INLINE_2__.", False),
+    ("", False),
+    (None, False),
+])
+def test_chunk_output_must_keep_every_placeholder(output, valid):
+    chunk = "__MATH_INLINE_0__ next to __IMAGE_1__"
+    assert notesconverter._chunk_output_is_valid(chunk, output) is valid
+
+
+def test_escaped_placeholders_are_unescaped_but_other_text_is_not():
+    text = r"See \_\_IMAGE\_2\_\_ and \_\_MATH\_INLINE\_0\_\_ in \_\_init\_\_2\_\_."
+    unescaped = notesconverter.ESCAPED_PLACEHOLDER_RE.sub(notesconverter._unescape_placeholder, text)
+    assert unescaped == r"See __IMAGE_2__ and __MATH_INLINE_0__ in \_\_init\_\_2\_\_."
+
+
+class DroppingManager(EchoManager):
+    """Escapes every placeholder, and loses the formulas of the chunk about `topic`."""
+
+    def __init__(self, cache, topic):
+        super().__init__(cache)
+        self.topic = topic
+        self.discarded = []
+
+    async def ainvoke_with_fallback(self, llm_instances, order, prompt):
+        response = await super().ainvoke_with_fallback(llm_instances, order, prompt)
+        if f"## {self.topic}\n" in response:
+            response = notesconverter.PLACEHOLDER_RE.sub("", response)
+        return response.replace("__", r"\_\_")
+
+    def discard_cached_response(self, prompt):
+        self.discarded.append(prompt)
+
+
+def test_chunks_that_lose_a_placeholder_keep_the_local_clean(tmp_path, monkeypatch):
+    mgr = DroppingManager(LLMResponseCache(db_path=tmp_path / "llm.sqlite3"), topic="Topic 9")
+    monkeypatch.setattr(notesconverter, "setup_llm_manager", lambda: (mgr, {"echo": None}))
+    try:
+        result = notesconverter.rewrite_markdown(_document())
+    finally:
+        mgr.loop.close()
+
+    assert result == notesconverter.local_clean(_document())
+    assert len(mgr.discarded) == 1 and "## Topic 9\n" in mgr.discarded[0]
+    assert "\\_" not in result
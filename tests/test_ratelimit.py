@@ -0,0 +1,72 @@
+import importlib
+
+import pytest
+
+from src import ratelimit
+from src.ratelimit import TokenBucket, SharedTokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Fake monotonic and wall clocks that only move when a caller sleeps."""
+    now = [1000.0]
+    slept = []
+
+    def sleep(seconds):
+        slept.append(seconds)
+        now[0] += seconds
+
+    monkeypatch.setattr(ratelimit.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(ratelimit.time, "time", lambda: now[0])
+    monkeypatch.setattr(ratelimit.time, "sleep", sleep)
+    return now, slept
+
+
+def test_token_bucket_allows_a_burst_then_paces(clock):
+    now, slept = clock
+    bucket = TokenBucket(60, burst=3)
+    for _ in range(3):
+        bucket.acquire()
+    assert slept == []
+    bucket.acquire()
+    assert sum(slept) == pytest.approx(1.0)
+
+
+def test_token_bucket_pause_holds_back_callers(clock):
+    now, slept = clock
+    bucket = TokenBucket(60, burst=3)
+    bucket.pause(10)
+    bucket.acquire()
+    assert sum(slept) >= 10
+
+
+def test_shared_bucket_is_one_quota_across_instances(clock, tmp_path):
+    now, slept = clock
+    db_path = tmp_path / "rate_limits.sqlite3"
+    first = SharedTokenBucket(60, burst=2, name="gemini", db_path=db_path)
+    second = SharedTokenBucket(60, burst=2, name="gemini", db_path=db_path)
+    first.acquire()
+    second.acquire()
+    assert slept == []
+    second.acquire()
+    assert sum(slept) == pytest.approx(1.0)
+
+
+def test_shared_bucket_pause_reaches_other_instances(clock, tmp_path):
+    now, slept = clock
+    db_path = tmp_path / "rate_limits.sqlite3"
+    first = SharedTokenBucket(60, burst=2, name="gemini", db_path=db_path)
+    other = SharedTokenBucket(60, burst=2, name="groq", db_path=db_path)
+    second = SharedTokenBucket(60, burst=2, name="gemini", db_path=db_path)
+    first.pause(30)
+    other.acquire()
+    assert slept == []
+    second.acquire()
+    assert sum(slept) >= 30
+
+
+def test_importing_image_analysis_opens_no_database(tmp_path, monkeypatch):
+    imagecaption = pytest.importorskip("src.imagecaption")
+    monkeypatch.chdir(tmp_path)
+    importlib.reload(imagecaption)
+    assert not (tmp_path / "cache").exists()
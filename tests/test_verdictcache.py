@@ -0,0 +1,73 @@
+import random
+import sqlite3
+
+import pytest
+
+verdictcache = pytest.importorskip("src.verdictcache")
+
+from src.verdictcache import VerdictCache, hamming_distance
+
+USEFUL = {"is_useful": True, "reason": "diagram"}
+
+
+def _signed(value: int) -> int:
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _flip(phash: int, bits: list) -> int:
+    value = phash & 0xFFFFFFFFFFFFFFFF
+    for bit in bits:
+        value ^= 1 << bit
+    return _signed(value)
+
+
+def test_near_lookup_matches_a_full_scan(tmp_path):
+    rng = random.Random(7)
+    cache = VerdictCache(db_path=tmp_path / "verdicts.sqlite3")
+    stored = {}
+    for n in range(300):
+        phash = _signed(rng.getrandbits(64))
+        stored[f"sha-{n}"] = phash
+        cache.store(f"sha-{n}", phash, {"is_useful": n % 2 == 0, "reason": f"image {n}"})
+
+    for n in range(300):
+        base = stored[f"sha-{rng.randrange(300)}"]
+        probe = _flip(base, rng.sample(range(64), rng.randrange(7)))
+        verdict, source = cache.lookup("unknown", probe)
+        nearest = min(stored, key=lambda sha: hamming_distance(probe, stored[sha]))
+        if hamming_distance(probe, stored[nearest]) <= cache.max_distance:
+            assert source == "cache-near"
+            assert verdict["reason"] == f"image {nearest.split('-')[1]}"
+        else:
+            assert verdict is None
+
+
+def test_verdicts_from_another_process_are_found(tmp_path):
+    db_path = tmp_path / "verdicts.sqlite3"
+    reader = VerdictCache(db_path=db_path)
+    VerdictCache(db_path=db_path).store("a", 0x0F0F, USEFUL)
+    assert reader.lookup("b", _flip(0x0F0F, [1, 40])) == (USEFUL, "cache-near")
+
+
+def test_least_recently_used_verdicts_are_evicted(tmp_path):
+    cache = VerdictCache(db_path=tmp_path / "verdicts.sqlite3", max_entries=2)
+    cache.store("a", None, USEFUL)
+    cache.store("b", None, USEFUL)
+    cache.lookup("a", None)
+    cache.store("c", None, USEFUL)
+    assert cache.lookup("a", None) == (USEFUL, "cache-exact")
+    assert cache.lookup("b", None) == (None, None)
+    assert cache.lookup("c", None) == (USEFUL, "cache-exact")
+
+
+def test_older_databases_are_upgraded(tmp_path):
+    db_path = tmp_path / "verdicts.sqlite3"
+    conn = sqlite3.connect(str(db_path))
+    conn.execute("CREATE TABLE verdicts (sha256 TEXT PRIMARY KEY, phash INTEGER,"
+                 " is_useful INTEGER NOT NULL, reason TEXT, created REAL)")
+    conn.execute("INSERT INTO verdicts VALUES ('a', ?, 1, 'diagram', 1.0)", (_signed(0xF << 60),))
+    conn.commit()
+    conn.close()
+
+    cache = VerdictCache(db_path=db_path)
+    assert cache.lookup("b", _flip(0xF << 60, [3])) == (USEFUL, "cache-near")
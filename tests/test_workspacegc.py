@@ -0,0 +1,76 @@
+import os
+import time
+
+from src.workspacegc import WorkspaceManager, ACCESS_MARKER, MIN_WORKSPACE_AGE_SECONDS
+
+HOUR = 3600
+
+
+def _workspace(root, name, age_seconds, files):
+    workspace = root / name
+    workspace.mkdir(parents=True)
+    for filename, data in files.items():
+        (workspace / filename).write_bytes(data)
+    marker = workspace / ACCESS_MARKER
+    marker.touch()
+    last_access = time.time() - age_seconds
+    os.utime(marker, (last_access, last_access))
+    return workspace
+
+
+def test_expired_workspaces_are_removed_unless_in_use(tmp_path):
+    root = tmp_path / "temp_sessions"
+    stale = _workspace(root, "stale", 10 * HOUR, {"lecture.pdf": b"old"})
+    running = _workspace(root, "running", 10 * HOUR, {"lecture.pdf": b"busy"})
+    fresh = _workspace(root, "fresh", 1 * HOUR, {"lecture.pdf": b"new"})
+    manager = WorkspaceManager([root], in_use=lambda: [running / "lecture.md"], ttl_seconds=5 * HOUR)
+
+    summary = manager.collect()
+
+    assert summary["expired"] == 1
+    assert not stale.exists()
+    assert running.exists() and fresh.exists()
+
+
+def test_quota_evicts_least_recently_used_first(tmp_path):
+    root = tmp_path / "temp"
+    oldest = _workspace(root, "oldest", 3 * HOUR, {"a.md": b"x" * 1000})
+    running = _workspace(root, "running", 2 * HOUR, {"b.md": b"x" * 1000})
+    newer = _workspace(root, "newer", 1 * HOUR, {"c.md": b"x" * 1000})
+    uploading = _workspace(root, "uploading", 0, {"d.md": b"x" * 1000})
+    manager = WorkspaceManager([root], in_use=lambda: [running], ttl_seconds=100 * HOUR, max_bytes=2500)
+
+    summary = manager.collect()
+
+    assert summary["evicted"] == 2
+    assert not oldest.exists() and not newer.exists()
+    assert running.exists(), "a workspace in use is never evicted"
+    assert uploading.exists(), f"workspaces younger than {MIN_WORKSPACE_AGE_SECONDS}s are never evicted"
+
+
+def test_identical_images_are_hardlinked_outside_running_jobs(tmp_path):
+    root = tmp_path / "temp_sessions"
+    first = _workspace(root, "first", 2 * HOUR, {"chart.png": b"same picture"})
+    second = _workspace(root, "second", 2 * HOUR, {"chart.png": b"same picture"})
+    running = _workspace(root, "running", 2 * HOUR, {"chart.png": b"same picture"})
+    manager = WorkspaceManager([root], in_use=lambda: [running], ttl_seconds=100 * HOUR)
+
+    summary = manager.collect()
+
+    assert summary["deduplicated_bytes"] == len(b"same picture")
+    assert os.path.samefile(first / "chart.png", second / "chart.png")
+    assert not os.path.samefile(first / "chart.png", running / "chart.png")
+    assert (second / "chart.png").read_bytes() == b"same picture"
+    # Relinking does not count as a use of the workspace.
+    assert time.time() - (second / ACCESS_MARKER).stat().st_mtime > HOUR
+
+
+def test_touch_marks_the_enclosing_workspace(tmp_path):
+    root = tmp_path / "temp"
+    workspace = _workspace(root, "session", 10 * HOUR, {"lecture.md": b"# Notes"})
+    manager = WorkspaceManager([root], ttl_seconds=5 * HOUR)
+
+    manager.touch(workspace / "lecture.md")
+    manager.collect()
+
+    assert workspace.exists()